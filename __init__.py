@@ -1,2 +1,19 @@
 from .cryptopro import CryptoPro, CryptoProError
-from .tinkoff import Tinkoff, TinkoffError
+from .tinkoff import Tinkoff, TinkoffError, Payment, PaymentStatus, Card, CardStatus, CardType, Client, CardRequest, RemovedCard
+from .journal import PayoutJournal
+from .ratelimit import RateLimiter, RateLimitError
+from .adaptive import AdaptiveLimiter, AdaptiveLimitError
+from .receiver import NotificationReceiver, NotificationVerifier
+from .transport import Transport, TransportError, RequestsTransport, Urllib3Transport, HTTP2Transport
+from .cache import SharedCache
+from .spawner import Spawner
+from .watcher import PaymentWatcher, HashRing
+from .metrics import Metrics
+from .registry import TinkoffRegistry
+from .signer import Signer, SignerError, CryptoProSigner, PooledSigner, RemoteSigner, FakeSigner, SignerServer, create_signer, register_signer
+from .scheduler import RequestScheduler, SchedulerError, call_options
+from .recorder import TrafficRecorder, ReplayTransport, TrafficReplayer, read_records
+from .audit import AuditLog
+from .profiler import SlowRequestProfiler
+from .presign import PresignedStore
+from .history import StatusHistory
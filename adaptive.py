@@ -0,0 +1,261 @@
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+OVERLOAD_STATUSES = frozenset((429, 502, 503, 504))
+# The bank may throttle with HTTP 200 and `Success: false`, these `ErrorCode`s mean a temporary
+# failure of the bank (use `functools.partial(is_overload, codes=...)` to change them)
+OVERLOAD_ERROR_CODES = frozenset(('9999',))
+
+
+class AdaptiveLimitError(Exception):
+    def __init__(self, message, code=-1):
+        super().__init__(message, code)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return '{}: {}'.format(self.code, self.message)
+
+
+def is_overload(error, codes=OVERLOAD_ERROR_CODES):
+    """
+    Checks whether an error (or any error in its chain) means that the other side is overloaded:
+    a timeout, a 429/5xx gateway status or a bank error with a throttling `ErrorCode`
+
+    Parameters
+    ----------
+    error[Exception]: an error
+    codes[iterable]: bank `ErrorCode`s which mean overload
+
+    Returns
+    -------
+    bool: the error is an overload one
+    """
+
+    while error is not None:
+        if isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__:
+            return True
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status is None:
+            status = getattr(error, 'status', None)
+        if status in OVERLOAD_STATUSES:
+            return True
+        code = getattr(error, 'code', None)
+        if code is not None and str(code) in codes:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limiter which adapts its limit to observed latency (AIMD)
+
+    The limit grows additively (by one per `limit` successful calls) while latency stays within
+    `tolerance` of the best recent latency, and it's multiplied by `backoff` when latency rises
+    or when an overload error (see `is_overload()`) is got. The best latency is a minimum over
+    the last one or two `baseline_window`s, so a lasting change of latency becomes the new baseline
+    instead of holding the limit at `min_limit`. The limit is decreased at most once
+    per observed latency, so a burst of slow calls gives a single decrease.
+
+    Methods
+    -------
+    slot()
+        get a context manager which holds a slot during a call
+    acquire()
+        wait for a free slot
+    release()
+        free a slot and report the call result
+    metrics()
+        get current limiter metrics
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, tolerance=2.0, backoff=0.5,
+                 smoothing=0.2, timeout=None, is_overload=is_overload, baseline_window=60.0):
+        """
+        Parameters
+        ----------
+        initial[int]: an initial limit
+        min_limit[int]: a minimum limit
+        max_limit[int]: a maximum limit
+        tolerance[float]: a latency to the best latency ratio which is considered as flat
+        backoff[float]: a multiplier of the limit on congestion
+        smoothing[float]: a weight of a new latency sample in the smoothed latency
+        timeout[float]: a maximum time to wait for a slot (unlimited by default)
+        is_overload[callable]: a function which checks whether an error means overload
+        baseline_window[float]: seconds after which the best latency is forgotten
+        """
+
+        assert 1 <= min_limit <= initial <= max_limit, 'Limits must be 1 <= min_limit <= initial <= max_limit'
+        assert 0 < backoff < 1, 'Backoff must be between 0 and 1'
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.timeout = timeout
+        self.is_overload = is_overload
+        self.baseline_window = baseline_window
+
+        self._condition = threading.Condition()
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._baseline = None
+        self._window_started = time.monotonic()
+        self._window_min = None
+        self._previous_min = None
+        self._latency = None
+        self._last_decrease = 0.0
+        self._decreases = 0
+
+    @property
+    def limit(self):
+        """
+        int: the current limit
+        """
+
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """
+        int: a number of calls in progress
+        """
+
+        return self._in_flight
+
+    def slot(self, timeout=None):
+        """
+        Returns a context manager which holds a slot and reports latency and errors of a call
+
+        Parameters
+        ----------
+        timeout[float]: a maximum time to wait for a slot
+
+        Returns
+        -------
+        context manager
+        """
+
+        return _Slot(self, timeout)
+
+    def acquire(self, timeout=None):
+        """
+        Waits for a free slot
+
+        Parameters
+        ----------
+        timeout[float]: a maximum time to wait (`timeout` of the limiter by default)
+
+        Raises
+        ------
+        AdaptiveLimitError: when a slot cannot be got in time
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_flight < int(self._limit), timeout):
+                raise AdaptiveLimitError('No free slots in {}s (limit {})'.format(timeout, self.limit))
+            self._in_flight += 1
+
+    def release(self, latency, error=None):
+        """
+        Frees a slot and adapts the limit
+
+        Parameters
+        ----------
+        latency[float]: a call duration in seconds
+        error[Exception]: an error of the call or None
+        """
+
+        with self._condition:
+            self._in_flight -= 1
+            limit = self._limit
+
+            if error is not None and self.is_overload(error):
+                self._decrease()
+            else:
+                self._update_baseline(latency)
+                if self._latency is None:
+                    self._latency = latency
+                else:
+                    self._latency += (latency - self._latency) * self.smoothing
+
+                if self._latency > self._baseline * self.tolerance:
+                    self._decrease()
+                else:
+                    self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+
+            if int(self._limit) != int(limit):
+                logger.debug('Concurrency limit is changed from %d to %d', limit, self._limit)
+            self._condition.notify_all()
+
+    def metrics(self):
+        """
+        Returns current limiter metrics
+
+        Returns
+        -------
+        dict: metrics:
+            - limit[int] - the current limit
+            - in_flight[int] - a number of calls in progress
+            - latency[float] - the smoothed latency
+            - baseline[float] - the best recent latency
+            - decreases[int] - a number of limit decreases
+        """
+
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'latency': self._latency,
+                'baseline': self._baseline,
+                'decreases': self._decreases,
+            }
+
+    def _update_baseline(self, latency):
+        # The baseline is a minimum of the current and the previous windows
+        now = time.monotonic()
+        if now - self._window_started >= self.baseline_window:
+            expired = now - self._window_started >= 2 * self.baseline_window
+            self._previous_min = None if expired else self._window_min
+            self._window_min = None
+            self._window_started = now
+        if self._window_min is None or latency < self._window_min:
+            self._window_min = latency
+        self._baseline = self._window_min if self._previous_min is None else min(self._previous_min,
+                                                                                   self._window_min)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or 0.0):
+            return
+        self._last_decrease = now
+        self._decreases += 1
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+
+
+class _Slot:
+    def __init__(self, limiter, timeout):
+        self.limiter = limiter
+        self.timeout = timeout
+        self.started = None
+
+    def __enter__(self):
+        self.limiter.acquire(self.timeout)
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.limiter.release(time.monotonic() - self.started, exc_value)
+
+
+__all__ = ('AdaptiveLimiter', 'AdaptiveLimitError', 'is_overload')
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+OVERFLOW_DROP = 'drop'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_BLOCK = 'block'
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK)
+
+# Seconds between warnings about dropped records
+DROP_WARNING_INTERVAL = 10.0
+
+
+class AuditLog:
+    """
+    A `Tinkoff` request hook which keeps an audit record of every request and response
+
+        audit = AuditLog('/var/log/tinkoff/audit.jsonl')
+        tinkoff = Tinkoff(terminal_key, cryptopro, hooks=[audit])
+
+    A request thread only puts a record into a bounded buffer, a background thread serializes
+    buffered records and writes them in batches to a JSONL file which is rotated by size.
+    When the buffer is full, a new record is dropped (`drop`, the default), the oldest one is dropped
+    (`drop_oldest`) or a request thread waits for space up to `block_timeout` seconds (`block`).
+    Dropped records are counted in `dropped` and reported by warnings at most every 10 seconds.
+    Buffered records are written on `close()` and at interpreter exit.
+
+    Methods
+    -------
+    flush()
+        write buffered records
+    close()
+        write buffered records and stop the writer
+    """
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backup_count=10, buffer_size=10000, batch_size=1000,
+                 flush_interval=1.0, overflow=OVERFLOW_DROP, block_timeout=1.0):
+        """
+        Parameters
+        ----------
+        path[str]: a JSONL file path
+        max_bytes[int]: a file size to rotate the file at (0 disables rotation)
+        backup_count[int]: a number of rotated files to keep (`path.1` is the newest one)
+        buffer_size[int]: a maximum number of buffered records
+        batch_size[int]: a number of buffered records which wakes the writer up before `flush_interval`
+        flush_interval[float]: seconds between writes
+        overflow[str]: a policy of a full buffer: `drop`, `drop_oldest` or `block`
+        block_timeout[float]: seconds to wait for space with `block` policy before a record is dropped
+        """
+
+        assert buffer_size > 0, 'Buffer size must be positive'
+        assert overflow in OVERFLOW_POLICIES, 'Unknown overflow policy {}'.format(overflow)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.batch_size = min(batch_size, buffer_size)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self.written = 0
+        self.dropped = 0
+
+        # `deque.append()` and `popleft()` are atomic. Free places of the buffer are counted by a semaphore
+        # (a bounded deque drops the oldest records itself), so concurrent requests never overfill it
+        self._buffer = deque(maxlen=buffer_size if overflow == OVERFLOW_DROP_OLDEST else None)
+        self._slots = threading.Semaphore(buffer_size) if overflow != OVERFLOW_DROP_OLDEST else None
+        self._wakeup = threading.Event()
+        self._drop_lock = threading.Lock()
+        self._drop_warned = None
+        self._flushed = threading.Condition()
+        self._flush_requests = 0
+        self._flush_done = 0
+        self._closed = False
+
+        self._file = open(path, 'ab')
+        self._size = self._file.tell()
+
+        self._thread = threading.Thread(target=self._run, name='tinkoff-audit', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __call__(self, record):
+        if self._closed:
+            self._drop()
+            return
+
+        buffer = self._buffer
+        if self._slots is None:
+            if len(buffer) >= self.buffer_size:
+                self._drop()
+        elif not self._slots.acquire(False):
+            # Places are freed by the writer only, so it's woken up at once
+            self._wakeup.set()
+            if (self.overflow == OVERFLOW_DROP or not self._slots.acquire(timeout=self.block_timeout)
+                    or self._closed):
+                self._drop()
+                return
+
+        buffer.append(record)
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self, timeout=None):
+        """
+        Writes records buffered before the call
+
+        Parameters
+        ----------
+        timeout[float]: seconds to wait for
+
+        Returns
+        -------
+        bool: records are written
+        """
+
+        with self._flushed:
+            self._flush_requests += 1
+            request = self._flush_requests
+            self._wakeup.set()
+            return self._flushed.wait_for(lambda: self._flush_done >= request or not self._thread.is_alive(),
+                                          timeout)
+
+    def close(self):
+        """
+        Writes buffered records, stops the writer and closes the file
+        """
+
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._wakeup.set()
+        self._thread.join()
+        # Records which are put while the writer is stopping
+        self._write()
+        self._file.close()
+        if self.dropped:
+            logger.warning('Audit log %s dropped %d records', self.path, self.dropped)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _drop(self):
+        with self._drop_lock:
+            self.dropped += 1
+            now = time.monotonic()
+            if self._drop_warned is not None and now - self._drop_warned < DROP_WARNING_INTERVAL:
+                return
+            self._drop_warned = now
+            dropped = self.dropped
+        logger.warning('Audit log %s is full, %d records are dropped', self.path, dropped)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._flushed:
+                flush_request = self._flush_requests
+            closed = self._closed
+
+            try:
+                self._write()
+            except Exception:
+                logger.exception('Cannot write audit log %s', self.path)
+
+            with self._flushed:
+                self._flush_done = flush_request
+                self._flushed.notify_all()
+            if closed:
+                return
+
+    def _write(self):
+        buffer = self._buffer
+        while buffer:
+            lines = []
+            while buffer and len(lines) < self.batch_size:
+                lines.append(self._format(buffer.popleft()))
+                if self._slots is not None:
+                    self._slots.release()
+
+            data = ''.join(lines).encode('utf-8')
+            if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self.written += len(lines)
+
+    def _format(self, record):
+        error = record['error']
+        return json.dumps({
+            'time': record['time'],
+            'terminal': record['terminal'],
+            'operation': record['operation'],
+            'method': record['method'],
+            'data': record['data'],
+            'status': record['status'],
+            'result': record['result'],
+            'sign_latency': round(record['sign_latency'], 6),
+            'latency': round(record['latency'], 6),
+            'response': record['response'],
+            'error': str(error) if error is not None else None,
+        }, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = '{}.{}'.format(self.path, index)
+                if os.path.exists(source):
+                    os.replace(source, '{}.{}'.format(self.path, index + 1))
+            os.replace(self.path, '{}.1'.format(self.path))
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'ab')
+        self._size = 0
+
+
+__all__ = ('AuditLog',)
@@ -0,0 +1,73 @@
+"""
+Compares memory usage of result objects with plain dicts
+
+Usage: python benchmarks/bench_results.py [count]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tinkoff import Card, Payment, CARD_STATUS_MAPPING, CARD_TYPE_MAPPING, PAYMENT_STATUS_MAPPING
+
+
+def card_dict(i):
+    return {
+        'card_id': i,
+        'type': 1,
+        'type_name': CARD_TYPE_MAPPING.get(1),
+        'pan': '1111 22** **** 4444',
+        'status': 'A',
+        'status_name': CARD_STATUS_MAPPING.get('A'),
+        'rebill_id': i,
+        'expires': '0220',
+        'is_active': True,
+    }
+
+
+def card_object(i):
+    return Card(i, 'A', type=1, pan='1111 22** **** 4444', rebill_id=i, expires='0220')
+
+
+def payment_dict(i):
+    return {
+        'payment_id': i,
+        'status': 'COMPLETED',
+        'status_name': PAYMENT_STATUS_MAPPING.get('COMPLETED'),
+    }
+
+
+def payment_object(i):
+    return Payment(i, 'COMPLETED')
+
+
+def measure(factory, count):
+    tracemalloc.start()
+    started = time.perf_counter()
+    items = [factory(i) for i in range(count)]
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return size, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    print('{:<16} {:>12} {:>14} {:>10}'.format('kind', 'MiB', 'bytes/record', 'seconds'))
+    for name, factory in (
+        ('card dict', card_dict),
+        ('card object', card_object),
+        ('payment dict', payment_dict),
+        ('payment object', payment_object),
+    ):
+        size, elapsed = measure(factory, count)
+        print('{:<16} {:>12.1f} {:>14.1f} {:>10.2f}'.format(name, size / 2 ** 20, size / count, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures throughput of signer backends with concurrent callers
+
+CryptoPro backends use fake `csptest` and `certmgr` scripts unless a real tools prefix
+and a container are given
+
+Usage: python benchmarks/bench_signer.py [concurrency] [seconds] [prefix] [container]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptopro import CryptoPro
+from signer import CryptoProSigner, PooledSigner, RemoteSigner, FakeSigner, SignerServer
+from tests.test_signer import CSPTEST, CERTMGR
+
+
+CONTENT = '1000001123456150000Phone=+79001234567|Email=x@y.rutest_key'
+
+
+def measure(signer, concurrency, duration):
+    signer.sign(CONTENT)
+    counts = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    def work(index):
+        while time.perf_counter() < deadline:
+            signer.sign(CONTENT)
+            counts[index] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(work, range(concurrency)))
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    prefix = sys.argv[3] if len(sys.argv) > 3 else None
+    container = sys.argv[4] if len(sys.argv) > 4 else '\\\\.\\HDIMAGE\\container'
+
+    directory = tempfile.TemporaryDirectory()
+    if prefix is None:
+        for name, content in (('csptest', CSPTEST), ('certmgr', CERTMGR)):
+            path = os.path.join(directory.name, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            os.chmod(path, 0o755)
+        prefix = directory.name
+
+    def cryptopro():
+        instance = CryptoPro(container_name=container, store_name='uMy')
+        instance.prefix = os.path.join(prefix, '')
+        return instance
+
+    server = SignerServer(FakeSigner(), os.path.join(directory.name, 'signer.sock'))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    backends = (
+        ('fake', FakeSigner()),
+        ('pooled fake', PooledSigner([FakeSigner() for _ in range(4)])),
+        ('remote fake', RemoteSigner(server.address)),
+        ('cryptopro', CryptoProSigner(cryptopro())),
+        ('pooled cryptopro', PooledSigner([CryptoProSigner(cryptopro()) for _ in range(4)])),
+    )
+
+    print('{:<18} {:>12}'.format('backend', 'signs/s'))
+    for name, signer in backends:
+        print('{:<18} {:>12.0f}'.format(name, measure(signer, concurrency, duration)))
+        signer.close()
+
+    server.shutdown()
+    directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
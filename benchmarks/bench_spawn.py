@@ -0,0 +1,59 @@
+"""
+Compares latency of spawning a command from a large process:
+`subprocess.run()`, `run_command()` (posix_spawn) and a `Spawner` helper
+
+The helper is started before the parent grows, like it should be in an application
+
+Usage: python benchmarks/bench_spawn.py [parent_mb] [runs]
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spawner import Spawner, run_command
+
+
+COMMAND = ['/bin/true']
+
+
+def measure(function, runs):
+    function()
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    spawner = Spawner()
+
+    # Touch every page, so the parent really has `size` MB of resident memory
+    ballast = bytearray(size * 1024 * 1024)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+
+    print('parent RSS: {} MB'.format(size))
+    print('{:<18} {:>10} {:>10}'.format('method', 'p50 ms', 'p99 ms'))
+    for name, function in (
+        ('subprocess.run', lambda: subprocess.run(COMMAND, stdout=subprocess.PIPE, stderr=subprocess.PIPE)),
+        ('posix_spawn', lambda: run_command(COMMAND)),
+        ('helper', lambda: spawner.run(COMMAND)),
+    ):
+        p50, p99 = measure(function, runs)
+        print('{:<18} {:>10.2f} {:>10.2f}'.format(name, p50 * 1000, p99 * 1000))
+
+    spawner.close()
+
+
+if __name__ == '__main__':
+    main()
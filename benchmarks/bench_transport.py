@@ -0,0 +1,137 @@
+"""
+Compares connection count and latency of transports under concurrent load against local stubs:
+an HTTP/1.1 one (for `RequestsTransport`) and an HTTP/2 one (for `HTTP2Transport`, requires h2)
+
+Usage: python benchmarks/bench_transport.py [concurrency] [requests] [delay_ms]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transport import RequestsTransport, HTTP2Transport
+
+
+BODY = json.dumps({'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}).encode()
+
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    def add(self):
+        with self.lock:
+            self.connections += 1
+
+
+def start_http1_stub(delay, counter):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            counter.add()
+            super().setup()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port, server.shutdown
+
+
+def start_http2_stub(delay, counter):
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    class Protocol(asyncio.Protocol):
+        def connection_made(self, transport):
+            counter.add()
+            self.transport = transport
+            self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+            self.connection.initiate_connection()
+            self.transport.write(self.connection.data_to_send())
+
+        def data_received(self, data):
+            for event in self.connection.receive_data(data):
+                if isinstance(event, h2.events.DataReceived):
+                    self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    asyncio.get_running_loop().call_later(delay, self.respond, event.stream_id)
+            self.transport.write(self.connection.data_to_send())
+
+        def respond(self, stream_id):
+            self.connection.send_headers(stream_id, [
+                (':status', '200'),
+                ('content-type', 'application/json'),
+                ('content-length', str(len(BODY))),
+            ])
+            self.connection.send_data(stream_id, BODY, end_stream=True)
+            self.transport.write(self.connection.data_to_send())
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(Protocol, '127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server.sockets[0].getsockname()[1], lambda: loop.call_soon_threadsafe(loop.stop)
+
+
+def run(transport, url, concurrency, count):
+    data = {'TerminalKey': 'test_key', 'PaymentId': '1', 'DigestValue': 'x' * 44, 'SignatureValue': 'x' * 88}
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    def call(_):
+        started = time.perf_counter()
+        transport.request('POST', url, data=data, headers=headers)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(call, range(count)))
+    elapsed = time.perf_counter() - started
+    transport.close()
+    return elapsed, latencies
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    delay = (int(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+
+    print('{:<10} {:>12} {:>10} {:>10} {:>10}'.format('transport', 'connections', 'req/s', 'p50 ms', 'p99 ms'))
+    for name, start_stub, factory in (
+        ('http/1.1', start_http1_stub, lambda: RequestsTransport(pool_size=concurrency)),
+        ('http/2', start_http2_stub, lambda: HTTP2Transport(max_connections=2, http1=False)),
+    ):
+        counter = Counter()
+        port, stop = start_stub(delay, counter)
+        url = 'http://127.0.0.1:{}/e2c/GetState'.format(port)
+        elapsed, latencies = run(factory(), url, concurrency, count)
+        stop()
+        print('{:<10} {:>12} {:>10.0f} {:>10.1f} {:>10.1f}'.format(
+            name, counter.connections, count / elapsed,
+            latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures client-side CPU time per request of transports against a local stub
+which runs in a separate process, so only the client's CPU time is counted
+
+Usage: python benchmarks/bench_transport_cpu.py [requests]
+"""
+
+import os
+import sys
+import json
+import time
+import multiprocessing
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transport import RequestsTransport, Urllib3Transport, HTTP2Transport, httpx
+
+
+BODY = json.dumps({'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port):
+    HTTPServer(('127.0.0.1', port.value), Handler).serve_forever()
+
+
+def run(transport, url, count):
+    data = {
+        'TerminalKey': 'test_key',
+        'PaymentId': '1',
+        'DigestValue': 'x' * 44,
+        'SignatureValue': 'x' * 88,
+        'X509SerialNumber': 'f' * 34,
+    }
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+    transport.request('POST', url, data=data, headers=headers)
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(count):
+        json.loads(transport.request('POST', url, data=data, headers=headers).content)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    transport.close()
+    return cpu, wall
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    port = multiprocessing.Value('i', 18765)
+    process = multiprocessing.Process(target=serve, args=(port,), daemon=True)
+    process.start()
+    time.sleep(0.5)
+    url = 'http://127.0.0.1:{}/e2c/GetState'.format(port.value)
+
+    transports = [
+        ('requests', RequestsTransport),
+        ('urllib3', Urllib3Transport),
+    ]
+    if httpx is not None:
+        transports.append(('httpx', HTTP2Transport))
+
+    print('{:<10} {:>16} {:>16}'.format('transport', 'cpu us/request', 'wall us/request'))
+    try:
+        for name, factory in transports:
+            cpu, wall = run(factory(), url, count)
+            print('{:<10} {:>16.1f} {:>16.1f}'.format(name, cpu / count * 1e6, wall / count * 1e6))
+    finally:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
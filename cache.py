@@ -0,0 +1,169 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCache:
+    """
+    A cache on a local disk shared by all processes of a host (SQLite in WAL mode)
+
+    Values are pickled and kept with a TTL. When the cache has more than `max_entries` entries,
+    the ones which expire first are evicted. Every process (and every forked child) uses its own
+    connection, SQLite locking makes concurrent readers and writers safe. Unpickling runs code,
+    so the file is created readable and writable by its owner only, and a file which is owned
+    by another user or writable by others is refused.
+
+    Methods
+    -------
+    get()
+        get a value by key
+    set()
+        set a value by key
+    delete()
+        delete a value by key
+    clear()
+        delete all values
+    """
+
+    def __init__(self, path, default_ttl=300, max_entries=100000, timeout=5.0):
+        """
+        Parameters
+        ----------
+        path[str]: a database file path
+        default_ttl[float]: a default time to live in seconds
+        max_entries[int]: a maximum number of entries
+        timeout[float]: seconds to wait for a lock held by another process
+        """
+
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+
+        with self._lock:
+            self._get_connection()
+
+    def get(self, key, default=None):
+        """
+        Returns a value by key
+
+        Parameters
+        ----------
+        key[str]: a key
+        default: a value to return when the key is missing or expired
+
+        Returns
+        -------
+        a cached value or `default`
+        """
+
+        with self._lock:
+            row = self._get_connection().execute(
+                'SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time.time())
+            ).fetchone()
+        if row is None:
+            return default
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.warning('Cannot load cached value %s: %s', key, e)
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Sets a value by key
+
+        Parameters
+        ----------
+        key[str]: a key
+        value: a picklable value
+        ttl[float]: a time to live in seconds (`default_ttl` by default)
+        """
+
+        expires = time.time() + (self.default_ttl if ttl is None else ttl)
+        content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', (key, content, expires)
+                )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(connection)
+
+    def delete(self, key):
+        """
+        Deletes a value by key
+
+        Parameters
+        ----------
+        key[str]: a key
+        """
+
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        """
+        Deletes all values
+        """
+
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute('DELETE FROM cache')
+
+    def _evict(self, connection):
+        with connection:
+            connection.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self.max_entries:
+                connection.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)',
+                    (count - self.max_entries,),
+                )
+                logger.debug('Evicted %d cache entries', count - self.max_entries)
+
+    def _get_connection(self):
+        # A connection inherited from a parent process must not be used
+        if self._connection is None or self._pid != os.getpid():
+            self._check_file()
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _check_file(self):
+        # SQLite creates the journal files with permissions of the database file
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            stat = os.fstat(fd)
+        finally:
+            os.close(fd)
+        # There are no owners and modes like these on Windows
+        if hasattr(os, 'getuid') and (stat.st_uid != os.getuid() or stat.st_mode & 0o022):
+            raise PermissionError('Cache file {} must be owned by the current user and not writable by others'
+                                  .format(self.path))
+
+
+__all__ = ('SharedCache',)
@@ -0,0 +1,186 @@
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+OPERATIONS = ('get_hash', 'get_sign', 'get_certificate_serial')
+
+
+class CapacityBenchmark:
+    """
+    Measures how many CryptoPro operations per second a host sustains
+
+    Every operation is run for `duration` seconds at every concurrency level (and with every payload
+    size for `get_hash` and `get_sign`). An operation saturates at the lowest concurrency which reaches
+    `saturation` of its best throughput: more simultaneous operations only add latency.
+
+    Methods
+    -------
+    run()
+        measure all operations
+    recommend_pool_size()
+        get a signer pool size for measured results
+    """
+
+    def __init__(self, cryptopro, concurrency=(1, 2, 4, 8, 16), sizes=(256, 4096), duration=2.0,
+                 operations=OPERATIONS, saturation=0.9):
+        """
+        Parameters
+        ----------
+        cryptopro[CryptoPro]: CryptoPro instance
+        concurrency[iterable]: numbers of simultaneous operations
+        sizes[iterable]: payload sizes in bytes
+        duration[float]: seconds to run an operation at every level
+        operations[iterable]: names of CryptoPro methods
+        saturation[float]: a share of the best throughput which is considered as saturated
+        """
+
+        for operation in operations:
+            assert operation in OPERATIONS, 'Unknown operation {}'.format(operation)
+
+        self.cryptopro = cryptopro
+        self.concurrency = sorted(set(concurrency))
+        self.sizes = sorted(set(sizes))
+        self.duration = duration
+        self.operations = tuple(operations)
+        self.saturation = saturation
+
+    def run(self):
+        """
+        Measures all operations
+
+        Returns
+        -------
+        list: results, dicts with keys:
+            - operation[str] - a CryptoPro method
+            - size[int] - a payload size (None for `get_certificate_serial`)
+            - concurrency[int] - a number of simultaneous operations
+            - count[int] - a number of successful operations
+            - errors[int] - a number of failed operations
+            - throughput[float] - successful operations per second
+            - p50[float] - a median latency in seconds
+            - p99[float] - a 99th percentile latency in seconds
+            - saturated[bool] - the concurrency is a saturation point of the operation
+        """
+
+        results = []
+        for operation in self.operations:
+            sizes = self.sizes if operation != 'get_certificate_serial' else (None,)
+            for size in sizes:
+                series = [self._measure(operation, size, x) for x in self.concurrency]
+                point = self._find_saturation(series)
+                for item in series:
+                    item['saturated'] = item['concurrency'] == point
+                results.extend(series)
+        return results
+
+    def recommend_pool_size(self, results):
+        """
+        Returns a signer pool size: the largest saturation point of `get_hash` and `get_sign`
+        (both of them are called for every request)
+
+        Parameters
+        ----------
+        results[list]: `run()` results
+
+        Returns
+        -------
+        int: a pool size (None when there are no measured operations)
+        """
+
+        points = [x['concurrency'] for x in results if x['saturated'] and x['operation'] != 'get_certificate_serial']
+        if not points:
+            points = [x['concurrency'] for x in results if x['saturated']]
+        return max(points) if points else None
+
+    def _measure(self, operation, size, concurrency):
+        method = getattr(self.cryptopro, operation)
+        args = (b'x' * size,) if size is not None else ()
+        lock = threading.Lock()
+        latencies = []
+        errors = [0]
+
+        def work(deadline):
+            while True:
+                started = time.perf_counter()
+                try:
+                    method(*args)
+                except Exception as e:
+                    logger.debug('%s is failed: %s', operation, e)
+                    with lock:
+                        errors[0] += 1
+                else:
+                    finished = time.perf_counter()
+                    with lock:
+                        latencies.append(finished - started)
+                if time.perf_counter() >= deadline:
+                    break
+
+        started = time.perf_counter()
+        deadline = started + self.duration
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(work, deadline) for _ in range(concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        result = {
+            'operation': operation,
+            'size': size,
+            'concurrency': concurrency,
+            'count': len(latencies),
+            'errors': errors[0],
+            'throughput': len(latencies) / elapsed,
+            'p50': latencies[len(latencies) // 2] if latencies else None,
+            'p99': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] if latencies else None,
+        }
+        logger.info('%s size=%s concurrency=%d: %.1f ops/s, %d errors',
+                    operation, size, concurrency, result['throughput'], result['errors'])
+        return result
+
+    def _find_saturation(self, series):
+        best = max(x['throughput'] for x in series)
+        if not best:
+            return None
+        for item in series:
+            if item['throughput'] >= best * self.saturation:
+                return item['concurrency']
+
+
+def format_results(results, pool_size):
+    """
+    Returns a text table of `CapacityBenchmark.run()` results
+
+    Parameters
+    ----------
+    results[list]: results
+    pool_size[int]: a recommended pool size
+
+    Returns
+    -------
+    str: a table
+    """
+
+    lines = ['{:<24} {:>6} {:>6} {:>8} {:>7} {:>10} {:>10}'.format(
+        'operation', 'size', 'conc', 'ops/s', 'errors', 'p50 ms', 'p99 ms',
+    )]
+    for item in results:
+        lines.append('{:<24} {:>6} {:>6} {:>8.1f} {:>7} {:>10} {:>10}{}'.format(
+            item['operation'],
+            '-' if item['size'] is None else item['size'],
+            item['concurrency'],
+            item['throughput'],
+            item['errors'],
+            '-' if item['p50'] is None else '{:.2f}'.format(item['p50'] * 1000),
+            '-' if item['p99'] is None else '{:.2f}'.format(item['p99'] * 1000),
+            '  <- saturation' if item['saturated'] else '',
+        ))
+    lines.append('recommended pool size: {}'.format('-' if pool_size is None else pool_size))
+    return '\n'.join(lines)
+
+
+__all__ = ('CapacityBenchmark', 'format_results')
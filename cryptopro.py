@@ -1,14 +1,36 @@
 import os
+import sys
+import time
+import random
+import argparse
+import threading
 import subprocess
 import tempfile
-import base64
+import binascii
 import re
+import collections
 import logging
 
+try:
+    from .spawner import run_command, is_collecting_usage
+except ImportError:
+    from spawner import run_command, is_collecting_usage
+
 
 logger = logging.getLogger(__name__)
 
 
+# Codes of errors which are caused by concurrent access to a container and pass by themselves
+TRANSIENT_ERROR_CODES = frozenset((
+    0x20,  # ERROR_SHARING_VIOLATION
+    0x21,  # ERROR_LOCK_VIOLATION
+    0xaa,  # ERROR_BUSY
+    0x5b4,  # ERROR_TIMEOUT
+    0x8010000a,  # SCARD_E_TIMEOUT
+    0x8010000b,  # SCARD_E_SHARING_VIOLATION
+))
+
+
 class CryptoProError(Exception):
     def __init__(self, message, code=-1):
         super().__init__(message, code)
@@ -18,12 +40,131 @@ class CryptoProError(Exception):
     def __str__(self):
         return '{}: {}'.format(self.code, self.message)
 
+    @property
+    def is_transient(self):
+        return self.code in TRANSIENT_ERROR_CODES
+
+
+class ContainerQueue:
+    """
+    A fair (first in, first out) queue of callers which use a container, at most `concurrency`
+    of them use it at once
+
+    Methods
+    -------
+    acquire()
+        wait for a turn
+    release()
+        give a turn to the next caller
+    """
+
+    def __init__(self, concurrency):
+        """
+        Parameters
+        ----------
+        concurrency[int]: a number of simultaneous callers
+        """
+
+        assert concurrency > 0, 'Concurrency must be positive'
+
+        self.concurrency = concurrency
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = collections.deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def acquire(self, timeout=None):
+        """
+        Waits for a turn
+
+        Parameters
+        ----------
+        timeout[float]: seconds to wait for (unlimited by default)
+
+        Returns
+        -------
+        bool: the turn is got
+        """
+
+        with self._lock:
+            if self._active < self.concurrency and not self._waiters:
+                self._active += 1
+                return True
+            event = threading.Event()
+            self._waiters.append(event)
+
+        if event.wait(timeout):
+            return True
+
+        with self._lock:
+            if event.is_set():
+                # The turn is given right after the timeout
+                return True
+            self._waiters.remove(event)
+            return False
+
+    def release(self):
+        """
+        Gives a turn to the next caller
+        """
+
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._active -= 1
+
+
+_container_queues = {}
+_container_queues_lock = threading.Lock()
+# (container name, concurrency) pairs which are already warned about
+_container_queues_warned = set()
+
+
+def get_container_queue(container_name, concurrency):
+    """
+    Returns a queue of a container shared by all `CryptoPro` instances of the process
+    (it's created with the concurrency of the first caller, a different one is warned about and ignored,
+    as separate queues of the same container would exceed both limits together)
+
+    Parameters
+    ----------
+    container_name[str]: a container name
+    concurrency[int]: a number of simultaneous callers
+
+    Returns
+    -------
+    ContainerQueue: a queue
+    """
+
+    with _container_queues_lock:
+        queue = _container_queues.get(container_name)
+        if queue is None:
+            queue = _container_queues[container_name] = ContainerQueue(concurrency)
+        elif queue.concurrency != concurrency and (container_name, concurrency) not in _container_queues_warned:
+            _container_queues_warned.add((container_name, concurrency))
+            logger.warning('Container %s is already used with concurrency %d, concurrency %d is ignored',
+                           container_name, queue.concurrency, concurrency)
+        return queue
+
 
 class CryptoPro:
     """
     A class for getting hashes, signatures and certificate numbers
     for secure connection client's system with Tinkoff bank's E2C
 
+    Methods are thread-safe: every call writes and reads its own uniquely named temporary files.
+
+    Too many simultaneous `csptest` processes on one container get busy or lock errors.
+    With `container_concurrency` at most that many hashes and signatures of a container
+    are generated at once in the process and other callers wait in a fair queue. An operation
+    which gets a transient error (see `CryptoProError.is_transient`) is repeated after a jittered
+    delay. Waiting in the queue and repeats of an operation take no longer than `max_wait` seconds.
+
     Methods
     -------
     get_hash()
@@ -43,7 +184,9 @@ class CryptoPro:
     prefix = '/opt/cprocsp/bin/amd64/'
     encoding = 'utf-8'
 
-    def __init__(self, container_name=None, store_name=None, encryption_provider=80, sign_algorithm='GOST12_256'):
+    def __init__(self, container_name=None, store_name=None, encryption_provider=80, sign_algorithm='GOST12_256',
+                 cache=None, serial_ttl=3600, spawner=None, container_concurrency=None, max_wait=5.0,
+                 retry_delay=0.05):
         """
         Parameters
         ----------
@@ -51,12 +194,24 @@ class CryptoPro:
         store_name[str]: a name of store where certificate is located (like 'uMy')
         encryption_provider[int]: an encryption provider (like 75, 80, ...)
         sign_algorithm[str]: an algorithm to use when generating a hash or a signature (like 'GOST12_256', 'GOST12_512', ...)
+        cache[SharedCache]: a cache to share a certificate serial between processes
+        serial_ttl[float]: seconds to keep a certificate serial in `cache`
+        spawner[Spawner]: a helper to run commands with (instead of spawning them from this process)
+        container_concurrency[int]: a number of simultaneous operations on the container (unlimited by default)
+        max_wait[float]: seconds to wait for the container and to repeat an operation after transient errors
+        retry_delay[float]: a base delay before a repeat (it's doubled with every repeat and jittered)
         """
 
         self.container_name = container_name
         self.store_name = store_name
         self.encryption_provider = encryption_provider
         self.sign_algorithm = sign_algorithm
+        self.cache = cache
+        self.serial_ttl = serial_ttl
+        self.spawner = spawner
+        self.container_concurrency = container_concurrency
+        self.max_wait = max_wait
+        self.retry_delay = retry_delay
 
     def get_hash(self, content):
         """
@@ -83,7 +238,7 @@ class CryptoPro:
         out_file_name = in_file_name + '.hash'
 
         try:
-            self._execute(
+            self._execute_on_container(
                 "csptest",
                 "-keyset",
                 "-hash", "%(sign_algorithm)s",
@@ -128,7 +283,7 @@ class CryptoPro:
         out_file_name = in_file_name + '.sign'
 
         try:
-            self._execute(
+            self._execute_on_container(
                 "csptest",
                 "-keyset",
                 "-sign", "%(sign_algorithm)s",
@@ -261,6 +416,26 @@ class CryptoPro:
         CryptoProError: when got an encryption error
         """
 
+        if self.cache is None:
+            return self._find_certificate_serial()
+
+        key = 'cryptopro:serial:{}:{}'.format(self.container_name, self.store_name)
+        serial = self.cache.get(key)
+        if serial is None:
+            serial = self._find_certificate_serial()
+            if serial is not None:
+                self.cache.set(key, serial, self.serial_ttl)
+        return serial
+
+    def _find_certificate_serial(self):
+        """
+        Finds a serial number of a certificate which is associated with `container_name`
+
+        Returns
+        -------
+        str: hex serial or None when not found
+        """
+
         code = None
         containers = self.get_containers()
         for item in containers:
@@ -298,7 +473,7 @@ class CryptoPro:
 
         if isinstance(value, str):
             value = value.encode(self.encoding)
-        return base64.b64encode(value).decode(self.encoding)
+        return binascii.b2a_base64(value, newline=False).decode('ascii')
 
     def _execute(self, command, *args, **kwargs):
         """
@@ -331,6 +506,51 @@ class CryptoPro:
 
         return output
 
+    def _execute_on_container(self, command, *args, **kwargs):
+        """
+        Returns a result of command execution which uses the container: waits for a turn
+        in the container queue and repeats the command after transient errors
+
+        Parameters
+        ----------
+        see `_execute()`
+
+        Returns
+        -------
+        bytes: a console output
+
+        Raises
+        ------
+        CryptoProError: when got a non-transient error or `max_wait` is exceeded
+        """
+
+        deadline = time.monotonic() + self.max_wait
+        queue = None
+        if self.container_concurrency:
+            queue = get_container_queue(self.container_name, self.container_concurrency)
+
+        attempt = 0
+        while True:
+            if queue is not None and not queue.acquire(max(deadline - time.monotonic(), 0)):
+                raise CryptoProError('Container is busy for {} seconds'.format(self.max_wait))
+
+            try:
+                return self._execute(command, *args, **kwargs)
+            except CryptoProError as e:
+                if not e.is_transient:
+                    raise
+                # Full jitter: repeats of concurrent callers don't hit the container at once again
+                delay = random.uniform(0, min(self.retry_delay * 2 ** attempt, 1.0))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                logger.info('Container is busy (%s), repeating %s in %.3fs', e, command, delay)
+            finally:
+                if queue is not None:
+                    queue.release()
+
+            time.sleep(delay)
+            attempt += 1
+
     def _proceed_command(self, command, *args):
         """
         Proceeds a command
@@ -349,6 +569,19 @@ class CryptoPro:
         CryptoProError: when got a non-zero result code
         """
 
+        if self.spawner is not None:
+            code, stdout, stderr = self.spawner.run([command, *args])
+            if code:
+                raise self._get_error(stderr)
+            return stdout
+
+        if is_collecting_usage():
+            # `run_command()` reports resource usage of the command (like a profiler needs)
+            code, stdout, stderr = run_command([command, *args])
+            if code:
+                raise self._get_error(stderr)
+            return stdout
+
         result = subprocess.run([command, *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         if result.returncode:
             raise self._get_error(result.stderr)
@@ -450,4 +683,64 @@ class CryptoPro:
         return CryptoProError(text, code)
 
 
+def main(argv=None):
+    """
+    Runs a command line tool:
+
+        python -m cryptopro bench [options]
+    """
+
+    try:
+        from .capacity import CapacityBenchmark, format_results
+    except ImportError:
+        from capacity import CapacityBenchmark, format_results
+
+    def numbers(value):
+        return [int(x) for x in value.split(',') if x]
+
+    parser = argparse.ArgumentParser(prog='python -m cryptopro')
+    parser.add_argument('--container', help='CryptoPro container name')
+    parser.add_argument('--store', default='uMy', help='CryptoPro certificate store name')
+    parser.add_argument('--provider', type=int, default=80, help='CryptoPro encryption provider')
+    parser.add_argument('--algorithm', default='GOST12_256', help='CryptoPro sign algorithm')
+    parser.add_argument('--prefix', default=CryptoPro.prefix, help='a directory of CryptoPro tools')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    bench = commands.add_parser('bench', help='measure signing capacity of the host')
+    bench.add_argument('--concurrency', type=numbers, default=[1, 2, 4, 8, 16],
+                       help='comma-separated numbers of simultaneous operations')
+    bench.add_argument('--sizes', type=numbers, default=[256, 4096], help='comma-separated payload sizes in bytes')
+    bench.add_argument('--duration', type=float, default=2.0, help='seconds to run an operation at every level')
+    bench.add_argument('--operations', default=','.join(('get_hash', 'get_sign', 'get_certificate_serial')),
+                       help='comma-separated operations to measure')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    cryptopro = CryptoPro(
+        container_name=args.container,
+        store_name=args.store,
+        encryption_provider=args.provider,
+        sign_algorithm=args.algorithm,
+    )
+    cryptopro.prefix = os.path.join(args.prefix, '')
+
+    benchmark = CapacityBenchmark(
+        cryptopro,
+        concurrency=args.concurrency,
+        sizes=args.sizes,
+        duration=args.duration,
+        operations=[x for x in args.operations.split(',') if x],
+    )
+    results = benchmark.run()
+    print(format_results(results, benchmark.recommend_pool_size(results)))
+    return 0 if all(x['count'] for x in results) else 1
+
+
 __all__ = ('CryptoPro', 'CryptoProError')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
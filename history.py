@@ -0,0 +1,445 @@
+import os
+import mmap
+import time
+import array
+import queue
+import atexit
+import struct
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+try:
+    from .tinkoff import PaymentStatus
+except ImportError:
+    from tinkoff import PaymentStatus
+
+
+logger = logging.getLogger(__name__)
+
+
+# Status codes are positions of statuses in `PaymentStatus`, new statuses must be appended to keep them stable
+STATUSES = tuple(PaymentStatus)
+STATUS_CODES = {x.value: i for i, x in enumerate(STATUSES)}
+
+CHUNK_MAGIC = b'TKSH'
+CHUNK_HEADER = struct.Struct('=4s4xQ')
+CHUNK_SUFFIX = '.chunk'
+
+HISTORY_OPERATIONS = ('Payment', 'GetState')
+
+
+class StatusHistory:
+    """
+    A compact columnar history of payment status transitions
+
+        history = StatusHistory('/var/lib/tinkoff/history')
+        tinkoff = Tinkoff(terminal_key, cryptopro, hooks=[history])
+        ...
+        history.percentiles(PaymentStatus.CHECKING)
+        history.stuck(PaymentStatus.COMPLETING, older_than=3600)
+
+    A transition is 17 bytes in three columns: `PaymentId` (int64), time (float64, Unix)
+    and a status code (int8). Only changes of a payment status are kept: polling a payment
+    in the same status adds nothing while the active chunk is not sealed (a repeat in a later
+    chunk is added and collapsed by queries, so memory of the check doesn't grow with history).
+    Rows are appended to an active chunk in memory which is sealed when it has `chunk_size` rows
+    (or on `flush()`). A sealed chunk is written once to its own file in `path` by a background thread
+    and memory-mapped, so a history larger than memory costs only page cache and a request thread
+    which seals a chunk never waits for the disk (queries read the chunk from memory until it's mapped).
+    Rows of the active chunk and of chunks waiting for the writer are lost on a crash.
+
+    Queries read chunks one by one in order of adding, the last row of every payment is carried
+    to the next chunk, so transitions of a payment are expected to be added in order of time
+    (rows of a chunk may be in any order). Queries are vectorised with NumPy when it's installed
+    and fall back to pure Python otherwise.
+
+    Methods
+    -------
+    add()
+        add a payment status
+    get()
+        get transitions of a payment
+    durations()
+        get seconds spent in a status
+    percentiles()
+        get percentiles of seconds spent in a status
+    stuck()
+        get payments which stay in a status too long
+    flush()
+        seal the active chunk and wait for chunk files to be written
+    close()
+        seal the active chunk and unmap chunks
+    """
+
+    def __init__(self, path=None, chunk_size=65536, operations=HISTORY_OPERATIONS):
+        """
+        Parameters
+        ----------
+        path[str]: a directory of chunk files (the history is kept in memory only when it's None)
+        chunk_size[int]: a number of rows in a chunk
+        operations[iterable]: operations which responses are added by the hook
+        """
+
+        assert chunk_size > 0, 'Chunk size must be positive'
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.operations = frozenset(operations)
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._readers = 0
+        self._chunks = []
+        self._maps = []
+        self._closed = False
+        self._reset_active()
+        self._sealed = queue.Queue()
+        self._writer = None
+        self._next_number = 0
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            for name in sorted(os.listdir(path)):
+                if name.endswith(CHUNK_SUFFIX):
+                    map_, columns = self._map_chunk(os.path.join(path, name))
+                    self._maps.append(map_)
+                    self._chunks.append(columns)
+                    # A chunk which is not written leaves a gap in numbers, so they are not counted
+                    self._next_number = int(name[:-len(CHUNK_SUFFIX)]) + 1
+            self._writer = threading.Thread(target=self._run, name='tinkoff-history', daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(x[0]) for x in self._chunks) + len(self._ids)
+
+    def __call__(self, record):
+        """
+        Adds a status from a request record of `Tinkoff` (see the `hooks` parameter)
+
+        Parameters
+        ----------
+        record[dict]: a request record
+        """
+
+        response = record['response']
+        if record['result'] != 'ok' or record['operation'] not in self.operations or not response:
+            return
+        if 'PaymentId' not in response or 'Status' not in response:
+            return
+        self.add(response['PaymentId'], response['Status'],
+                 record['time'] + record['sign_latency'] + record['latency'])
+
+    def add(self, payment_id, status, timestamp=None):
+        """
+        Adds a payment status, the same status as the last one is ignored
+
+        Parameters
+        ----------
+        payment_id[int]: `PaymentId`
+        status[str]: `Status` (an unknown one is kept as `UNKNOWN`)
+        timestamp[float]: a time of the status (Unix, now by default)
+
+        Returns
+        -------
+        bool: whether a transition is added
+        """
+
+        try:
+            payment_id = int(payment_id)
+        except (TypeError, ValueError):
+            logger.warning('Status of payment %r is not kept: PaymentId is not numeric', payment_id)
+            return False
+        code = STATUS_CODES.get(status, STATUS_CODES[PaymentStatus.UNKNOWN.value])
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._lock:
+            if self._closed:
+                raise ValueError('History is closed')
+            if self._last.get(payment_id) == code:
+                return False
+            self._last[payment_id] = code
+            self._ids.append(payment_id)
+            self._times.append(timestamp)
+            self._statuses.append(code)
+            if len(self._ids) >= self.chunk_size:
+                self._seal()
+        return True
+
+    def get(self, payment_id):
+        """
+        Returns transitions of a payment
+
+        Parameters
+        ----------
+        payment_id[int]: `PaymentId`
+
+        Returns
+        -------
+        list: tuples of `PaymentStatus` and a time (Unix) in order of time
+        """
+
+        payment_id = int(payment_id)
+        rows = []
+        with self._read_chunks() as chunks:
+            for ids, times, statuses in chunks:
+                if np is not None:
+                    indexes = np.flatnonzero(np.frombuffer(ids, dtype=np.int64) == payment_id).tolist()
+                else:
+                    indexes = [i for i, x in enumerate(ids) if x == payment_id]
+                rows.extend((float(times[i]), statuses[i]) for i in indexes)
+
+        rows.sort()
+        # A repeat of a status is added to a later chunk, it's collapsed to the first row
+        return [(STATUSES[code], time_) for i, (time_, code) in enumerate(rows) if not i or rows[i - 1][1] != code]
+
+    def durations(self, status):
+        """
+        Returns seconds spent in a status by payments which have left it
+
+        Parameters
+        ----------
+        status[str]: `Status`
+
+        Returns
+        -------
+        list: seconds of every stay in the status
+        """
+
+        code = STATUS_CODES[PaymentStatus(status).value]
+        durations = []
+        for (ids, times, statuses), _ in self._iter_windows():
+            if np is not None:
+                mask = (ids[1:] == ids[:-1]) & (statuses[:-1] == code)
+                durations.extend((times[1:][mask] - times[:-1][mask]).tolist())
+            else:
+                durations.extend(
+                    times[i + 1] - times[i]
+                    for i in range(len(ids) - 1)
+                    if statuses[i] == code and ids[i] == ids[i + 1]
+                )
+        return durations
+
+    def percentiles(self, status, percentiles=(50, 90, 99)):
+        """
+        Returns percentiles of seconds spent in a status by payments which have left it
+
+        Parameters
+        ----------
+        status[str]: `Status`
+        percentiles[iterable]: percentiles (from 0 to 100)
+
+        Returns
+        -------
+        dict: seconds by percentiles (None when no payment has left the status)
+        """
+
+        durations = self.durations(status)
+        if not durations:
+            return {x: None for x in percentiles}
+        if np is not None:
+            durations = np.sort(np.asarray(durations))
+        else:
+            durations.sort()
+        count = len(durations)
+        return {x: float(durations[min(int(count * x / 100), count - 1)]) for x in percentiles}
+
+    def stuck(self, status=PaymentStatus.COMPLETING, older_than=3600.0, now=None):
+        """
+        Returns payments which stay in a status too long
+
+        Parameters
+        ----------
+        status[str]: `Status`
+        older_than[float]: seconds in the status after which a payment is stuck
+        now[float]: a current time (Unix, now by default)
+
+        Returns
+        -------
+        list: sorted `PaymentId`s
+        """
+
+        code = STATUS_CODES[PaymentStatus(status).value]
+        deadline = (time.time() if now is None else now) - older_than
+        ids = times = statuses = ()
+        for _, (ids, times, statuses) in self._iter_windows():
+            pass
+        if np is not None and len(ids):
+            return ids[(statuses == code) & (times <= deadline)].tolist()
+        return [ids[i] for i in range(len(ids)) if statuses[i] == code and times[i] <= deadline]
+
+    def flush(self):
+        """
+        Seals the active chunk and waits until sealed chunks are written to chunk files
+        """
+
+        with self._lock:
+            if self._ids:
+                self._seal()
+        self._sealed.join()
+
+    def close(self):
+        """
+        Seals the active chunk and unmaps chunk files
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            if self._ids:
+                self._seal()
+            self._closed = True
+        if self._writer is not None:
+            atexit.unregister(self.close)
+            self._sealed.put(None)
+            self._writer.join()
+
+        with self._lock:
+            self._idle.wait_for(lambda: not self._readers)
+            # Views must be released before their maps are closed
+            for columns in self._chunks:
+                for column in columns:
+                    if isinstance(column, memoryview):
+                        column.release()
+            self._chunks = []
+            for map_ in self._maps:
+                map_.close()
+            self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _reset_active(self):
+        self._ids = array.array('q')
+        self._times = array.array('d')
+        self._statuses = array.array('b')
+        # The last status of every payment of the active chunk, so it's bounded by `chunk_size`
+        self._last = {}
+
+    def _seal(self):
+        columns = (self._ids, self._times, self._statuses)
+        self._reset_active()
+        self._chunks.append(columns)
+        if self.path is not None:
+            path = os.path.join(self.path, '{:08d}{}'.format(self._next_number, CHUNK_SUFFIX))
+            self._next_number += 1
+            self._sealed.put((len(self._chunks) - 1, path, columns))
+
+    def _run(self):
+        while True:
+            task = self._sealed.get()
+            try:
+                if task is None:
+                    return
+                index, path, columns = task
+                try:
+                    self._write_chunk(path, columns)
+                    map_, mapped = self._map_chunk(path)
+                except Exception:
+                    # The chunk stays in memory, so it's still queried until the history is closed
+                    logger.exception('Cannot write history chunk %s', path)
+                    continue
+                with self._lock:
+                    self._maps.append(map_)
+                    self._chunks[index] = mapped
+            finally:
+                self._sealed.task_done()
+
+    def _write_chunk(self, path, columns):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(columns[0])))
+            for column in columns:
+                column.tofile(f)
+        os.replace(temp_path, path)
+
+    def _map_chunk(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < CHUNK_HEADER.size:
+                raise ValueError('File {} is not a history chunk'.format(path))
+            map_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = CHUNK_HEADER.unpack_from(map_)
+        if magic != CHUNK_MAGIC or size != CHUNK_HEADER.size + count * 17:
+            map_.close()
+            raise ValueError('File {} is not a history chunk'.format(path))
+
+        view = memoryview(map_)
+        offset = CHUNK_HEADER.size
+        columns = []
+        for code, size in (('q', 8), ('d', 8), ('b', 1)):
+            columns.append(view[offset:offset + count * size].cast(code))
+            offset += count * size
+        view.release()
+        return map_, tuple(columns)
+
+    @contextmanager
+    def _read_chunks(self):
+        # Chunks are read outside the lock, `close()` waits for readers before it unmaps them
+        with self._lock:
+            chunks = [x for x in self._chunks if len(x[0])]
+            if self._ids:
+                # The active chunk is copied as it's appended to
+                chunks.append((array.array('q', self._ids), array.array('d', self._times),
+                               array.array('b', self._statuses)))
+            self._readers += 1
+        try:
+            yield chunks
+        finally:
+            with self._lock:
+                self._readers -= 1
+                self._idle.notify_all()
+
+    def _iter_windows(self):
+        # Yields rows of every chunk with the last row of every payment of previous chunks sorted
+        # by `PaymentId` and time, so transitions of a payment are adjacent, and the last rows
+        # of every payment after the chunk
+        if np is not None:
+            carry = (np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, np.int8))
+        else:
+            carry = ([], [], [])
+        with self._read_chunks() as chunks:
+            for chunk in chunks:
+                window = self._merge(carry, chunk)
+                carry = self._get_last_rows(window)
+                yield window, carry
+
+    def _merge(self, carry, chunk):
+        if np is not None:
+            ids, times, statuses = (
+                np.concatenate((carry[i], np.frombuffer(chunk[i], dtype=dtype)))
+                for i, dtype in enumerate((np.int64, np.float64, np.int8))
+            )
+            order = np.lexsort((times, ids))
+            ids, times, statuses = ids[order], times[order], statuses[order]
+            # A repeat of a status (added to a later chunk) is collapsed to the first row
+            keep = np.ones(len(ids), dtype=bool)
+            keep[1:] = (ids[1:] != ids[:-1]) | (statuses[1:] != statuses[:-1])
+            return ids[keep], times[keep], statuses[keep]
+
+        rows = sorted(zip(carry[0] + list(chunk[0]), carry[1] + list(chunk[1]), carry[2] + list(chunk[2])))
+        rows = [x for i, x in enumerate(rows) if not i or rows[i - 1][0] != x[0] or rows[i - 1][2] != x[2]]
+        return [x[0] for x in rows], [x[1] for x in rows], [x[2] for x in rows]
+
+    def _get_last_rows(self, window):
+        ids, times, statuses = window
+        if np is not None:
+            last = np.ones(len(ids), dtype=bool)
+            last[:-1] = ids[1:] != ids[:-1]
+            return ids[last], times[last], statuses[last]
+        indexes = [i for i in range(len(ids)) if i == len(ids) - 1 or ids[i] != ids[i + 1]]
+        return [ids[i] for i in indexes], [times[i] for i in indexes], [statuses[i] for i in indexes]
+
+
+__all__ = ('StatusHistory',)
@@ -0,0 +1,299 @@
+import sqlite3
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+STEP_PENDING = 'pending'
+STEP_INIT = 'init'
+STEP_PAYMENT = 'payment'
+
+
+class PayoutJournal:
+    """
+    A durable local journal of payouts which allows to resume an interrupted run
+    without sending the same `Init` or `Payment` twice
+
+    Records are kept in a SQLite database in WAL mode and indexed by `OrderId` and `PaymentId`.
+    An intent to send `Init` is committed before the request and a registered payment is
+    committed right after it, so an `Init` is never sent twice after a crash: an order which
+    intent has no registered payment is in doubt and must be checked (and discarded) by hand.
+    Status updates are buffered and committed in batches (group commit): a batch is committed
+    when it has `batch_size` records or when `flush_interval` seconds passed since the last commit.
+    Status updates of an uncommitted batch are lost on a crash.
+
+    Methods
+    -------
+    get()
+        get a journal entry by `OrderId`
+    find()
+        get a journal entry by `PaymentId`
+    try_record_intent()
+        record an intent to register a payment unless the order is already known
+    record_init()
+        record a registered payment
+    discard()
+        forget an order which payment is not registered
+    record_status()
+        record a payment status (and optionally a completed step)
+    flush()
+        commit buffered records
+    close()
+        commit buffered records and close the database
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        """
+        Parameters
+        ----------
+        path[str]: a database file path
+        batch_size[int]: a maximum number of status updates in a batch
+        flush_interval[float]: a maximum number of seconds between commits
+        """
+
+        assert batch_size > 0, 'Batch size must be positive'
+
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.RLock()
+        self._pending = []
+        self._by_order = {}
+        self._by_payment = {}
+        self._last_flush = time.monotonic()
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS payouts ('
+            'order_id TEXT, '
+            'payment_id, '
+            'step TEXT NOT NULL, '
+            'status TEXT, '
+            'url TEXT, '
+            'updated REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS payouts_order_id ON payouts (order_id)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS payouts_payment_id ON payouts (payment_id)')
+        # `PaymentId`s are kept as strings, the bank returns them so while callers may pass numbers
+        self._connection.execute(
+            "UPDATE payouts SET payment_id = CAST(payment_id AS TEXT) WHERE typeof(payment_id) = 'integer'"
+        )
+
+    def get(self, order_id):
+        """
+        Returns a journal entry by `OrderId`
+
+        Parameters
+        ----------
+        order_id[str]: `OrderId`
+
+        Returns
+        -------
+        dict: journal entry (or None when not found):
+            - order_id[str] - `OrderId`
+            - payment_id[str] - `PaymentId` (None when the payment is not registered yet)
+            - step[str] - the last completed step (`pending`, `init` or `payment`)
+            - status[str] - the last known `Status`
+            - url[str] - `PaymentURL`
+            - updated[float] - a timestamp of the last update
+        """
+
+        with self._lock:
+            if order_id in self._by_order:
+                return dict(self._by_order[order_id])
+            return self._select('order_id', order_id)
+
+    def find(self, payment_id):
+        """
+        Returns a journal entry by `PaymentId`
+
+        Parameters
+        ----------
+        payment_id[int]: `PaymentId`
+
+        Returns
+        -------
+        dict: journal entry (see `get()`) or None when not found
+        """
+
+        payment_id = str(payment_id)
+        with self._lock:
+            if payment_id in self._by_payment:
+                return dict(self._by_payment[payment_id])
+            return self._select('payment_id', payment_id)
+
+    def try_record_intent(self, order_id):
+        """
+        Records an intent to register a payment with `Init`, the record is committed at once.
+        The check and the record are made under the journal lock, so of concurrent callers with
+        the same `OrderId` only one records the intent
+
+        Parameters
+        ----------
+        order_id[str]: `OrderId`
+
+        Returns
+        -------
+        dict: the existing journal entry (see `get()`) or None when the intent is recorded
+        """
+
+        entry = {
+            'order_id': order_id,
+            'payment_id': None,
+            'step': STEP_PENDING,
+            'status': None,
+            'url': None,
+            'updated': time.time(),
+        }
+        with self._lock:
+            existing = self.get(order_id)
+            if existing is not None:
+                return existing
+            self._by_order[order_id] = entry
+            self._pending.append(entry)
+            self.flush()
+        return None
+
+    def record_init(self, order_id, payment_id, status, url=None):
+        """
+        Records a payment registered with `Init`, the record is committed at once
+
+        Parameters
+        ----------
+        order_id[str]: `OrderId`
+        payment_id[int]: `PaymentId`
+        status[str]: `Status`
+        url[str]: `PaymentURL`
+        """
+
+        entry = {
+            'order_id': order_id,
+            'payment_id': str(payment_id),
+            'step': STEP_INIT,
+            'status': status,
+            'url': url,
+            'updated': time.time(),
+        }
+        with self._lock:
+            self._by_order[order_id] = entry
+            self._by_payment[entry['payment_id']] = entry
+            self._pending.append(entry)
+            self.flush()
+
+    def discard(self, order_id):
+        """
+        Forgets an order, so `Init` can be sent for it again (for example, when an order in doubt
+        is checked to be not registered by the bank), the change is committed at once
+
+        Parameters
+        ----------
+        order_id[str]: `OrderId`
+        """
+
+        with self._lock:
+            self.flush()
+            self._connection.execute('DELETE FROM payouts WHERE order_id = ?', (order_id,))
+
+    def record_status(self, payment_id, status, step=None):
+        """
+        Records the last known payment status
+
+        Parameters
+        ----------
+        payment_id[int]: `PaymentId`
+        status[str]: `Status`
+        step[str]: a completed step (`payment`) or None to keep the current one
+        """
+
+        payment_id = str(payment_id)
+        with self._lock:
+            entry = self.find(payment_id)
+            if entry is None:
+                entry = {
+                    'order_id': None,
+                    'payment_id': payment_id,
+                    'step': STEP_INIT,
+                    'url': None,
+                }
+            entry['status'] = status
+            entry['updated'] = time.time()
+            if step is not None:
+                entry['step'] = step
+
+            if entry['order_id'] is not None:
+                self._by_order[entry['order_id']] = entry
+            self._by_payment[payment_id] = entry
+            self._pending.append(entry)
+            self._flush_if_needed()
+
+    def flush(self):
+        """
+        Commits buffered records in a single transaction
+        """
+
+        with self._lock:
+            if self._pending:
+                pending = self._pending
+                self._pending = []
+                self._write(pending)
+                logger.debug('Journal committed %d records', len(pending))
+            self._by_order.clear()
+            self._by_payment.clear()
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Commits buffered records and closes the database
+        """
+
+        with self._lock:
+            self.flush()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _flush_if_needed(self):
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write(self, entries):
+        cursor = self._connection.cursor()
+        cursor.execute('BEGIN')
+        try:
+            for entry in entries:
+                if entry['order_id'] is not None:
+                    cursor.execute('DELETE FROM payouts WHERE order_id = ?', (entry['order_id'],))
+                else:
+                    cursor.execute('DELETE FROM payouts WHERE payment_id = ?', (entry['payment_id'],))
+                cursor.execute(
+                    'INSERT INTO payouts (order_id, payment_id, step, status, url, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                    (entry['order_id'], entry['payment_id'], entry['step'], entry['status'], entry['url'],
+                     entry['updated']),
+                )
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+    def _select(self, field, value):
+        row = self._connection.execute(
+            'SELECT order_id, payment_id, step, status, url, updated FROM payouts WHERE {} = ? '
+            'ORDER BY updated DESC LIMIT 1'.format(field),
+            (value,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('order_id', 'payment_id', 'step', 'status', 'url', 'updated'), row))
+
+
+__all__ = ('PayoutJournal',)
@@ -0,0 +1,134 @@
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    An in-memory metrics sink: counters and value summaries by name and tags (like a terminal key)
+
+    It may be shared by many `Tinkoff` instances, any object with the same `increment()`
+    and `observe()` methods may be used instead (for example, an adapter to StatsD or Prometheus).
+
+    Methods
+    -------
+    increment()
+        add to a counter
+    observe()
+        add a value (like a latency) to a summary
+    get()
+        get a counter or a summary
+    snapshot()
+        get all counters and summaries
+    reset()
+        forget all metrics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+
+    def increment(self, name, value=1, **tags):
+        """
+        Adds to a counter
+
+        Parameters
+        ----------
+        name[str]: a metric name
+        value[int]: an increment
+        **tags: tags of the metric
+        """
+
+        key = self._get_key(name, tags)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **tags):
+        """
+        Adds a value to a summary
+
+        Parameters
+        ----------
+        name[str]: a metric name
+        value[float]: a value
+        **tags: tags of the metric
+        """
+
+        key = self._get_key(name, tags)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = [1, value, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                if value < summary[2]:
+                    summary[2] = value
+                if value > summary[3]:
+                    summary[3] = value
+
+    def get(self, name, **tags):
+        """
+        Returns a counter or a summary
+
+        Parameters
+        ----------
+        name[str]: a metric name
+        **tags: tags of the metric
+
+        Returns
+        -------
+        int: a counter value
+        or
+        dict: a summary with `count`, `sum`, `min` and `max` keys
+        or
+        None: when there is no such metric
+        """
+
+        key = self._get_key(name, tags)
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            if key in self._summaries:
+                return self._format_summary(self._summaries[key])
+        return None
+
+    def snapshot(self):
+        """
+        Returns all counters and summaries
+
+        Returns
+        -------
+        list: dicts with `name`, `tags` and `value` keys
+        """
+
+        with self._lock:
+            items = [(k, v) for k, v in self._counters.items()]
+            items.extend((k, self._format_summary(v)) for k, v in self._summaries.items())
+        return [{'name': k[0], 'tags': dict(k[1]), 'value': v} for k, v in items]
+
+    def reset(self):
+        """
+        Forgets all metrics
+        """
+
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def _get_key(self, name, tags):
+        return name, tuple(sorted(tags.items()))
+
+    def _format_summary(self, summary):
+        return {
+            'count': summary[0],
+            'sum': summary[1],
+            'min': summary[2],
+            'max': summary[3],
+        }
+
+
+__all__ = ('Metrics',)
@@ -0,0 +1,140 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class PresignedStore:
+    """
+    A bounded store of signatures computed in advance (for example, of `GetState` requests
+    of payments which are polled soon, see `Tinkoff.presign()`)
+
+    A signature is kept by its signing string for `ttl` seconds and is used once: a request
+    with the same signing string takes it instead of signing. When the store is full,
+    the oldest signatures are evicted.
+
+    Methods
+    -------
+    put()
+        keep a signature
+    take()
+        get a signature and forget it
+    stats()
+        get hit and miss counters
+    """
+
+    def __init__(self, max_entries=10000, ttl=60.0, operations=('GetState',), metrics=None):
+        """
+        Parameters
+        ----------
+        max_entries[int]: a maximum number of kept signatures
+        ttl[float]: seconds to keep a signature
+        operations[iterable]: operations which requests look for signatures in the store
+        metrics[Metrics]: a sink for `presigned` counters (tagged with `result`: hit, miss or expired)
+        """
+
+        assert max_entries > 0, 'Maximum number of entries must be positive'
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.operations = frozenset(operations)
+        self.sink = metrics
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, content):
+        with self._lock:
+            entry = self._entries.get(content)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def put(self, content, sign):
+        """
+        Keeps a signature
+
+        Parameters
+        ----------
+        content[str]: a signing string
+        sign[dict]: a signature (`DigestValue`, `SignatureValue` and `X509SerialNumber`)
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._entries[content] = (now + self.ttl, sign)
+            self._entries.move_to_end(content)
+            # Signatures are kept in order of expiry, so expired ones are at the start
+            while self._entries and next(iter(self._entries.values()))[0] <= now:
+                self._entries.popitem(last=False)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def take(self, content):
+        """
+        Returns a signature and forgets it
+
+        Parameters
+        ----------
+        content[str]: a signing string
+
+        Returns
+        -------
+        dict: a signature (None when there is no signature or it's expired)
+        """
+
+        with self._lock:
+            entry = self._entries.pop(content, None)
+            if entry is None:
+                result = 'miss'
+            elif entry[0] <= time.monotonic():
+                result = 'expired'
+                entry = None
+            else:
+                result = 'hit'
+            self._stats['hits' if result == 'hit' else 'misses'] += 1
+            if result == 'expired':
+                self._stats['expired'] += 1
+
+        if self.sink is not None:
+            self.sink.increment('presigned', result=result)
+        return entry[1] if entry is not None else None
+
+    def stats(self):
+        """
+        Returns counters of the store
+
+        Returns
+        -------
+        dict: counters:
+            - size[int] - a number of kept signatures
+            - hits[int] - a number of requests which found a signature
+            - misses[int] - a number of requests which didn't find a signature (with expired ones)
+            - expired[int] - a number of requests which found an expired signature
+            - evicted[int] - a number of signatures evicted from the full store
+            - hit_rate[float] - a part of requests which found a signature
+        """
+
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+
+    def clear(self):
+        """
+        Forgets all signatures
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+
+__all__ = ('PresignedStore',)
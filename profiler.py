@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+import logging
+from collections import deque, Counter
+from contextlib import contextmanager
+
+try:
+    from .spawner import collect_usage
+except ImportError:
+    from spawner import collect_usage
+
+
+logger = logging.getLogger(__name__)
+
+
+class Profile:
+    """
+    A profile of a request in progress, `Tinkoff` marks phases of the request in it
+
+    Methods
+    -------
+    mark()
+        end a phase
+    """
+
+    __slots__ = ('operation', 'terminal', 'time', 'started', 'last', 'phases', 'usages', 'thread_id', 'samples',
+                 'error')
+
+    def __init__(self, operation, terminal, sampled):
+        self.operation = operation
+        self.terminal = terminal
+        self.time = time.time()
+        self.started = self.last = time.monotonic()
+        self.phases = []
+        self.usages = None
+        self.thread_id = threading.get_ident()
+        self.samples = Counter() if sampled else None
+        self.error = None
+
+    def mark(self, phase):
+        """
+        Ends a phase which is started at the end of the previous one
+
+        Parameters
+        ----------
+        phase[str]: a phase name (like `sign`)
+        """
+
+        now = time.monotonic()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+
+class SlowRequestProfiler:
+    """
+    Keeps detailed reports of requests which take longer than a threshold
+
+        profiler = SlowRequestProfiler(threshold=2.0, sample_rate=0.1)
+        tinkoff = Tinkoff(terminal_key, cryptopro, profiler=profiler)
+        ...
+        profiler.dump('slow.jsonl')
+
+    Every request is profiled: its phases are timed and resource usage of CryptoPro commands
+    (CPU time and maximum RSS) is collected. A part of requests (`sample_rate`) is also sampled
+    by a background thread every `sample_interval` seconds to get a statistical profile of stacks.
+    Reports of slow requests are kept in a ring of `max_reports` latest ones. A client without
+    a profiler doesn't profile at all.
+
+    Methods
+    -------
+    profile()
+        get a context manager which profiles a request
+    reports()
+        get kept reports
+    dump()
+        write kept reports to a JSONL file
+    clear()
+        forget kept reports
+    close()
+        stop the sampler
+    """
+
+    def __init__(self, threshold=1.0, thresholds=None, sample_rate=0.0, sample_interval=0.005, max_reports=100):
+        """
+        Parameters
+        ----------
+        threshold[float]: seconds after which a request is slow
+        thresholds[dict]: thresholds of operations (like `{'Init': 0.5}`)
+        sample_rate[float]: a part of requests sampled for a stack profile (from 0 to 1)
+        sample_interval[float]: seconds between stack samples
+        max_reports[int]: a number of kept reports
+        """
+
+        assert 0 <= sample_rate <= 1, 'Sample rate must be from 0 to 1'
+        assert max_reports > 0, 'Number of reports must be positive'
+
+        self.threshold = threshold
+        self.thresholds = dict(thresholds or {})
+        self.sample_rate = sample_rate
+        self.sample_interval = sample_interval
+        self.max_reports = max_reports
+
+        self._reports = deque(maxlen=max_reports)
+        self._lock = threading.Lock()
+        self._sampled = threading.Condition(self._lock)
+        self._active = set()
+        self._sampler = None
+        self._closed = False
+
+    @contextmanager
+    def profile(self, operation, terminal=None):
+        """
+        Returns a context manager which profiles a request
+
+        Parameters
+        ----------
+        operation[str]: an operation (like `Init`)
+        terminal[str]: a terminal key
+
+        Yields
+        ------
+        Profile: a profile to mark phases in
+        """
+
+        profile = Profile(operation, terminal, self.sample_rate and random.random() < self.sample_rate)
+        if profile.samples is not None:
+            self._start_sampling(profile)
+
+        try:
+            with collect_usage() as profile.usages:
+                yield profile
+        except BaseException as e:
+            profile.error = e
+            raise
+        finally:
+            if profile.samples is not None:
+                with self._lock:
+                    self._active.discard(profile)
+            self._finish(profile)
+
+    def reports(self):
+        """
+        Returns kept reports (from the oldest to the newest)
+
+        Returns
+        -------
+        list: reports:
+            - time[float] - a start time (Unix)
+            - terminal[str] - a terminal key
+            - operation[str] - an operation
+            - duration[float] - seconds of the request
+            - error[str] - an error or None
+            - phases[dict] - seconds by phases (`sign`, `request`, `response`)
+            - commands[list] - usages of commands (see `spawner.collect_usage()`)
+            - cpu[float] - user and system CPU seconds of commands
+            - max_rss[int] - a maximum RSS of commands in KB
+            - samples[dict] - numbers of samples by stacks (`file:function;...` from the outermost frame),
+                None when the request is not sampled
+        """
+
+        with self._lock:
+            return list(self._reports)
+
+    def dump(self, path):
+        """
+        Appends kept reports to a JSONL file
+
+        Parameters
+        ----------
+        path[str]: a file path
+
+        Returns
+        -------
+        int: a number of written reports
+        """
+
+        reports = self.reports()
+        with open(path, 'a', encoding='utf-8') as f:
+            for report in reports:
+                f.write(json.dumps(report, ensure_ascii=False, default=str) + '\n')
+        return len(reports)
+
+    def clear(self):
+        """
+        Forgets kept reports
+        """
+
+        with self._lock:
+            self._reports.clear()
+
+    def close(self):
+        """
+        Stops the sampler
+        """
+
+        with self._lock:
+            self._closed = True
+            self._sampled.notify_all()
+            sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            sampler.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start_sampling(self, profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._sampler is None and not self._closed:
+                self._sampler = threading.Thread(target=self._sample, name='tinkoff-profiler', daemon=True)
+                self._sampler.start()
+            self._sampled.notify()
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                # The sampler sleeps while no request is sampled
+                self._sampled.wait_for(lambda: self._active or self._closed)
+                if self._closed:
+                    return
+                active = list(self._active)
+
+            frames = sys._current_frames()
+            for profile in active:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.samples[self._get_stack(frame)] += 1
+            del frames
+
+            time.sleep(self.sample_interval)
+
+    def _get_stack(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _finish(self, profile):
+        duration = time.monotonic() - profile.started
+        if duration < self.thresholds.get(profile.operation, self.threshold):
+            return
+
+        usages = profile.usages or []
+        report = {
+            'time': profile.time,
+            'terminal': profile.terminal,
+            'operation': profile.operation,
+            'duration': duration,
+            'error': str(profile.error) if profile.error is not None else None,
+            'phases': dict(profile.phases),
+            'commands': usages,
+            'cpu': sum(x['cpu_user'] + x['cpu_system'] for x in usages),
+            'max_rss': max((x['max_rss'] for x in usages), default=None),
+            'samples': dict(profile.samples.most_common()) if profile.samples is not None else None,
+        }
+        with self._lock:
+            self._reports.append(report)
+        logger.info('Slow request %s took %.3fs: %s', profile.operation, duration,
+                    ', '.join('{} {:.3f}s'.format(k, v) for k, v in profile.phases))
+
+
+__all__ = ('SlowRequestProfiler', 'Profile')
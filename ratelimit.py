@@ -0,0 +1,194 @@
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Guards reopening of limiters in a forked process, it's replaced in a child as it may be held at fork
+_fork_lock = threading.Lock()
+
+
+def _reset_fork_lock():
+    global _fork_lock
+    _fork_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_fork_lock)
+
+
+class RateLimitError(Exception):
+    def __init__(self, message, code=-1):
+        super().__init__(message, code)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return '{}: {}'.format(self.code, self.message)
+
+
+class RateLimiter:
+    """
+    A token bucket rate limiter per terminal and operation
+
+    Buckets are kept in a memory-mapped file guarded with `flock`, so all processes which use
+    the same file on a host share the same limits. Without a file buckets are kept in an anonymous
+    memory map and shared by threads of the current process only. A forked process reopens
+    the file (or gets its own anonymous map) on its first request, so it never uses a file lock
+    or a thread lock inherited from the parent.
+
+    A request which cannot get a token right now reserves one (the bucket goes below zero)
+    and waits for it, so waiting requests are served in order of arrival.
+
+    Methods
+    -------
+    acquire()
+        wait for a token for a certain terminal and operation
+    """
+
+    slots = 1024
+    record = struct.Struct('<Qdd')
+
+    def __init__(self, rate, burst=None, rates=None, path=None, timeout=None):
+        """
+        Parameters
+        ----------
+        rate[float]: a number of requests per second for every terminal and operation
+        burst[int]: a bucket size (a number of requests which may be sent at once), `rate` by default
+        rates[dict]: (rate, burst) pairs by operation name (like 'GetState') to override defaults
+        path[str]: a file to share buckets across processes
+        timeout[float]: a maximum time to wait for a token (unlimited by default)
+        """
+
+        assert rate > 0, 'Rate must be positive'
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(int(rate), 1)
+        self.rates = rates or {}
+        self.path = path
+        self.timeout = timeout
+
+        self._fd = None
+        self._map = None
+        self._open()
+
+    def acquire(self, terminal_key, operation, timeout=None):
+        """
+        Waits for a token for a certain terminal and operation
+
+        Parameters
+        ----------
+        terminal_key[str]: a terminal key
+        operation[str]: an operation name (like 'Init', 'GetState', ...)
+        timeout[float]: a maximum time to wait (`timeout` of the limiter by default)
+
+        Returns
+        -------
+        float: seconds waited
+
+        Raises
+        ------
+        RateLimitError: when a token cannot be got in time
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        delay = self._reserve(terminal_key, operation, timeout)
+        if delay > 0:
+            logger.debug('Rate limit for %s %s, waiting %.3fs', terminal_key, operation, delay)
+            time.sleep(delay)
+        return delay
+
+    def close(self):
+        """
+        Releases the memory map and the file
+        """
+
+        self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _open(self):
+        # The file descriptor, the map and the lock inherited from a parent process must not be used:
+        # `flock` is held by an open file and an anonymous map is shared with the parent
+        if self._map is not None:
+            self.close()
+        self._lock = threading.Lock()
+        size = self.slots * self.record.size
+        if self.path is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._file_lock():
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        self._pid = os.getpid()
+
+    def _reserve(self, terminal_key, operation, timeout):
+        rate, burst = self.rates.get(operation, (self.rate, self.burst))
+        key = self._get_key(terminal_key, operation)
+
+        if self._pid != os.getpid():
+            with _fork_lock:
+                if self._pid != os.getpid():
+                    self._open()
+
+        with self._lock, self._file_lock():
+            offset = self._find_slot(key)
+            stored_key, tokens, updated = self.record.unpack_from(self._map, offset)
+            # The file outlives processes and reboots, so the wall clock is stored. It may step back
+            # (like on an NTP correction), so the elapsed time is never negative
+            now = time.time()
+            if stored_key != key:
+                tokens, updated = float(burst), now
+
+            tokens = min(float(burst), tokens + max(0.0, now - updated) * rate)
+            delay = max(0.0, (1.0 - tokens) / rate)
+            if timeout is not None and delay > timeout:
+                raise RateLimitError('Rate limit for {} {} is exceeded'.format(terminal_key, operation))
+
+            self.record.pack_into(self._map, offset, key, tokens - 1.0, now)
+            return delay
+
+    def _find_slot(self, key):
+        start = key % self.slots
+        for i in range(self.slots):
+            offset = ((start + i) % self.slots) * self.record.size
+            stored_key = self.record.unpack_from(self._map, offset)[0]
+            if stored_key == key or stored_key == 0:
+                return offset
+        raise RateLimitError('No free rate limit slots')
+
+    def _get_key(self, terminal_key, operation):
+        # Built-in `hash()` is randomized per process, so a stable digest is used
+        digest = hashlib.blake2b('{}\0{}'.format(terminal_key, operation).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _file_lock(self):
+        return _FileLock(self._fd)
+
+
+class _FileLock:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+__all__ = ('RateLimiter', 'RateLimitError')
@@ -0,0 +1,405 @@
+import json
+import time
+import binascii
+import threading
+import logging
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+try:
+    from .tinkoff import Payment
+except ImportError:
+    from tinkoff import Payment
+
+
+logger = logging.getLogger(__name__)
+
+
+SIGN_FIELDS = frozenset(('DigestValue', 'SignatureValue', 'X509SerialNumber'))
+
+
+class NotificationVerifier:
+    """
+    Verifies bank notifications: a terminal key, a certificate serial, a digest of fields
+    and a signature
+
+    A digest is calculated the same way as for requests (values of all fields except signature ones
+    are joined in order of keys). The digest and the serial are public, so a notification is valid
+    only when `SignatureValue` is checked against the bank certificate by `check_signature`
+    (`CryptoPro` has no signature verification, so the check is pluggable, like a GOST library
+    or a verification service). Results are cached per certificate serial, so a notification
+    which is sent again by the bank isn't checked again, and equal notifications of a batch
+    are checked once.
+
+    Methods
+    -------
+    verify()
+        verify a notification
+    verify_many()
+        verify a batch of notifications
+    """
+
+    def __init__(self, cryptopro, check_signature, terminal_key=None, serials=None, cache_size=10000):
+        """
+        Parameters
+        ----------
+        cryptopro[CryptoPro]: CryptoPro instance
+        check_signature[callable]: a function which takes signed content (bytes), a signature (bytes)
+            and a certificate serial and returns whether the signature is made by the bank certificate
+        terminal_key[str]: an expected `TerminalKey` (any by default)
+        serials[iterable]: trusted bank certificate serials (any by default)
+        cache_size[int]: a maximum number of cached results
+        """
+
+        assert callable(check_signature), 'Signature check must be a callable'
+
+        self.cryptopro = cryptopro
+        self.check_signature = check_signature
+        self.terminal_key = terminal_key
+        self.serials = frozenset(x.lower() for x in serials) if serials is not None else None
+        self.cache_size = cache_size
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def verify(self, notification):
+        """
+        Verifies a notification
+
+        Parameters
+        ----------
+        notification[dict]: notification fields
+
+        Returns
+        -------
+        bool: the notification is valid
+        """
+
+        return self.verify_many([notification])[0]
+
+    def verify_many(self, notifications):
+        """
+        Verifies a batch of notifications
+
+        Parameters
+        ----------
+        notifications[list]: notifications fields
+
+        Returns
+        -------
+        list[bool]: results in the same order
+        """
+
+        results = [None] * len(notifications)
+        pending = {}
+
+        for index, notification in enumerate(notifications):
+            if not self._check_fields(notification):
+                results[index] = False
+                continue
+            key = self._get_cache_key(notification)
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.setdefault(key, []).append(index)
+
+        for key, indexes in pending.items():
+            serial, digest, signature, content = key
+            try:
+                valid = (
+                    self.cryptopro.to_base64(self.cryptopro.get_hash(content)) == digest
+                    and bool(self.check_signature(content.encode(self.cryptopro.encoding),
+                                                  binascii.a2b_base64(signature), serial))
+                )
+            except Exception as e:
+                logger.warning('Cannot verify notification signature: %s', e)
+                valid = False
+            self._store(key, valid)
+            for index in indexes:
+                results[index] = valid
+
+        return results
+
+    def _check_fields(self, notification):
+        if not SIGN_FIELDS.issubset(notification):
+            return False
+        if self.terminal_key is not None and notification.get('TerminalKey') != self.terminal_key:
+            return False
+        if self.serials is not None and str(notification['X509SerialNumber']).lower() not in self.serials:
+            return False
+        return True
+
+    def _get_cache_key(self, notification):
+        # Values are serialized, so a key is hashable whatever values (like lists or objects) are sent
+        content = ''.join(self._format_value(notification[x]) for x in sorted(notification) if x not in SIGN_FIELDS)
+        return (str(notification['X509SerialNumber']).lower(), self._format_value(notification['DigestValue']),
+                self._format_value(notification['SignatureValue']), content)
+
+    def _format_value(self, value):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return str(value)
+
+    def _store(self, key, valid):
+        with self._lock:
+            self._cache[key] = valid
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+class NotificationReceiver:
+    """
+    A receiver of bank payment notifications, a WSGI application (and an ASGI one as `asgi`)
+
+    Valid notifications are converted to `Payment` objects (like `Tinkoff.get_payment()` results)
+    and passed to registered callbacks and put to a queue. The bank gets `OK` when all notifications
+    of a request are valid. Otherwise none of them is dispatched, and the bank sends them again later.
+    A request body larger than `max_body_size` is rejected without being read.
+
+    Methods
+    -------
+    add_callback()
+        register a callback for payments
+    handle()
+        verify and dispatch notifications
+    get_stale()
+        get payments which have no recent notification
+    serve()
+        run a standalone HTTP server
+    """
+
+    def __init__(self, verifier, callbacks=None, queue=None, max_tracked=100000, max_body_size=64 * 1024):
+        """
+        Parameters
+        ----------
+        verifier[NotificationVerifier]: a verifier (required, an unverified notification may be forged)
+        callbacks[list]: callables which take a `Payment` and a notification dict
+        queue[queue.Queue]: a queue to put (Payment, notification) pairs to
+        max_tracked[int]: a maximum number of payments to remember notification times for
+        max_body_size[int]: a maximum size of a request body in bytes
+        """
+
+        assert verifier is not None, 'Notifications must be verified'
+
+        self.verifier = verifier
+        self.callbacks = list(callbacks or ())
+        self.queue = queue
+        self.max_tracked = max_tracked
+        self.max_body_size = max_body_size
+
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+
+    def add_callback(self, callback):
+        """
+        Registers a callback
+
+        Parameters
+        ----------
+        callback[callable]: a function which takes a `Payment` and a notification dict
+        """
+
+        self.callbacks.append(callback)
+
+    def handle(self, notifications):
+        """
+        Verifies notifications and dispatches them when all of them are valid
+
+        Parameters
+        ----------
+        notifications[list]: notifications fields
+
+        Returns
+        -------
+        bool: all notifications are valid
+        """
+
+        results = self.verifier.verify_many(notifications)
+        if not all(results):
+            # The bank sends a rejected batch again as a whole, so valid items of it are not
+            # dispatched now to not be dispatched twice
+            for notification, valid in zip(notifications, results):
+                if not valid:
+                    logger.warning('Invalid notification: %s', notification)
+            return False
+
+        for notification in notifications:
+            self._dispatch(notification)
+        return True
+
+    def get_stale(self, payment_ids, max_age):
+        """
+        Returns payments which had no notification for `max_age` seconds, only they need polling
+
+        Parameters
+        ----------
+        payment_ids[iterable]: `PaymentId`s
+        max_age[float]: seconds
+
+        Returns
+        -------
+        list: `PaymentId`s
+        """
+
+        threshold = time.monotonic() - max_age
+        with self._lock:
+            return [x for x in payment_ids if self._seen.get(str(x), threshold - 1) < threshold]
+
+    def serve(self, host='0.0.0.0', port=8080):
+        """
+        Runs a standalone multithreaded HTTP server forever
+
+        Parameters
+        ----------
+        host[str]: a host to listen
+        port[int]: a port to listen
+        """
+
+        server = self.make_server(host, port)
+        logger.info('Listening for notifications on %s:%d', host, server.server_port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def make_server(self, host='0.0.0.0', port=8080):
+        """
+        Returns a multithreaded WSGI server (not started)
+        """
+
+        return make_server(host, port, self, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_response('405 Method Not Allowed', [('Content-Type', 'text/plain')])
+            return [b'ERROR']
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > self.max_body_size:
+            start_response('413 Payload Too Large', [('Content-Type', 'text/plain'), ('Content-Length', '5')])
+            return [b'ERROR']
+        body = environ['wsgi.input'].read(length) if length > 0 else b''
+
+        status, content = self._respond(body, environ.get('CONTENT_TYPE', ''))
+        start_response(status, [('Content-Type', 'text/plain'), ('Content-Length', str(len(content)))])
+        return [content]
+
+    async def asgi(self, scope, receive, send):
+        """
+        An ASGI application
+        """
+
+        import asyncio
+
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body') or len(body) > self.max_body_size:
+                break
+
+        if len(body) > self.max_body_size:
+            status, content = '413 Payload Too Large', b'ERROR'
+        elif scope['method'] != 'POST':
+            status, content = '405 Method Not Allowed', b'ERROR'
+        else:
+            content_type = dict(scope.get('headers') or ()).get(b'content-type', b'').decode('latin-1')
+            loop = asyncio.get_running_loop()
+            status, content = await loop.run_in_executor(None, self._respond, body, content_type)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split()[0]),
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(content)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    def _respond(self, body, content_type):
+        try:
+            notifications = self._parse(body, content_type)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.warning('Cannot parse notification: %s', e)
+            return '400 Bad Request', b'ERROR'
+
+        if self.handle(notifications):
+            return '200 OK', b'OK'
+        return '403 Forbidden', b'ERROR'
+
+    def _parse(self, body, content_type):
+        text = body.decode('utf-8')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            notification = dict(parse_qsl(text, keep_blank_values=True))
+            self._check_amount(notification)
+            return [notification]
+
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list) or not all(isinstance(x, dict) for x in data):
+            raise ValueError('Notification must be an object or a list of objects')
+        for notification in data:
+            self._check_amount(notification)
+        return data
+
+    def _check_amount(self, notification):
+        # `Amount` is in kopecks, anything else is a malformed request rather than a forged one
+        amount = notification.get('Amount')
+        if amount is None:
+            return
+        try:
+            if isinstance(amount, bool) or int(amount) != float(amount):
+                raise ValueError()
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError('Invalid amount {!r}'.format(amount))
+
+    def _dispatch(self, notification):
+        if 'PaymentId' not in notification or 'Status' not in notification:
+            logger.warning('Notification without payment: %s', notification)
+            return
+
+        amount = notification.get('Amount')
+        payment = Payment(
+            notification['PaymentId'],
+            notification['Status'],
+            amount=None if amount is None else int(amount) / 100,
+        )
+
+        with self._lock:
+            key = str(payment.payment_id)
+            self._seen[key] = time.monotonic()
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_tracked:
+                self._seen.popitem(last=False)
+
+        for callback in self.callbacks:
+            try:
+                callback(payment, notification)
+            except Exception:
+                logger.exception('Notification callback is failed')
+
+        if self.queue is not None:
+            self.queue.put((payment, notification))
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+__all__ = ('NotificationReceiver', 'NotificationVerifier')
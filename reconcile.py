@@ -0,0 +1,270 @@
+import csv
+import json
+import os
+import bisect
+import itertools
+import logging
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+
+TERMINAL_STATUSES = frozenset(('COMPLETED', 'REJECTED'))
+
+
+def read_ledger(path):
+    """
+    Reads a ledger file row by row
+
+    A CSV file must have a header with `payment_id` and `amount` columns, a JSONL file must have
+    objects with the same keys. An optional `status` column is compared with the bank status too.
+
+    Parameters
+    ----------
+    path[str]: a `.csv` or `.jsonl` file path
+
+    Yields
+    ------
+    tuple: (payment_id[str], amount[float], status[str])
+    """
+
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith('.csv'):
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(x) for x in file if x.strip())
+        for row in rows:
+            yield str(row['payment_id']), float(row['amount']), (row.get('status') or None)
+
+
+class Reconciler:
+    """
+    Compares a ledger of payments with their bank states chunk by chunk
+
+    Rows are read lazily and only one chunk is kept in memory. Bank states of a chunk are requested
+    with a bounded concurrency and then compared column by column (vectorised with NumPy when
+    it's installed). A watermark keeps ranges of ledger rows which are settled, that is in
+    a terminal state and matched, they are skipped on the next run. Rows which are terminal
+    but mismatched are kept in the watermark separately and are compared and reported again
+    on every run until the ledger is fixed. The watermark is written every `save_interval` seconds
+    and when the run ends, and it keeps at most `max_ranges` settled ranges and as many mismatched
+    rows: ranges past the limit are forgotten (and their rows are compared again on the next run),
+    so a ledger with scattered stuck rows doesn't make the watermark grow with the ledger.
+
+    Methods
+    -------
+    reconcile()
+        compare ledger rows with bank states and write mismatches
+    """
+
+    def __init__(self, tinkoff, concurrency=8, chunk_size=1000, watermark_path=None, save_interval=10.0,
+                 max_ranges=10000):
+        """
+        Parameters
+        ----------
+        tinkoff[Tinkoff]: Tinkoff instance
+        concurrency[int]: a number of simultaneous `GetState` requests
+        chunk_size[int]: a number of rows compared at once
+        watermark_path[str]: a file to read and store the watermark
+        save_interval[float]: a minimum number of seconds between watermark writes
+        max_ranges[int]: a maximum number of settled ranges (and of mismatched rows) in the watermark
+        """
+
+        assert concurrency > 0, 'Concurrency must be positive'
+        assert chunk_size > 0, 'Chunk size must be positive'
+        assert max_ranges > 0, 'Maximum number of ranges must be positive'
+
+        self.tinkoff = tinkoff
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.watermark_path = watermark_path
+        self.save_interval = save_interval
+        self.max_ranges = max_ranges
+
+    def reconcile(self, rows, report):
+        """
+        Compares ledger rows with bank states
+
+        Parameters
+        ----------
+        rows[iterable]: (payment_id, amount, status) tuples (see `read_ledger()`)
+        report[file]: a text file to write mismatches to as CSV (`row,payment_id,field,expected,actual`)
+
+        Returns
+        -------
+        dict: summary:
+            - skipped[int] - a number of rows skipped by the watermark
+            - checked[int] - a number of compared rows
+            - mismatches[int] - a number of mismatched fields
+            - errors[int] - a number of failed `GetState` requests
+            - watermark[int] - a number of settled rows (skipped on the next run)
+            - mismatched[int] - a number of terminal rows with mismatches
+        """
+
+        settled, mismatched = self._load_watermark()
+        summary = {
+            'skipped': 0,
+            'checked': 0,
+            'mismatches': 0,
+            'errors': 0,
+            'watermark': 0,
+            'mismatched': 0,
+        }
+
+        writer = csv.writer(report)
+        writer.writerow(('row', 'payment_id', 'field', 'expected', 'actual'))
+
+        rows = self._skip_settled(rows, settled, summary)
+        last_save = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                while True:
+                    chunk = list(itertools.islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+
+                    offsets, ids, amounts, statuses = self._split_columns(chunk)
+                    states = list(executor.map(self._get_state, ids))
+                    actual_amounts, actual_statuses = self._split_states(states)
+
+                    failed = set()
+                    for index, field, expected, actual in self._diff(ids, amounts, statuses,
+                                                                     actual_amounts, actual_statuses):
+                        writer.writerow((offsets[index], ids[index], field, expected, actual))
+                        summary['errors' if field == 'error' else 'mismatches'] += 1
+                        failed.add(index)
+
+                    for index, status in enumerate(actual_statuses):
+                        if isinstance(status, Exception) or status not in TERMINAL_STATUSES:
+                            continue
+                        if index in failed:
+                            if len(mismatched) < self.max_ranges:
+                                mismatched.add(offsets[index])
+                        else:
+                            mismatched.discard(offsets[index])
+                            self._add_settled(settled, offsets[index])
+
+                    summary['checked'] += len(chunk)
+                    logger.info('Reconciled %d rows, %d mismatches', summary['checked'], summary['mismatches'])
+
+                    if time.monotonic() - last_save >= self.save_interval:
+                        self._save_watermark(settled, mismatched)
+                        last_save = time.monotonic()
+            finally:
+                self._save_watermark(settled, mismatched)
+
+        summary['watermark'] = sum(x[1] - x[0] for x in settled)
+        summary['mismatched'] = len(mismatched)
+        return summary
+
+    def _skip_settled(self, rows, settled, summary):
+        # Settled ranges are sorted, so they are passed with a single pointer
+        ranges = iter(list(settled))
+        current = next(ranges, None)
+        for offset, row in enumerate(rows):
+            while current is not None and current[1] <= offset:
+                current = next(ranges, None)
+            if current is not None and current[0] <= offset:
+                summary['skipped'] += 1
+                continue
+            yield offset, row
+
+    def _add_settled(self, settled, offset):
+        # Settled rows are kept as sorted non-overlapping [start, end) ranges
+        index = bisect.bisect_right(settled, [offset, float('inf')])
+        if index and settled[index - 1][1] >= offset + 1:
+            return
+        if index and settled[index - 1][1] == offset:
+            settled[index - 1][1] = offset + 1
+        else:
+            settled.insert(index, [offset, offset + 1])
+            index += 1
+        if index < len(settled) and settled[index][0] == settled[index - 1][1]:
+            settled[index - 1][1] = settled[index][1]
+            del settled[index]
+        # The farthest range is forgotten, so the leading ones (which skip the most rows) are kept
+        if len(settled) > self.max_ranges:
+            del settled[-1]
+
+    def _get_state(self, payment_id):
+        try:
+            return self.tinkoff.get_payment(payment_id)
+        except Exception as e:
+            logger.warning('Cannot get payment %s: %s', payment_id, e)
+            return e
+
+    def _split_columns(self, chunk):
+        offsets = [x[0] for x in chunk]
+        ids = [x[1][0] for x in chunk]
+        amounts = array('q', (int(round(x[1][1] * 100)) for x in chunk))
+        statuses = [x[1][2] for x in chunk]
+        return offsets, ids, amounts, statuses
+
+    def _split_states(self, states):
+        amounts = [None if isinstance(x, Exception) or x.get('amount') is None else int(round(x['amount'] * 100))
+                   for x in states]
+        statuses = [x if isinstance(x, Exception) else x['status'] for x in states]
+        return amounts, statuses
+
+    def _diff(self, ids, amounts, statuses, actual_amounts, actual_statuses):
+        for index, actual in enumerate(actual_statuses):
+            if isinstance(actual, Exception):
+                yield index, 'error', '', str(actual)
+
+        # Unknown amounts and statuses are -1, failed requests are -2
+        actual_amount_column = array('q', (-1 if x is None else x for x in actual_amounts))
+        codes = {}
+        status_column = array('i', (-1 if x is None else codes.setdefault(x, len(codes)) for x in statuses))
+        actual_status_column = array('i', (
+            -2 if isinstance(x, Exception) else codes.setdefault(str(x), len(codes)) for x in actual_statuses
+        ))
+
+        if np is not None:
+            expected = np.frombuffer(amounts, dtype=np.int64)
+            actual = np.frombuffer(actual_amount_column, dtype=np.int64)
+            amount_indexes = np.flatnonzero((actual >= 0) & (expected != actual)).tolist()
+            expected = np.frombuffer(status_column, dtype=np.intc)
+            actual = np.frombuffer(actual_status_column, dtype=np.intc)
+            status_indexes = np.flatnonzero((expected >= 0) & (actual >= 0) & (expected != actual)).tolist()
+        else:
+            amount_indexes = [i for i, (expected, actual) in enumerate(zip(amounts, actual_amount_column))
+                              if actual >= 0 and expected != actual]
+            status_indexes = [i for i, (expected, actual) in enumerate(zip(status_column, actual_status_column))
+                              if expected >= 0 and actual >= 0 and expected != actual]
+
+        for index in amount_indexes:
+            yield index, 'amount', '%.2f' % (amounts[index] / 100), '%.2f' % (actual_amounts[index] / 100)
+        for index in status_indexes:
+            yield index, 'status', statuses[index], str(actual_statuses[index])
+
+    def _load_watermark(self):
+        if self.watermark_path is None or not os.path.exists(self.watermark_path):
+            return [], set()
+        with open(self.watermark_path, encoding='utf-8') as file:
+            data = json.load(file)
+        # A watermark of older versions only has a number of leading settled rows
+        settled = [list(x) for x in data.get('settled', [[0, data.get('offset', 0)]]) if x[1] > x[0]]
+        return settled[:self.max_ranges], set(sorted(data.get('mismatched', ()))[:self.max_ranges])
+
+    def _save_watermark(self, settled, mismatched):
+        if self.watermark_path is None:
+            return
+        temp_path = self.watermark_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'offset': settled[0][1] if settled and settled[0][0] == 0 else 0,
+                'settled': settled,
+                'mismatched': sorted(mismatched),
+            }, file)
+        os.replace(temp_path, self.watermark_path)
+
+
+__all__ = ('Reconciler', 'read_ledger')
@@ -0,0 +1,420 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+try:
+    from .tinkoff import TinkoffError
+    from .transport import Transport, TransportError, Response
+    from .registry import TinkoffRegistry
+    from .signer import create_signer
+    from .audit import AuditLog, OVERFLOW_BLOCK
+except ImportError:
+    from tinkoff import TinkoffError
+    from transport import Transport, TransportError, Response
+    from registry import TinkoffRegistry
+    from signer import create_signer
+    from audit import AuditLog, OVERFLOW_BLOCK
+
+
+logger = logging.getLogger(__name__)
+
+
+SENSITIVE_FIELDS = frozenset((
+    'CustomerKey', 'CardId', 'Pan', 'RebillId', 'RebillID', 'ExpDate', 'Email', 'Phone', 'DATA',
+    'PaymentURL', 'URL',
+))
+
+SIGN_FIELDS = frozenset(('TerminalKey', 'DigestValue', 'SignatureValue', 'X509SerialNumber'))
+
+# Response fields which `Tinkoff` reads, others are not needed to replay a response
+RESPONSE_FIELDS = frozenset((
+    'Success', 'ErrorCode', 'Message', 'Details', 'PaymentId', 'Status', 'Amount', 'CardId', 'CardType', 'Pan',
+    'RebillID', 'ExpDate', 'CustomerKey', 'Email', 'Phone', 'RequestKey', 'PaymentURL', 'URL',
+))
+
+
+def redact(value, fields=SENSITIVE_FIELDS, key=b''):
+    """
+    Replaces values of sensitive fields (at any depth) with keyed hashes, so equal values
+    have equal hashes within a recording (a card is still the same card in a replay)
+    but the original values can't be restored
+
+    Parameters
+    ----------
+    value[dict, list]: a request or a response
+    fields[iterable]: names of sensitive fields
+    key[bytes]: a hash key (up to 64 bytes)
+
+    Returns
+    -------
+    dict, list: a redacted copy
+    """
+
+    if isinstance(value, dict):
+        return {
+            k: _hash(v, key) if k in fields and v is not None else redact(v, fields, key)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(x, fields, key) for x in value]
+    return value
+
+
+def _trim(value, fields):
+    # Responses are objects or lists of objects
+    if isinstance(value, dict):
+        return {k: v for k, v in value.items() if k in fields}
+    if isinstance(value, list):
+        return [_trim(x, fields) for x in value]
+    return value
+
+
+def _hash(value, key):
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, default=str)
+    return '~' + hashlib.blake2b(value.encode('utf-8'), key=key, digest_size=8).hexdigest()
+
+
+def read_records(path):
+    """
+    Reads records of a recording
+
+    Parameters
+    ----------
+    path[str]: a JSONL file path
+
+    Yields
+    ------
+    dict: a record (see `TrafficRecorder`)
+    """
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TrafficRecorder(AuditLog):
+    """
+    A `Tinkoff` request hook which writes a redacted record of every request to a JSONL file
+
+        recorder = TrafficRecorder('traffic.jsonl')
+        tinkoff = Tinkoff(terminal_key, cryptopro, hooks=[recorder])
+
+    Like `AuditLog`, a request thread only puts a record into a buffer, and a background thread
+    redacts and writes records in batches. Unlike it, the file is not rotated and a request thread
+    waits for space in a full buffer by default, so a recording is complete. A response keeps only
+    fields which are read by `Tinkoff` (`response_fields`), which is enough to replay it.
+
+    A record has keys:
+        - time[float] - a start time (Unix)
+        - terminal[str] - a terminal key
+        - operation[str] - an operation (like `GetState`)
+        - method[str] - HTTP method
+        - data[dict] - request fields (redacted)
+        - request_size[int] - a request body size in bytes
+        - sign_latency[float] - seconds spent on signing
+        - latency[float] - seconds spent on a request
+        - result[str] - `ok`, `error` (a transport error) or `rejected` (a bank error)
+        - status[int] - HTTP status (None when unknown)
+        - response[dict, list] - a decoded response (redacted, with `response_fields` only)
+        - response_size[int] - a size of the whole response in JSON
+        - error[str] - an error message
+
+    Methods
+    -------
+    flush()
+        write buffered records
+    close()
+        write buffered records and close the file
+    """
+
+    def __init__(self, path, fields=SENSITIVE_FIELDS, key=None, response_fields=RESPONSE_FIELDS, max_bytes=0,
+                 overflow=OVERFLOW_BLOCK, **params):
+        """
+        Parameters
+        ----------
+        path[str]: a JSONL file path (records are appended)
+        fields[iterable]: names of sensitive fields to redact
+        key[bytes]: a hash key of redacted values (random by default, set it to match values
+            between recordings)
+        response_fields[iterable]: names of response fields to keep (None keeps whole responses)
+        max_bytes[int]: a file size to rotate the file at (0 disables rotation)
+        overflow[str]: a policy of a full buffer (see `AuditLog`)
+        params[dict]: other params of `AuditLog` (like `buffer_size` or `flush_interval`)
+        """
+
+        self.fields = frozenset(fields)
+        self.key = key if key is not None else os.urandom(16)
+        self.response_fields = frozenset(response_fields) if response_fields is not None else None
+        super().__init__(path, max_bytes=max_bytes, overflow=overflow, **params)
+
+    def _format(self, record):
+        response = record['response']
+        response_size = 0
+        if response is not None:
+            response_size = len(json.dumps(response, ensure_ascii=False, separators=(',', ':'),
+                                           default=str).encode('utf-8'))
+            if self.response_fields is not None:
+                response = _trim(response, self.response_fields)
+        error = record['error']
+        return json.dumps({
+            'time': record['time'],
+            'terminal': record['terminal'],
+            'operation': record['operation'],
+            'method': record['method'],
+            'data': redact(record['data'], self.fields, self.key),
+            'request_size': record['request_size'],
+            'sign_latency': round(record['sign_latency'], 6),
+            'latency': round(record['latency'], 6),
+            'result': record['result'],
+            'status': record['status'],
+            'response': redact(response, self.fields, self.key),
+            'response_size': response_size,
+            'error': str(error) if error is not None else None,
+        }, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+
+
+class ReplayTransport(Transport):
+    """
+    A local stub of the bank which answers with recorded responses after recorded latencies
+
+    A request gets a response of a record with the same operation and fields, or of the next
+    unused record of the operation when there is no such record (for example, when a client
+    under test sends requests in another order). Transport errors are reproduced as `TransportError`.
+
+    Methods
+    -------
+    request()
+        get a recorded response
+    """
+
+    def __init__(self, records, speed=1.0):
+        """
+        Parameters
+        ----------
+        records[iterable]: records (see `TrafficRecorder`)
+        speed[float]: a speedup of latencies (2 halves them, 0 disables them)
+        """
+
+        assert speed >= 0, 'Speed must not be negative'
+
+        self.speed = speed
+
+        self._lock = threading.Lock()
+        self._by_request = {}
+        self._by_operation = {}
+        for record in records:
+            record = {'record': record, 'used': False}
+            self._by_request.setdefault(self._get_key(record['record']), deque()).append(record)
+            self._by_operation.setdefault(record['record']['operation'], deque()).append(record)
+
+    def request(self, method, url, data=None, headers=None, allow_redirects=True):
+        operation = url.rstrip('/').rsplit('/', 1)[-1]
+        if isinstance(data, bytes):
+            data = dict(parse_qsl(data.decode('utf-8')))
+        fields = {k: v for k, v in (data or {}).items() if k not in SIGN_FIELDS}
+
+        record = self._take(operation, fields)
+        if record is None:
+            raise TransportError('No recorded response of {}'.format(operation), 404)
+
+        if self.speed:
+            time.sleep(record['latency'] / self.speed)
+
+        if record['result'] == 'error':
+            raise TransportError(record['error'] or 'Recorded error', record['status'] or -1)
+
+        content = json.dumps(record['response'], ensure_ascii=False).encode('utf-8')
+        headers = {}
+        if record['status'] and 300 <= record['status'] <= 399:
+            headers['Location'] = (record['response'] or {}).get('URL')
+        return Response(record['status'] or 200, headers, content)
+
+    def _take(self, operation, fields):
+        with self._lock:
+            for queue in (self._by_request.get((operation, self._get_fields_key(fields))),
+                          self._by_operation.get(operation)):
+                while queue:
+                    item = queue.popleft()
+                    if not item['used']:
+                        item['used'] = True
+                        return item['record']
+        return None
+
+    def _get_key(self, record):
+        return record['operation'], self._get_fields_key(record['data'] or {})
+
+    def _get_fields_key(self, fields):
+        return tuple(sorted((k, v if isinstance(v, str) else str(v)) for k, v in fields.items() if v is not None))
+
+
+class TrafficReplayer:
+    """
+    Sends recorded requests with their recorded timing (open loop) to measure a client
+    against real traffic, usually with `ReplayTransport`:
+
+        records = list(read_records('traffic.jsonl'))
+        transport = ReplayTransport(records, speed=10)
+        tinkoff = Tinkoff(terminal_key, signer=FakeSigner(), transport=transport)
+        summary = TrafficReplayer(tinkoff, records, speed=10).run()
+
+    Methods
+    -------
+    run()
+        replay requests
+    """
+
+    def __init__(self, tinkoff, records, speed=1.0, concurrency=16):
+        """
+        Parameters
+        ----------
+        tinkoff[Tinkoff, TinkoffRegistry]: a client (a registry replays requests with clients of their terminals)
+        records[iterable]: records (see `TrafficRecorder`)
+        speed[float]: a speedup of the recorded timing (0 sends requests as fast as possible)
+        concurrency[int]: a maximum number of simultaneous requests
+        """
+
+        assert speed >= 0, 'Speed must not be negative'
+        assert concurrency > 0, 'Concurrency must be positive'
+
+        self.tinkoff = tinkoff
+        self.records = sorted(records, key=lambda x: x['time'])
+        self.speed = speed
+        self.concurrency = concurrency
+
+    def run(self):
+        """
+        Replays requests
+
+        Returns
+        -------
+        dict: a summary:
+            - requests[int] - a number of requests
+            - mismatches[int] - a number of requests which result differs from the recorded one
+            - elapsed[float] - seconds of the replay
+            - recorded[float] - seconds of the recording
+            - operations[dict] - `count`, `errors`, `p50` and `p99` latencies in seconds by operations
+        """
+
+        results = []
+        lock = threading.Lock()
+
+        def replay(record):
+            result = self._replay(record)
+            with lock:
+                results.append(result)
+
+        first = self.records[0]['time'] if self.records else 0.0
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in self.records:
+                if self.speed:
+                    delay = (record['time'] - first) / self.speed - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(replay, record)
+        elapsed = time.monotonic() - started
+
+        operations = {}
+        for operation, latency, result, expected in results:
+            operations.setdefault(operation, []).append((latency, result != 'ok'))
+
+        return {
+            'requests': len(results),
+            'mismatches': sum(1 for x in results if x[2] != x[3]),
+            'elapsed': elapsed,
+            'recorded': self.records[-1]['time'] - first if self.records else 0.0,
+            'operations': {k: self._summarize(v) for k, v in sorted(operations.items())},
+        }
+
+    def _replay(self, record):
+        client = self.tinkoff
+        if isinstance(client, TinkoffRegistry):
+            client = client.get(record['terminal'])
+
+        started = time.monotonic()
+        try:
+            client.request(record['operation'], record['data'], record['method'])
+        except TinkoffError as e:
+            result = 'error' if e.__cause__ is not None else 'rejected'
+        except Exception:
+            logger.exception('Replay of %s is failed', record['operation'])
+            result = 'error'
+        else:
+            result = 'ok'
+        return record['operation'], time.monotonic() - started, result, record['result']
+
+    def _summarize(self, items):
+        latencies = sorted(x[0] for x in items)
+        return {
+            'count': len(items),
+            'errors': sum(1 for x in items if x[1]),
+            'p50': latencies[len(latencies) // 2],
+            'p99': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+        }
+
+
+def format_summary(summary):
+    """
+    Returns a text table of `TrafficReplayer.run()` summary
+
+    Parameters
+    ----------
+    summary[dict]: a summary
+
+    Returns
+    -------
+    str: a table
+    """
+
+    lines = ['{:<20} {:>8} {:>7} {:>10} {:>10}'.format('operation', 'count', 'errors', 'p50 ms', 'p99 ms')]
+    for operation, item in summary['operations'].items():
+        lines.append('{:<20} {:>8} {:>7} {:>10.2f} {:>10.2f}'.format(
+            operation, item['count'], item['errors'], item['p50'] * 1000, item['p99'] * 1000,
+        ))
+    lines.append('{} requests in {:.1f}s (recorded in {:.1f}s), {} mismatches'.format(
+        summary['requests'], summary['elapsed'], summary['recorded'], summary['mismatches'],
+    ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Replays a recording against a local stub of the bank:
+
+        python -m recorder FILE [options]
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m recorder')
+    parser.add_argument('path', help='a JSONL recording')
+    parser.add_argument('--speed', type=float, default=1.0, help='a speedup of timing and latencies')
+    parser.add_argument('--concurrency', type=int, default=16, help='a maximum number of simultaneous requests')
+    parser.add_argument('--signer', default='{"backend": "fake"}', help='a JSON signer config (see create_signer)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log requests')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    records = list(read_records(args.path))
+    transport = ReplayTransport(records, speed=args.speed)
+    with TinkoffRegistry(None, transport=transport, signer=create_signer(json.loads(args.signer))) as registry:
+        summary = TrafficReplayer(registry, records, speed=args.speed, concurrency=args.concurrency).run()
+    print(format_summary(summary))
+    return 0
+
+
+__all__ = ('TrafficRecorder', 'ReplayTransport', 'TrafficReplayer', 'read_records', 'redact', 'format_summary')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import threading
+import logging
+from collections import OrderedDict
+
+try:
+    from .tinkoff import Tinkoff, get_default_decoder
+    from .transport import RequestsTransport
+    from .signer import CryptoProSigner
+except ImportError:
+    from tinkoff import Tinkoff, get_default_decoder
+    from transport import RequestsTransport
+    from signer import CryptoProSigner
+
+
+logger = logging.getLogger(__name__)
+
+
+class TinkoffRegistry:
+    """
+    A registry of `Tinkoff` clients of many terminals (merchants) which share expensive resources
+
+    All clients use one transport (one connection pool), one signer (or a signer pool), one decoder,
+    one cache and one metrics sink: cache keys and metrics are partitioned by the terminal key.
+    Clients are created on demand and only `max_clients` recently used ones are kept, so memory
+    grows with the number of active terminals and connections with the number of hosts.
+
+    Methods
+    -------
+    get()
+        get a client of a terminal
+    register()
+        set options of a terminal
+    close()
+        close shared connections
+    """
+
+    def __init__(self, cryptopro, is_test=False, transport=None, cache=None, metrics=None, decoder=None, signer=None,
+                 max_clients=1000, **options):
+        """
+        Parameters
+        ----------
+        cryptopro[CryptoPro]: CryptoPro instance shared by terminals (may be None when `signer` is given)
+        is_test[bool]: use test endpoint for requests
+        transport[Transport]: an HTTP transport (`RequestsTransport` by default)
+        cache[SharedCache]: a cache shared by terminals
+        metrics[Metrics]: a metrics sink shared by terminals
+        decoder[JSONDecoder]: a response decoder
+        signer[Signer]: a signer (or a `PooledSigner`) shared by terminals (`CryptoProSigner` by default)
+        max_clients[int]: a maximum number of kept clients
+        **options: other `Tinkoff` parameters for all terminals (like `rate_limiter`)
+        """
+
+        assert max_clients > 0, 'Maximum number of clients must be positive'
+
+        self.cryptopro = cryptopro
+        self.is_test = is_test
+        self.transport = transport if transport is not None else RequestsTransport()
+        self.cache = cache
+        self.metrics = metrics
+        self.decoder = decoder if decoder is not None else get_default_decoder()
+        self.signer = signer if signer is not None else CryptoProSigner(cryptopro)
+        self.max_clients = max_clients
+        self.options = options
+
+        self._own_transport = transport is None
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self._terminal_options = {}
+
+    def get(self, terminal_key):
+        """
+        Returns a client of a terminal
+
+        Parameters
+        ----------
+        terminal_key[str]: the terminal key (got from bank)
+
+        Returns
+        -------
+        Tinkoff: a client
+        """
+
+        with self._lock:
+            client = self._clients.get(terminal_key)
+            if client is not None:
+                self._clients.move_to_end(terminal_key)
+                return client
+
+            client = self._create_client(terminal_key)
+            self._clients[terminal_key] = client
+            while len(self._clients) > self.max_clients:
+                evicted, _ = self._clients.popitem(last=False)
+                logger.debug('Client of terminal %s is evicted', evicted)
+            return client
+
+    def __getitem__(self, terminal_key):
+        return self.get(terminal_key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+    def register(self, terminal_key, **options):
+        """
+        Sets options of a terminal, they override common ones (like its own `cryptopro` or `signer`)
+
+        Parameters
+        ----------
+        terminal_key[str]: the terminal key (got from bank)
+        **options: `Tinkoff` parameters
+        """
+
+        with self._lock:
+            self._terminal_options[terminal_key] = options
+            self._clients.pop(terminal_key, None)
+
+    def close(self):
+        """
+        Forgets clients and closes the transport when it's created by the registry
+        """
+
+        with self._lock:
+            self._clients.clear()
+        if self._own_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _create_client(self, terminal_key):
+        params = {
+            'cryptopro': self.cryptopro,
+            'is_test': self.is_test,
+            'transport': self.transport,
+            'cache': self.cache,
+            'metrics': self.metrics,
+            'decoder': self.decoder,
+            'signer': self.signer,
+        }
+        params.update(self.options)
+        options = self._terminal_options.get(terminal_key, {})
+        if 'cryptopro' in options and 'signer' not in options:
+            params['signer'] = CryptoProSigner(options['cryptopro'])
+        params.update(options)
+        return Tinkoff(terminal_key, **params)
+
+
+__all__ = ('TinkoffRegistry',)
@@ -0,0 +1,309 @@
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_DEFAULT = 'default'
+PRIORITY_BATCH = 'batch'
+
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_DEFAULT, PRIORITY_BATCH)
+
+OPERATION_PRIORITIES = {
+    'AddCard': PRIORITY_INTERACTIVE,
+    'GetCardList': PRIORITY_INTERACTIVE,
+    'RemoveCard': PRIORITY_INTERACTIVE,
+    'AddCustomer': PRIORITY_INTERACTIVE,
+    'GetCustomer': PRIORITY_INTERACTIVE,
+    'RemoveCustomer': PRIORITY_INTERACTIVE,
+}
+
+_call_options = contextvars.ContextVar('tinkoff_call_options', default=None)
+
+
+class SchedulerError(Exception):
+    def __init__(self, message, code=-1):
+        super().__init__(message, code)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return '{}: {}'.format(self.code, self.message)
+
+
+@contextmanager
+def call_options(priority=None, tenant=None, deadline=None, timeout=None):
+    """
+    Sets scheduling options of requests made in a block (in the current thread or task)
+
+        with call_options(priority='batch', timeout=30):
+            tinkoff.proceed_payment(payment_id)
+
+    Parameters
+    ----------
+    priority[str]: a priority class (by operation by default)
+    tenant[str]: a tenant to share capacity fairly with (the terminal key by default)
+    deadline[float]: a `time.monotonic()` time after which a request is dropped
+    timeout[float]: seconds after which a request is dropped (instead of `deadline`)
+    """
+
+    options = dict(_call_options.get() or {})
+    if priority is not None:
+        options['priority'] = priority
+    if tenant is not None:
+        options['tenant'] = tenant
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+    if deadline is not None:
+        options['deadline'] = deadline
+
+    token = _call_options.set(options)
+    try:
+        yield options
+    finally:
+        _call_options.reset(token)
+
+
+def get_call_options():
+    """
+    Returns scheduling options set by `call_options()`
+
+    Returns
+    -------
+    dict: options (empty when not set)
+    """
+
+    return _call_options.get() or {}
+
+
+class _Waiter:
+    __slots__ = ('priority', 'tenant', 'deadline', 'queued', 'event', 'state', 'in_queue')
+
+    def __init__(self, priority, tenant, deadline):
+        self.priority = priority
+        self.tenant = tenant
+        self.deadline = deadline
+        self.queued = time.monotonic()
+        self.event = threading.Event()
+        self.state = None
+        self.in_queue = False
+
+
+class RequestScheduler:
+    """
+    Schedules outbound requests by priority classes with weighted fair queuing across tenants
+
+    At most `concurrency` requests are run at once. When all slots are busy, a free slot is given
+    to the highest priority class which has waiting requests and within the class to the tenant
+    with the smallest virtual finish time: a tenant with weight 2 gets twice as many slots
+    as a tenant with weight 1 while both of them have waiting requests. A request which deadline
+    passes while it waits is dropped before it's signed.
+
+    Methods
+    -------
+    acquire()
+        wait for a slot
+    release()
+        free a slot
+    slot()
+        get a context manager which holds a slot
+    metrics()
+        get queue metrics of every priority class
+    """
+
+    def __init__(self, concurrency=8, priorities=PRIORITIES, operation_priorities=None, weights=None,
+                 default_priority=PRIORITY_DEFAULT, metrics=None):
+        """
+        Parameters
+        ----------
+        concurrency[int]: a number of simultaneous requests
+        priorities[iterable]: priority classes from the highest to the lowest
+        operation_priorities[dict]: priority classes of operations (`OPERATION_PRIORITIES` by default)
+        weights[dict]: weights of tenants (1 by default)
+        default_priority[str]: a priority class of other operations
+        metrics[Metrics]: a sink for queue wait times and dropped requests
+        """
+
+        assert concurrency > 0, 'Concurrency must be positive'
+        assert default_priority in priorities, 'Default priority must be one of priorities'
+
+        self.concurrency = concurrency
+        self.priorities = tuple(priorities)
+        self.operation_priorities = dict(OPERATION_PRIORITIES if operation_priorities is None else operation_priorities)
+        self.weights = dict(weights or {})
+        self.default_priority = default_priority
+        self.sink = metrics
+
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._running = 0
+        self._waiting = 0
+        self._queues = {x: [] for x in self.priorities}
+        self._virtual_time = {x: 0.0 for x in self.priorities}
+        self._finish = {}
+        self._stats = {x: {'queued': 0, 'waited': 0, 'wait_sum': 0.0, 'wait_max': 0.0, 'dropped': 0}
+                       for x in self.priorities}
+
+    def acquire(self, operation=None, tenant=None, priority=None, deadline=None):
+        """
+        Waits for a slot
+
+        Parameters
+        ----------
+        operation[str]: an operation (like `GetState`) to choose a priority class by
+        tenant[str]: a tenant (like a terminal key)
+        priority[str]: a priority class (overrides one of the operation)
+        deadline[float]: a `time.monotonic()` time after which the request is dropped
+
+        Raises
+        ------
+        SchedulerError: when the deadline is passed
+        """
+
+        if priority is None:
+            priority = self.operation_priorities.get(operation, self.default_priority)
+        assert priority in self._queues, 'Unknown priority {}'.format(priority)
+
+        waiter = _Waiter(priority, tenant, deadline)
+        with self._lock:
+            if deadline is not None and deadline <= waiter.queued:
+                self._drop(waiter)
+            elif self._running < self.concurrency and not self._waiting:
+                self._running += 1
+                self._grant(waiter)
+                return
+            else:
+                self._enqueue(waiter)
+                self._dispatch()
+
+        if waiter.state is None:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            waiter.event.wait(timeout)
+            with self._lock:
+                if waiter.state is None:
+                    self._drop(waiter)
+
+        if waiter.state == 'dropped':
+            raise SchedulerError('Deadline is exceeded while waiting in queue')
+
+    def release(self):
+        """
+        Frees a slot and gives it to the next waiting request
+        """
+
+        with self._lock:
+            self._running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, operation=None, tenant=None, priority=None, deadline=None):
+        """
+        Returns a context manager which holds a slot (see `acquire()`)
+        """
+
+        self.acquire(operation, tenant, priority, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self):
+        """
+        Returns queue metrics of every priority class
+
+        Returns
+        -------
+        dict: metrics by priority classes:
+            - queued[int] - a number of waiting requests
+            - waited[int] - a number of requests which got a slot
+            - wait_avg[float] - an average wait time in seconds
+            - wait_max[float] - a maximum wait time in seconds
+            - dropped[int] - a number of dropped requests
+        """
+
+        with self._lock:
+            return {
+                priority: {
+                    'queued': stats['queued'],
+                    'waited': stats['waited'],
+                    'wait_avg': stats['wait_sum'] / stats['waited'] if stats['waited'] else 0.0,
+                    'wait_max': stats['wait_max'],
+                    'dropped': stats['dropped'],
+                }
+                for priority, stats in self._stats.items()
+            }
+
+    def _enqueue(self, waiter):
+        key = (waiter.priority, waiter.tenant)
+        start = max(self._virtual_time[waiter.priority], self._finish.get(key, 0.0))
+        finish = start + 1.0 / self.weights.get(waiter.tenant, 1.0)
+        self._finish[key] = finish
+        heapq.heappush(self._queues[waiter.priority], (finish, next(self._counter), waiter))
+        waiter.in_queue = True
+        self._waiting += 1
+        self._stats[waiter.priority]['queued'] += 1
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._running < self.concurrency:
+            waiter = self._pop(now)
+            if waiter is None:
+                break
+            self._running += 1
+            self._grant(waiter)
+
+    def _pop(self, now):
+        for priority in self.priorities:
+            queue = self._queues[priority]
+            while queue:
+                finish, _, waiter = heapq.heappop(queue)
+                if not waiter.in_queue:
+                    # Dropped while waiting
+                    continue
+                self._dequeue(waiter)
+                if waiter.deadline is not None and waiter.deadline <= now:
+                    self._drop(waiter)
+                    continue
+                self._virtual_time[priority] = finish
+                return waiter
+        # Forget finish times of idle tenants, so they don't grow without bound
+        self._finish.clear()
+        return None
+
+    def _dequeue(self, waiter):
+        waiter.in_queue = False
+        self._waiting -= 1
+        self._stats[waiter.priority]['queued'] -= 1
+
+    def _grant(self, waiter):
+        wait = time.monotonic() - waiter.queued
+        stats = self._stats[waiter.priority]
+        stats['waited'] += 1
+        stats['wait_sum'] += wait
+        if wait > stats['wait_max']:
+            stats['wait_max'] = wait
+        waiter.state = 'granted'
+        waiter.event.set()
+        if self.sink is not None:
+            self.sink.observe('queue_wait', wait, priority=waiter.priority)
+
+    def _drop(self, waiter):
+        if waiter.in_queue:
+            self._dequeue(waiter)
+        waiter.state = 'dropped'
+        waiter.event.set()
+        self._stats[waiter.priority]['dropped'] += 1
+        logger.debug('Request of %s (%s) is dropped by deadline', waiter.tenant, waiter.priority)
+        if self.sink is not None:
+            self.sink.increment('queue_dropped', priority=waiter.priority)
+
+
+__all__ = ('RequestScheduler', 'SchedulerError', 'call_options', 'get_call_options',
+           'PRIORITY_INTERACTIVE', 'PRIORITY_DEFAULT', 'PRIORITY_BATCH')
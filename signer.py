@@ -0,0 +1,609 @@
+import os
+import sys
+import json
+import hmac
+import queue
+import base64
+import struct
+import socket
+import asyncio
+import hashlib
+import argparse
+import ipaddress
+import threading
+import socketserver
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# `struct ucred` of `SO_PEERCRED`: pid, uid, gid
+PEER_CREDENTIALS = struct.Struct('3i')
+
+
+class SignerError(Exception):
+    def __init__(self, message, code=-1):
+        super().__init__(message, code)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return '{}: {}'.format(self.code, self.message)
+
+
+class Signer:
+    """
+    A base class for request signers
+
+    A signer gets a signing string (values of request fields joined in order of keys) and returns
+    fields to add to the request. Implementations must be thread-safe.
+
+    Methods
+    -------
+    sign()
+        sign a string
+    sign_async()
+        sign a string in a coroutine
+    close()
+        release resources
+    """
+
+    def sign(self, content):
+        """
+        Signs a string
+
+        Parameters
+        ----------
+        content[str]: a signing string
+
+        Returns
+        -------
+        dict: request fields:
+            - DigestValue[str] - a base64-encoded hash
+            - SignatureValue[str] - a base64-encoded signature of the hash
+            - X509SerialNumber[str] - a hex serial of the certificate
+
+        Raises
+        ------
+        SignerError: when the string cannot be signed
+        """
+
+        raise NotImplementedError
+
+    async def sign_async(self, content):
+        """
+        Signs a string in a coroutine, `sign()` is run in the default executor unless overridden
+
+        Parameters
+        ----------
+        see `sign()`
+
+        Returns
+        -------
+        see `sign()`
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.sign, content)
+
+    def close(self):
+        """
+        Releases resources
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CryptoProSigner(Signer):
+    """
+    A signer which runs CryptoPro tools for every string (see `CryptoPro`)
+    """
+
+    def __init__(self, cryptopro=None, **params):
+        """
+        Parameters
+        ----------
+        cryptopro[CryptoPro]: CryptoPro instance (created with `params` when None)
+        **params: `CryptoPro` parameters (like `container_name`)
+        """
+
+        if cryptopro is None:
+            try:
+                from .cryptopro import CryptoPro
+            except ImportError:
+                from cryptopro import CryptoPro
+            cryptopro = CryptoPro(**params)
+        self.cryptopro = cryptopro
+
+    def sign(self, content):
+        try:
+            digest = self.cryptopro.get_hash(content)
+        except Exception as e:
+            raise SignerError('Cannot generate digest') from e
+
+        try:
+            sign = self.cryptopro.get_sign(digest)
+        except Exception as e:
+            raise SignerError('Cannot generate signature') from e
+
+        try:
+            serial = self.cryptopro.get_certificate_serial()
+        except Exception as e:
+            raise SignerError('Cannot get certificate serial') from e
+
+        return {
+            'DigestValue': self.cryptopro.to_base64(digest),
+            'SignatureValue': self.cryptopro.to_base64(sign),
+            'X509SerialNumber': serial,
+        }
+
+
+class PooledSigner(Signer):
+    """
+    A signer which shares a fixed pool of signers: at most `size` strings are signed at once
+    and other callers wait for a free signer
+    """
+
+    def __init__(self, signers=None, size=4, signer=None, timeout=None):
+        """
+        Parameters
+        ----------
+        signers[list]: signers of the pool
+        size[int]: a pool size when `signers` are not given
+        signer[dict]: a backend config to create `size` signers with (see `create_signer()`)
+        timeout[float]: seconds to wait for a free signer (unlimited by default)
+        """
+
+        if signers is None:
+            assert signer is not None, 'Signers or a signer config must be defined'
+            signers = [create_signer(signer) for _ in range(size)]
+
+        self.signers = list(signers)
+        self.timeout = timeout
+
+        self._free = queue.LifoQueue()
+        for item in self.signers:
+            self._free.put(item)
+
+    def sign(self, content):
+        try:
+            signer = self._free.get(timeout=self.timeout)
+        except queue.Empty:
+            raise SignerError('No free signer in {} seconds'.format(self.timeout))
+        try:
+            return signer.sign(content)
+        finally:
+            self._free.put(signer)
+
+    def close(self):
+        for signer in self.signers:
+            signer.close()
+
+
+class RemoteSigner(Signer):
+    """
+    A client of a signer daemon (see `SignerServer`), a connection is kept per thread
+
+    The protocol is line-delimited JSON: a request is `{"content": ...}` and a response
+    contains request fields or `{"error": ..., "code": ...}`. With a secret, a connection starts
+    with a handshake: the daemon sends `{"challenge": ...}` and a client answers
+    `{"response": ...}` with HMAC-SHA-256 of the challenge.
+    """
+
+    def __init__(self, address, timeout=10.0, secret=None):
+        """
+        Parameters
+        ----------
+        address[str, tuple]: a Unix socket path or a (host, port) pair
+        timeout[float]: seconds to wait for a response
+        secret[str]: a secret shared with the daemon (required by a TCP daemon)
+        """
+
+        self.address = tuple(address) if isinstance(address, list) else address
+        self.timeout = timeout
+        self.secret = secret
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def sign(self, content):
+        request = self._encode(content)
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection[1].write(request)
+                connection[1].flush()
+                line = connection[1].readline()
+                if not line:
+                    raise ConnectionError('Connection is closed')
+                break
+            except (OSError, ValueError) as e:
+                # ValueError: the connection is closed by `close()`
+                self._drop_connection()
+                if attempt:
+                    raise SignerError('Signer daemon is not available: {}'.format(e)) from e
+        return self._decode(line)
+
+    async def sign_async(self, content):
+        try:
+            if isinstance(self.address, str):
+                reader, writer = await asyncio.open_unix_connection(self.address)
+            else:
+                reader, writer = await asyncio.open_connection(*self.address)
+        except OSError as e:
+            raise SignerError('Signer daemon is not available: {}'.format(e)) from e
+        try:
+            if self.secret is not None:
+                writer.write(self._get_handshake(await asyncio.wait_for(reader.readline(), self.timeout)))
+            writer.write(self._encode(content))
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise SignerError('Signer daemon is not available: {}'.format(e)) from e
+        finally:
+            writer.close()
+        return self._decode(line)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for sock, file in connections:
+            file.close()
+            sock.close()
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if isinstance(self.address, str):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except OSError as e:
+                sock.close()
+                raise SignerError('Signer daemon is not available: {}'.format(e)) from e
+            connection = (sock, sock.makefile('rwb'))
+            if self.secret is not None:
+                try:
+                    connection[1].write(self._get_handshake(connection[1].readline()))
+                    connection[1].flush()
+                except (OSError, SignerError) as e:
+                    connection[1].close()
+                    sock.close()
+                    if isinstance(e, SignerError):
+                        raise
+                    raise SignerError('Signer daemon is not available: {}'.format(e)) from e
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        self._local.connection = None
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        connection[1].close()
+        connection[0].close()
+
+    def _encode(self, content):
+        return json.dumps({'content': content}).encode('utf-8') + b'\n'
+
+    def _get_handshake(self, line):
+        try:
+            challenge = json.loads(line)['challenge']
+        except (ValueError, KeyError, TypeError) as e:
+            raise SignerError('Got invalid handshake from signer daemon') from e
+        return json.dumps({'response': _get_auth_response(self.secret, challenge)}).encode('utf-8') + b'\n'
+
+    def _decode(self, line):
+        try:
+            result = json.loads(line)
+        except ValueError as e:
+            raise SignerError('Got invalid response from signer daemon') from e
+        if 'error' in result:
+            raise SignerError(result['error'], result.get('code', -1))
+        if 'challenge' in result:
+            raise SignerError('Signer daemon requires a secret')
+        return result
+
+
+class FakeSigner(Signer):
+    """
+    An in-memory signer for tests and benchmarks: a digest is SHA-256 of a string
+    and a signature is HMAC-SHA-256 of the digest, so both of them depend only on the string
+    """
+
+    def __init__(self, key='fake', serial='fake'):
+        """
+        Parameters
+        ----------
+        key[str]: an HMAC key
+        serial[str]: a certificate serial to return
+        """
+
+        self.key = key.encode('utf-8')
+        self.serial = serial
+
+    def sign(self, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        digest = hashlib.sha256(content).digest()
+        return {
+            'DigestValue': base64.b64encode(digest).decode('ascii'),
+            'SignatureValue': base64.b64encode(hmac.new(self.key, digest, hashlib.sha256).digest()).decode('ascii'),
+            'X509SerialNumber': self.serial,
+        }
+
+    async def sign_async(self, content):
+        return self.sign(content)
+
+
+class SignerServer:
+    """
+    A signer daemon: serves `RemoteSigner` clients with a signer, every connection in its own thread
+
+    The daemon signs anything it's asked for, so it accepts only trusted clients. A Unix socket
+    is accessible by the owner only (mode 0600) and a peer must run as the same user (checked with
+    `SO_PEERCRED` where it's supported). A TCP daemon listens only on a loopback address and requires
+    a shared secret: a client proves it knows the secret by a challenge-response handshake.
+
+    Methods
+    -------
+    serve_forever()
+        handle requests until `shutdown()`
+    shutdown()
+        stop handling requests (from another thread) and close the server
+    close()
+        close the server
+    """
+
+    def __init__(self, signer, address, secret=None):
+        """
+        Parameters
+        ----------
+        signer[Signer]: a signer to serve
+        address[str, tuple]: a Unix socket path or a (host, port) pair (port 0 to pick a free one)
+        secret[str]: a secret shared with clients (required for TCP)
+
+        Raises
+        ------
+        SignerError: when a TCP address is not a loopback one or a secret is not set for it
+        """
+
+        if not isinstance(address, str):
+            if not _is_loopback(address[0]):
+                raise SignerError('Signer daemon must listen on a loopback address, got {}'.format(address[0]))
+            if not secret:
+                raise SignerError('Signer daemon must have a secret to listen on TCP')
+
+        self.signer = signer
+        self.secret = secret
+        owner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if owner.secret is not None and not owner._authenticate(self.rfile, self.wfile):
+                    return
+                for line in self.rfile:
+                    self.wfile.write(owner._handle(line))
+                    self.wfile.flush()
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _ThreadingUnixServer(address, Handler)
+        else:
+            self.server = _ThreadingTCPServer(tuple(address), Handler)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.close()
+
+    def close(self):
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _authenticate(self, rfile, wfile):
+        # A client answers a random challenge, so the secret is never sent and an answer can't be replayed
+        challenge = os.urandom(16).hex()
+        wfile.write(json.dumps({'challenge': challenge}).encode('utf-8') + b'\n')
+        wfile.flush()
+        try:
+            response = str(json.loads(rfile.readline())['response'])
+        except (ValueError, KeyError, TypeError):
+            response = ''
+        if hmac.compare_digest(response.encode('utf-8'), _get_auth_response(self.secret, challenge).encode('ascii')):
+            return True
+        logger.warning('Signer client is not authenticated')
+        wfile.write(json.dumps({'error': 'Client is not authenticated', 'code': -1}).encode('utf-8') + b'\n')
+        wfile.flush()
+        return False
+
+    def _handle(self, line):
+        try:
+            result = self.signer.sign(json.loads(line)['content'])
+        except SignerError as e:
+            result = {'error': e.message, 'code': e.code}
+        except Exception as e:
+            logger.exception('Cannot sign')
+            result = {'error': str(e), 'code': -1}
+        return json.dumps(result).encode('utf-8') + b'\n'
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def server_bind(self):
+        super().server_bind()
+        # The socket doesn't listen yet, so no one connects before its mode is set
+        os.chmod(self.server_address, 0o600)
+        self.uid = os.getuid()
+
+    def verify_request(self, request, client_address):
+        if not hasattr(socket, 'SO_PEERCRED'):
+            # The mode of the socket is the only check
+            return True
+        _, uid, _ = PEER_CREDENTIALS.unpack(
+            request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size)
+        )
+        if uid != self.uid:
+            logger.warning('Signer client of user %d is rejected', uid)
+            return False
+        return True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def _is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _get_auth_response(secret, challenge):
+    return hmac.new(secret.encode('utf-8'), challenge.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+SIGNERS = {
+    'cryptopro': CryptoProSigner,
+    'pooled': PooledSigner,
+    'remote': RemoteSigner,
+    'fake': FakeSigner,
+}
+
+
+def register_signer(name, factory):
+    """
+    Registers a signer backend
+
+    Parameters
+    ----------
+    name[str]: a backend name
+    factory[callable]: a class or a function which takes config params and returns a signer
+    """
+
+    SIGNERS[name] = factory
+
+
+def create_signer(config):
+    """
+    Creates a signer by config
+
+    Parameters
+    ----------
+    config[dict]: `backend` (`cryptopro`, `pooled`, `remote`, `fake` or a registered one)
+        and params of the backend, like:
+            {'backend': 'cryptopro', 'container_name': '...', 'store_name': 'uMy'}
+            {'backend': 'pooled', 'size': 4, 'signer': {'backend': 'cryptopro', ...}}
+            {'backend': 'remote', 'address': '/run/signer.sock'}
+
+    Returns
+    -------
+    Signer: a signer
+
+    Raises
+    ------
+    SignerError: when a backend is unknown
+    """
+
+    params = dict(config)
+    backend = params.pop('backend', 'cryptopro')
+    if backend not in SIGNERS:
+        raise SignerError('Unknown signer backend {}'.format(backend))
+    return SIGNERS[backend](**params)
+
+
+def main(argv=None):
+    """
+    Runs a signer daemon:
+
+        python -m signer --socket PATH [options]
+        python -m signer --port PORT --secret-file PATH [options]
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m signer')
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket', help='a Unix socket path to listen')
+    address.add_argument('--port', type=int, help='a TCP port to listen')
+    parser.add_argument('--host', default='127.0.0.1', help='a loopback host to listen with --port')
+    parser.add_argument('--secret-file', help='a file with a secret shared with clients (required with --port)')
+    parser.add_argument('--config', help='a JSON signer config (see create_signer)')
+    parser.add_argument('--container', help='CryptoPro container name')
+    parser.add_argument('--store', default='uMy', help='CryptoPro certificate store name')
+    parser.add_argument('--provider', type=int, default=80, help='CryptoPro encryption provider')
+    parser.add_argument('--algorithm', default='GOST12_256', help='CryptoPro sign algorithm')
+    parser.add_argument('--pool-size', type=int, default=4, help='a number of simultaneous CryptoPro calls')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log requests')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    if args.config:
+        config = json.loads(args.config)
+    else:
+        config = {
+            'backend': 'pooled',
+            'size': args.pool_size,
+            'signer': {
+                'backend': 'cryptopro',
+                'container_name': args.container,
+                'store_name': args.store,
+                'encryption_provider': args.provider,
+                'sign_algorithm': args.algorithm,
+            },
+        }
+
+    secret = None
+    if args.secret_file:
+        with open(args.secret_file) as f:
+            secret = f.read().strip()
+
+    try:
+        server = SignerServer(create_signer(config), args.socket or (args.host, args.port), secret=secret)
+    except SignerError as e:
+        parser.error(e.message)
+    logger.info('Signer is listening on %s', server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+__all__ = ('Signer', 'SignerError', 'CryptoProSigner', 'PooledSigner', 'RemoteSigner', 'FakeSigner', 'SignerServer',
+           'register_signer', 'create_signer')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
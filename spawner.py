@@ -0,0 +1,330 @@
+import os
+import sys
+import time
+import struct
+import pickle
+import signal
+import selectors
+import subprocess
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+HEADER = struct.Struct('<I')
+
+_usages = contextvars.ContextVar('spawner_usages', default=None)
+
+
+@contextmanager
+def collect_usage():
+    """
+    Collects resource usage of commands run in a block (in the current thread or task)
+
+        with collect_usage() as usages:
+            run_command(['csptest', ...])
+
+    A usage is a dict:
+        - command[str] - a command name
+        - elapsed[float] - seconds of running
+        - cpu_user[float] - user CPU seconds
+        - cpu_system[float] - system CPU seconds
+        - max_rss[int] - a maximum resident set size in KB
+
+    Yields
+    ------
+    list: usages (appended as commands finish)
+    """
+
+    usages = []
+    token = _usages.set(usages)
+    try:
+        yield usages
+    finally:
+        _usages.reset(token)
+
+
+def is_collecting_usage():
+    """
+    Returns True when usage of commands is collected (see `collect_usage()`)
+    """
+
+    return _usages.get() is not None
+
+
+def run_command(args):
+    """
+    Runs a command and returns its result, `posix_spawn` is used where it is available
+    (it doesn't copy page tables of a calling process), `subprocess` otherwise.
+    Resource usage of the command is added to `collect_usage()` usages (with `posix_spawn` only).
+
+    Parameters
+    ----------
+    args[list]: a command and its arguments
+
+    Returns
+    -------
+    tuple: a return code, stdout and stderr bytes
+
+    Raises
+    ------
+    OSError: when the command cannot be started
+    """
+
+    if not hasattr(os, 'posix_spawn'):
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.returncode, result.stdout, result.stderr
+
+    code, stdout, stderr, usage = _spawn(args)
+    usages = _usages.get()
+    if usages is not None:
+        usages.append(usage)
+    return code, stdout, stderr
+
+
+def _spawn(args):
+    started = time.monotonic()
+    out_read, out_write = os.pipe()
+    err_read, err_write = os.pipe()
+    try:
+        pid = os.posix_spawnp(args[0], args, os.environ, file_actions=[
+            (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+            (os.POSIX_SPAWN_DUP2, out_write, 1),
+            (os.POSIX_SPAWN_DUP2, err_write, 2),
+        ])
+    except BaseException:
+        for fd in (out_read, err_read):
+            os.close(fd)
+        raise
+    finally:
+        os.close(out_write)
+        os.close(err_write)
+
+    output = {out_read: [], err_read: []}
+    with selectors.DefaultSelector() as selector:
+        for fd in output:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    output[key.fd].append(chunk)
+                else:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+
+    # `wait4()` costs the same as `waitpid()` and also returns resource usage of the child
+    _, status, rusage = os.wait4(pid, 0)
+    usage = {
+        'command': os.path.basename(args[0]),
+        'elapsed': time.monotonic() - started,
+        'cpu_user': rusage.ru_utime,
+        'cpu_system': rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss,
+    }
+    return os.waitstatus_to_exitcode(status), b''.join(output[out_read]), b''.join(output[err_read]), usage
+
+
+class Spawner:
+    """
+    Runs commands through a small helper process
+
+    Every spawn of a child process from a large process costs copying of its page tables
+    (or at least of its mappings). The helper is a fresh Python interpreter with a few MB
+    of memory: it gets commands over a pipe, runs them concurrently and sends their results back.
+    The helper itself is spawned once, so it's better to create a spawner early, before
+    an application grows. When the helper is disabled or exited, commands are run
+    by the calling process with `run_command()`.
+
+    Methods
+    -------
+    run()
+        run a command
+    close()
+        stop the helper
+    """
+
+    def __init__(self, helper=True, max_workers=16):
+        """
+        Parameters
+        ----------
+        helper[bool]: use a helper process
+        max_workers[int]: a maximum number of commands the helper runs at once
+        """
+
+        self.max_workers = max_workers
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._futures = {}
+        self._counter = 0
+        self._process = None
+
+        if helper:
+            self._process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(max_workers)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            self._reader = threading.Thread(target=self._read_results, name='spawner-reader', daemon=True)
+            self._reader.start()
+
+    @property
+    def is_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def run(self, args, timeout=None):
+        """
+        Runs a command
+
+        Parameters
+        ----------
+        args[list]: a command and its arguments
+        timeout[float]: seconds to wait for a result (unlimited by default)
+
+        Returns
+        -------
+        tuple: a return code, stdout and stderr bytes
+
+        Raises
+        ------
+        OSError: when the command cannot be started or the helper is exited while running it
+        TimeoutError: when the result is not received in time
+        """
+
+        args = [os.fspath(x) for x in args]
+        if not self.is_alive:
+            return run_command(args)
+
+        future = Future()
+        with self._lock:
+            self._counter += 1
+            request_id = self._counter
+            self._futures[request_id] = future
+
+        try:
+            with self._write_lock:
+                _write_frame(self._process.stdin, (request_id, args))
+        except (OSError, ValueError):
+            with self._lock:
+                self._futures.pop(request_id, None)
+            logger.warning('Spawner helper is not available, running %s locally', args[0])
+            return run_command(args)
+
+        code, stdout, stderr, usage = future.result(timeout)
+        if isinstance(code, BaseException):
+            raise code
+        usages = _usages.get()
+        if usages is not None and usage is not None:
+            usages.append(usage)
+        return code, stdout, stderr
+
+    def close(self):
+        """
+        Stops the helper after it finishes running commands
+        """
+
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        self._process.wait()
+        self._reader.join()
+        self._process.stdout.close()
+        self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read_results(self):
+        stream = self._process.stdout
+        while True:
+            try:
+                message = _read_frame(stream)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                message = None
+            if message is None:
+                break
+            request_id, code, stdout, stderr, usage = message
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is not None:
+                future.set_result((code, stdout, stderr, usage))
+
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_result((OSError('Spawner helper is exited'), None, None, None))
+
+
+def _write_frame(stream, message):
+    content = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(HEADER.pack(len(content)) + content)
+    stream.flush()
+
+
+def _read_frame(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    size, = HEADER.unpack(header)
+    content = stream.read(size)
+    if len(content) < size:
+        return None
+    return pickle.loads(content)
+
+
+def _serve(max_workers):
+    """
+    The helper loop: reads commands from stdin and writes results to stdout
+    """
+
+    requests = sys.stdin.buffer
+    results = sys.stdout.buffer
+    # Nothing but results must be written to the protocol stream
+    sys.stdout = sys.stderr
+    # The helper exits when the parent closes the pipe, not on a terminal's Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    lock = threading.Lock()
+
+    def proceed(request_id, args):
+        # Every request must get a result frame, otherwise the parent waits for it forever
+        usages = None
+        try:
+            with collect_usage() as usages:
+                code, stdout, stderr = run_command(args)
+        except Exception as e:
+            code, stdout, stderr = e, None, None
+        usage = usages[0] if usages else None
+        with lock:
+            try:
+                _write_frame(results, (request_id, code, stdout, stderr, usage))
+            except Exception as e:
+                # A result which cannot be pickled is passed as an error message
+                error = code if isinstance(code, Exception) else e
+                error = RuntimeError('{}: {}'.format(type(error).__name__, error))
+                _write_frame(results, (request_id, error, None, None, None))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            message = _read_frame(requests)
+            if message is None:
+                break
+            executor.submit(proceed, *message)
+
+
+__all__ = ('Spawner', 'run_command', 'collect_usage', 'is_collecting_usage')
+
+
+if __name__ == '__main__':
+    _serve(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
@@ -1,2 +1,21 @@
 from .test_cryptopro import CryptoProTestCase
 from .test_tinkoff import TinkoffTestCase
+from .test_journal import PayoutJournalTestCase, TinkoffJournalTestCase
+from .test_reconcile import ReconcilerTestCase
+from .test_ratelimit import RateLimiterTestCase
+from .test_adaptive import AdaptiveLimiterTestCase
+from .test_receiver import NotificationReceiverTestCase
+from .test_transport import TransportTestCase
+from .test_cache import SharedCacheTestCase
+from .test_spawner import SpawnerTestCase
+from .test_capacity import CapacityBenchmarkTestCase
+from .test_watcher import PaymentWatcherTestCase
+from .test_registry import TinkoffRegistryTestCase
+from .test_signer import FakeSignerTestCase, PooledSignerTestCase, RemoteSignerTestCase, CryptoProSignerTestCase, SignerTestCase
+from .test_concurrency import ConcurrencyTestCase
+from .test_scheduler import RequestSchedulerTestCase
+from .test_recorder import TrafficRecorderTestCase
+from .test_audit import AuditLogTestCase
+from .test_profiler import SlowRequestProfilerTestCase
+from .test_presign import PresignedStoreTestCase
+from .test_history import StatusHistoryTestCase
@@ -0,0 +1,131 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from adaptive import AdaptiveLimiter, AdaptiveLimitError, is_overload
+from tinkoff import Tinkoff, TinkoffError
+from signer import FakeSigner
+
+
+
+class CapacityStub:
+    """
+    A fake bank which serves `capacity` requests at once, a request takes longer
+    in proportion to the number of requests above the capacity
+    """
+
+    def __init__(self, capacity, latency):
+        self.capacity = capacity
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+    def __call__(self, method, url, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            latency = self.latency * max(1.0, self.in_flight / self.capacity)
+        try:
+            time.sleep(latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        # The stub doesn't depend on a request encoding, a payment id isn't checked by a client
+        return {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}, 200, {}
+
+
+class AdaptiveLimiterTestCase(TestCase):
+    def test_increase(self):
+        limiter = AdaptiveLimiter(initial=2, max_limit=4)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_decrease(self):
+        limiter = AdaptiveLimiter(initial=8, smoothing=1.0)
+        limiter.acquire()
+        limiter.release(0.01)
+        limiter.acquire()
+        limiter.release(0.1)
+        self.assertEqual(limiter.limit, 4)
+
+        limiter = AdaptiveLimiter(initial=8)
+        limiter.acquire()
+        limiter.release(0.01, TinkoffError('Request is failed'))
+        self.assertEqual(limiter.limit, 8)
+        limiter.acquire()
+        limiter.release(0.01, TimeoutError())
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.metrics()['decreases'], 1)
+
+    def test_baseline(self):
+        limiter = AdaptiveLimiter(initial=8, smoothing=1.0, baseline_window=0.05)
+        limiter.acquire()
+        limiter.release(0.01)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(0.1)
+        self.assertLess(limiter.limit, 8)
+        self.assertEqual(limiter.metrics()['baseline'], 0.01)
+
+        # A lasting rise of latency becomes the new baseline after two windows, so the limit grows again
+        time.sleep(0.11)
+        limit = limiter.limit
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(0.1)
+        self.assertEqual(limiter.metrics()['baseline'], 0.1)
+        self.assertGreater(limiter.limit, limit)
+
+    def test_timeout(self):
+        limiter = AdaptiveLimiter(initial=1, timeout=0.01)
+        limiter.acquire()
+        with self.assertRaises(AdaptiveLimitError):
+            limiter.acquire()
+        limiter.release(0.01)
+        limiter.acquire()
+
+    def test_is_overload(self):
+        class Response:
+            status_code = 503
+
+        class HTTPError(Exception):
+            response = Response()
+
+        try:
+            try:
+                raise HTTPError()
+            except HTTPError as e:
+                raise TinkoffError('Request is failed') from e
+        except TinkoffError as e:
+            self.assertTrue(is_overload(e))
+        self.assertFalse(is_overload(TinkoffError('Some error', '1')))
+        # The bank throttles with HTTP 200 and an error code
+        self.assertTrue(is_overload(TinkoffError('Internal error', '9999')))
+        self.assertTrue(is_overload(TinkoffError('Too many requests', '42'), codes={'42'}))
+
+    def test_capacity(self):
+        stub = CapacityStub(capacity=4, latency=0.005)
+        limiter = AdaptiveLimiter(initial=1, max_limit=32, tolerance=1.5)
+        tinkoff = Tinkoff('test_key', None, signer=FakeSigner(), is_test=True, concurrency_limiter=limiter)
+
+        limits = []
+
+        def worker():
+            for i in range(40):
+                tinkoff.get_payment(str(i))
+                limits.append(limiter.limit)
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=stub):
+            threads = [threading.Thread(target=worker) for _ in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertGreater(limiter.metrics()['decreases'], 0)
+        # Last calls are made by few threads, so the limit is checked while all threads are running
+        limits = sorted(limits[:len(limits) // 2])
+        self.assertGreaterEqual(limits[len(limits) // 2], 2)
+        self.assertLessEqual(limits[len(limits) // 2], 8)
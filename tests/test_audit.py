@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from audit import AuditLog
+from tinkoff import Tinkoff
+from signer import FakeSigner
+
+
+
+def get_record(index):
+    return {
+        'time': time.time(),
+        'terminal': 'terminal_key',
+        'operation': 'GetState',
+        'method': 'POST',
+        'data': {'PaymentId': index},
+        'request_size': 100,
+        'sign_latency': 0.001,
+        'latency': 0.01,
+        'result': 'ok',
+        'status': 200,
+        'response': {'Success': True, 'PaymentId': index, 'Status': 'COMPLETED', 'Message': 'Платеж'},
+        'error': None,
+    }
+
+
+class AuditLogTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'audit.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write(self):
+        with AuditLog(self.path, flush_interval=60) as audit:
+            for i in range(10):
+                audit(get_record(i))
+            self.assertTrue(audit.flush(timeout=5))
+            self.assertEqual(len(self._read(self.path)), 10)
+            for i in range(10, 15):
+                audit(get_record(i))
+
+        records = self._read(self.path)
+        self.assertEqual([x['data']['PaymentId'] for x in records], list(range(15)))
+        self.assertEqual(records[0]['response']['Message'], 'Платеж')
+        self.assertEqual(audit.written, 15)
+        self.assertEqual(audit.dropped, 0)
+        self.assertEqual(audit.overflow, 'drop')
+
+    def test_tinkoff(self):
+        audit = AuditLog(self.path)
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), hooks=[audit])
+        response = {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}
+        with patch('tinkoff.Tinkoff._proceed_request', return_value=(response, 200, {})):
+            tinkoff.get_payment(1)
+        audit.close()
+
+        records = self._read(self.path)
+        self.assertEqual(records[0]['operation'], 'GetState')
+        self.assertEqual(records[0]['data'], {'PaymentId': 1})
+        self.assertEqual(records[0]['response'], response)
+
+    def test_rotation(self):
+        with AuditLog(self.path, max_bytes=2000, backup_count=2, batch_size=1) as audit:
+            for i in range(30):
+                audit(get_record(i))
+                audit.flush(timeout=5)
+
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        for path in (self.path, self.path + '.1', self.path + '.2'):
+            self.assertLessEqual(os.path.getsize(path), 2000)
+        self.assertEqual(self._read(self.path)[-1]['data']['PaymentId'], 29)
+
+    def test_overflow(self):
+        for overflow, expected in (('drop', list(range(5))), ('drop_oldest', list(range(5, 10)))):
+            path = os.path.join(self.dir, overflow)
+            with AuditLog(path, buffer_size=5, flush_interval=60, overflow=overflow) as audit:
+                # The writer is woken up only by a full batch, hold it until the buffer overflows
+                with patch.object(audit, '_wakeup', threading.Event()), self.assertLogs('audit', 'WARNING') as logs:
+                    for i in range(10):
+                        audit(get_record(i))
+                self.assertEqual(audit.dropped, 5)
+                # Drops are reported once per interval
+                self.assertEqual(len(logs.records), 1)
+            self.assertEqual([x['data']['PaymentId'] for x in self._read(path)], expected)
+
+        # Concurrent requests never put more records than the buffer holds
+        path = os.path.join(self.dir, 'concurrent')
+        with AuditLog(path, buffer_size=5, flush_interval=60) as audit:
+            with patch.object(audit, '_wakeup', threading.Event()), self.assertLogs('audit', 'WARNING'):
+                threads = [threading.Thread(target=lambda: [audit(get_record(i)) for i in range(100)])
+                           for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(audit._buffer), 5)
+                self.assertEqual(audit.dropped, 795)
+
+        path = os.path.join(self.dir, 'block')
+        with AuditLog(path, buffer_size=5, batch_size=5, flush_interval=60, overflow='block') as audit:
+            for i in range(100):
+                audit(get_record(i))
+        self.assertEqual(audit.dropped, 0)
+        self.assertEqual(len(self._read(path)), 100)
+
+    def test_overhead(self):
+        with AuditLog(self.path, buffer_size=100000, batch_size=100000, flush_interval=60) as audit:
+            record = get_record(1)
+            count = 20000
+            started = time.perf_counter()
+            for _ in range(count):
+                audit(record)
+            elapsed = (time.perf_counter() - started) / count
+        self.assertLess(elapsed, 20e-6)
+        self.assertEqual(len(self._read(self.path)), count)
+
+    def _read(self, path):
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(x) for x in f]
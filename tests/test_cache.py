@@ -0,0 +1,128 @@
+import os
+import time
+import tempfile
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+
+from cache import SharedCache
+from tinkoff import Tinkoff, Payment
+from cryptopro import CryptoPro
+from signer import FakeSigner
+
+
+
+def _write_and_read(path, worker):
+    cache = SharedCache(path)
+    for i in range(50):
+        cache.set('key:{}:{}'.format(worker, i), i)
+    return sum(cache.get('key:{}:{}'.format(worker, i)) for i in range(50))
+
+
+class SharedCacheTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite')
+        self.cache = SharedCache(self.path, default_ttl=60, max_entries=50)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', 1), 1)
+        self.cache.set('key', Payment('1', 'COMPLETED'))
+        self.assertEqual(self.cache.get('key')['status'], 'COMPLETED')
+        self.assertEqual(SharedCache(self.path).get('key')['payment_id'], '1')
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_permissions(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+        # Cached values are unpickled, so a file which anyone can write to is refused
+        os.chmod(self.path, 0o666)
+        with self.assertRaises(PermissionError):
+            SharedCache(self.path)
+
+    def test_ttl(self):
+        self.cache.set('key', 'value', ttl=0.05)
+        self.assertEqual(self.cache.get('key'), 'value')
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_eviction(self):
+        for i in range(100):
+            self.cache.set('key:{}'.format(i), i, ttl=60 + i)
+        self.assertIsNone(self.cache.get('key:0'))
+        self.assertEqual(self.cache.get('key:99'), 99)
+
+    def test_processes(self):
+        context = multiprocessing.get_context('fork')
+        with context.Pool(4) as pool:
+            results = pool.starmap(_write_and_read, [(self.path, x) for x in range(4)])
+        self.assertEqual(results, [sum(range(50))] * 4)
+
+    def test_cryptopro(self):
+        cryptopro = CryptoPro(container_name='container', store_name='uMy', cache=self.cache)
+        other = CryptoPro(container_name='container', store_name='uMy', cache=SharedCache(self.path))
+        with patch('cryptopro.CryptoPro._find_certificate_serial', return_value='hexserial') as find_mock:
+            self.assertEqual(cryptopro.get_certificate_serial(), 'hexserial')
+            self.assertEqual(other.get_certificate_serial(), 'hexserial')
+            self.assertEqual(find_mock.call_count, 1)
+
+    def test_tinkoff(self):
+        tinkoff = Tinkoff('test_key', None, signer=FakeSigner(), is_test=True, cache=self.cache)
+        other = Tinkoff('test_key', None, signer=FakeSigner(), is_test=True, cache=SharedCache(self.path))
+        responses = {
+            'GetState': {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'},
+            'GetCardList': [{'CardId': 1, 'Pan': '4444', 'Status': 'A', 'CardType': 1}],
+            'RemoveCard': {'Success': True, 'CardId': 1, 'Status': 'D'},
+        }
+        calls = []
+
+        def side_effect(method, url, **kwargs):
+            operation = url.rsplit('/', 1)[-1]
+            calls.append(operation)
+            return responses[operation], 200, {}
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            self.assertEqual(tinkoff.get_payment('1')['status'], 'COMPLETED')
+            self.assertEqual(other.get_payment('1')['status'], 'COMPLETED')
+            self.assertEqual(tinkoff.get_cards('1')[0]['card_id'], 1)
+            self.assertEqual(other.get_cards('1')[0]['card_id'], 1)
+            other.delete_card(1, '1')
+            tinkoff.get_cards('1')
+
+        self.assertEqual(calls, ['GetState', 'GetCardList', 'RemoveCard', 'GetCardList'])
+
+    def test_tinkoff_add_card(self):
+        tinkoff = Tinkoff('test_key', None, signer=FakeSigner(), is_test=True, cache=self.cache, pending_cards_ttl=0.05)
+        cards = [{'CardId': 1, 'Pan': '4444', 'Status': 'A', 'CardType': 1}]
+        responses = {
+            'AddCard': {'Success': True, 'RequestKey': '1', 'PaymentURL': 'https://redirect.url/'},
+            'GetCardList': cards,
+        }
+        calls = []
+
+        def side_effect(method, url, **kwargs):
+            operation = url.rsplit('/', 1)[-1]
+            calls.append(operation)
+            return responses[operation], 200, {}
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            tinkoff.create_card('1')
+            self.assertEqual(len(tinkoff.get_cards('1')), 1)
+            self.assertEqual(len(tinkoff.get_cards('1')), 1)
+
+            # The client completes the form after the list is cached
+            cards.append({'CardId': 2, 'Pan': '5555', 'Status': 'A', 'CardType': 1})
+            time.sleep(0.06)
+            self.assertEqual(len(tinkoff.get_cards('1')), 2)
+
+            tinkoff.invalidate_cards('1')
+            self.assertEqual(len(tinkoff.get_cards('1')), 2)
+            time.sleep(0.06)
+            self.assertEqual(len(tinkoff.get_cards('1')), 2)
+
+        self.assertEqual(calls, ['AddCard', 'GetCardList', 'GetCardList', 'GetCardList'])
@@ -0,0 +1,89 @@
+import io
+import os
+import time
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from capacity import CapacityBenchmark
+from cryptopro import ContainerQueue, main
+
+
+CSPTEST = '''#!/bin/sh
+out=''
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -enum_cont) echo '\\\\.\\HDIMAGE\\container|\\\\.\\HDIMAGE\\HDIMAGE\\\\cont.000\\0001'; exit 0 ;;
+        -hashout|-out) out="$2"; shift ;;
+    esac
+    shift
+done
+printf 'result' > "$out"
+'''
+
+CERTMGR = '''#!/bin/sh
+echo '======================================================================'
+echo '1-------'
+echo 'Serial              : 0x0011'
+echo 'Container           : HDIMAGE\\\\cont.000\\0001'
+echo '======================================================================'
+'''
+
+
+class LimitedCryptoPro:
+    """
+    Runs at most `capacity` operations at once in order of calls, like a host with `capacity` cores
+    """
+
+    def __init__(self, capacity, latency):
+        # A semaphore is unfair: a released thread may take it again, so latencies wouldn't grow evenly
+        self.queue = ContainerQueue(capacity)
+        self.latency = latency
+
+    def get_hash(self, content):
+        self.queue.acquire()
+        try:
+            time.sleep(self.latency)
+        finally:
+            self.queue.release()
+        return b'hash'
+
+    def get_sign(self, content):
+        raise OSError('No key')
+
+
+class CapacityBenchmarkTestCase(TestCase):
+    def test_saturation(self):
+        benchmark = CapacityBenchmark(LimitedCryptoPro(2, 0.01), concurrency=(1, 2, 4), sizes=(16,),
+                                      duration=0.3, operations=('get_hash', 'get_sign'))
+        results = benchmark.run()
+
+        hashes = [x for x in results if x['operation'] == 'get_hash']
+        self.assertEqual([x['concurrency'] for x in hashes if x['saturated']], [2])
+        self.assertGreater(hashes[1]['throughput'], hashes[0]['throughput'] * 1.5)
+        self.assertGreater(hashes[2]['p50'], hashes[1]['p50'] * 1.5)
+
+        signs = [x for x in results if x['operation'] == 'get_sign']
+        self.assertTrue(all(x['count'] == 0 and x['errors'] > 0 and not x['saturated'] for x in signs))
+        self.assertEqual(benchmark.recommend_pool_size(results), 2)
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, content in (('csptest', CSPTEST), ('certmgr', CERTMGR)):
+                path = os.path.join(directory, name)
+                with open(path, 'w') as f:
+                    f.write(content)
+                os.chmod(path, 0o755)
+
+            with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                code = main([
+                    '--container', '\\\\.\\HDIMAGE\\container', '--prefix', directory,
+                    'bench', '--concurrency', '1,2', '--sizes', '16,1024', '--duration', '0.1',
+                ])
+
+        self.assertEqual(code, 0)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 1 + 2 * 2 + 2 * 2 + 2 + 1)
+        self.assertTrue(lines[-1].startswith('recommended pool size: '))
+        self.assertIn('get_certificate_serial', lines[-2])
+        self.assertFalse(any(' 0.0 ' in x for x in lines[1:-1]))
@@ -0,0 +1,103 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from tinkoff import Tinkoff
+from signer import FakeSigner
+
+
+SIGN_FIELDS = ('DigestValue', 'SignatureValue', 'X509SerialNumber')
+
+
+class VerifyingHandler(BaseHTTPRequestHandler):
+    """
+    Checks a signature of every request and echoes request fields back in a response
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    signer = FakeSigner()
+    mismatches = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        content = ''.join(data[x] for x in sorted(data) if x not in SIGN_FIELDS)
+        if {x: data.get(x) for x in SIGN_FIELDS} != self.signer.sign(content):
+            self.mismatches.append(data)
+            return self._send({'Success': False, 'ErrorCode': '9', 'Message': 'Signature mismatch'})
+
+        operation = self.path.rsplit('/', 1)[-1]
+        if operation == 'Init':
+            self._send({'Success': True, 'PaymentId': 'p' + data['OrderId'], 'Status': 'NEW',
+                        'PaymentURL': data['DATA']})
+        elif operation == 'GetState':
+            self._send({'Success': True, 'PaymentId': data['PaymentId'], 'Status': 'CHECKING',
+                        'Amount': int(data['PaymentId'])})
+        elif operation == 'GetCustomer':
+            self._send({'Success': True, 'CustomerKey': data['CustomerKey'], 'Email': data['CustomerKey'] + '@test.ru'})
+        elif operation == 'GetCardList':
+            self._send([{'CardId': data['CustomerKey'], 'Pan': data['CustomerKey'], 'Status': 'A', 'CardType': 1}])
+        else:
+            self._send({'Success': False, 'ErrorCode': '1', 'Message': 'Unknown operation'})
+
+    def _send(self, result):
+        content = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ConcurrencyTestCase(TestCase):
+    threads = 16
+    operations = 2000
+
+    def setUp(self):
+        VerifyingHandler.mismatches = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), VerifyingHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/e2c/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_shared_client(self):
+        tinkoff = Tinkoff('test_key', None, signer=FakeSigner())
+        # The same dict is passed by all threads, it must not be changed
+        data = {'Phone': '+79001234567', 'Email': 'Иванов@test.ru'}
+
+        def run(index):
+            kind = index % 4
+            if kind == 0:
+                payment = tinkoff.create_payment('order-{}'.format(index), index, index / 100,
+                                                 data=dict(data, Index=index))
+                return payment['payment_id'] == 'porder-{}'.format(index) and \
+                    payment['url'].endswith('Index={}'.format(index))
+            if kind == 1:
+                payment = tinkoff.get_payment(index)
+                return payment['payment_id'] == str(index) and payment['amount'] == index / 100
+            if kind == 2:
+                client = tinkoff.get_client('client-{}'.format(index))
+                return client['email'] == 'client-{}@test.ru'.format(index)
+            cards = tinkoff.get_cards('client-{}'.format(index))
+            return [x['card_id'] for x in cards] == ['client-{}'.format(index)]
+
+        with patch('tinkoff.Tinkoff.prod_url', self.url):
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                results = list(executor.map(run, range(self.operations)))
+
+        self.assertEqual(VerifyingHandler.mismatches, [])
+        self.assertEqual([i for i, x in enumerate(results) if not x], [])
+        self.assertEqual(data, {'Phone': '+79001234567', 'Email': 'Иванов@test.ru'})
+        tinkoff.transport.close()
@@ -1,7 +1,9 @@
+import time
+import threading
 from unittest import TestCase
 from unittest.mock import patch
 
-from cryptopro import CryptoPro, CryptoProError
+from cryptopro import CryptoPro, CryptoProError, ContainerQueue, get_container_queue
 
 
 CRYPTOPRO = {
@@ -125,6 +127,105 @@ class CryptoProTestCase(TestCase):
                         result = self.cryptopro.get_hash(test_source)
                         self.assertEqual(error.code, error_code)
 
+    def test_transient_error(self):
+        busy = CryptoProError('Sharing violation', 0x8010000b)
+        self.assertTrue(busy.is_transient)
+        self.assertFalse(CryptoProError('Some error', 123).is_transient)
+
+        cryptopro = CryptoPro(max_wait=1.0, retry_delay=0.001, **CRYPTOPRO)
+        calls = []
+
+        def side_effect(*args):
+            calls.append(args)
+            if len(calls) <= 2:
+                raise busy
+            return b''
+
+        with patch('cryptopro.CryptoPro._proceed_command', side_effect=side_effect):
+            with patch('cryptopro.CryptoPro._flush_temp_file', return_value=b'test result'):
+                self.assertEqual(cryptopro.get_sign(b'test source'), b'test result')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[0], calls[2])
+
+        calls.clear()
+        with patch('cryptopro.CryptoPro._proceed_command', side_effect=CryptoProError('Some error', 123)) as mock:
+            with self.assertRaises(CryptoProError):
+                cryptopro.get_sign(b'test source')
+        self.assertEqual(mock.call_count, 1)
+
+        cryptopro.max_wait = 0.1
+        started = time.monotonic()
+        with patch('cryptopro.CryptoPro._proceed_command', side_effect=busy) as mock:
+            with self.assertRaises(CryptoProError) as error:
+                cryptopro.get_hash(b'test source')
+        self.assertEqual(error.exception.code, busy.code)
+        self.assertGreater(mock.call_count, 1)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_container_concurrency(self):
+        params = dict(CRYPTOPRO, container_name='concurrency')
+        cryptopros = [CryptoPro(container_concurrency=2, **params) for _ in range(2)]
+        lock = threading.Lock()
+        state = {'active': 0, 'max': 0}
+
+        def side_effect(*args):
+            with lock:
+                state['active'] += 1
+                state['max'] = max(state['max'], state['active'])
+            time.sleep(0.01)
+            with lock:
+                state['active'] -= 1
+            return b''
+
+        with patch('cryptopro.CryptoPro._proceed_command', side_effect=side_effect), \
+                patch('cryptopro.CryptoPro._flush_temp_file', return_value=b'test result'):
+            threads = [threading.Thread(target=cryptopros[i % 2].get_sign, args=(b'test source',)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(state['max'], 2)
+
+        cryptopro = CryptoPro(container_concurrency=1, max_wait=0.05, **dict(params, container_name='busy'))
+        queue = get_container_queue('busy', 1)
+        queue.acquire()
+        with patch('cryptopro.CryptoPro._proceed_command', return_value=b'') as mock:
+            with self.assertRaises(CryptoProError):
+                cryptopro.get_sign(b'test source')
+        mock.assert_not_called()
+        queue.release()
+
+        # Instances of the same container share the first queue whatever their concurrency is
+        with self.assertLogs('cryptopro', 'WARNING') as logs:
+            self.assertIs(get_container_queue('busy', 4), queue)
+            self.assertIs(get_container_queue('busy', 4), queue)
+        self.assertEqual(len(logs.records), 1)
+
+    def test_container_queue(self):
+        queue = ContainerQueue(1)
+        queue.acquire()
+        order = []
+
+        def acquire(index):
+            queue.acquire()
+            order.append(index)
+            queue.release()
+
+        threads = []
+        for index in range(5):
+            threads.append(threading.Thread(target=acquire, args=(index,)))
+            threads[-1].start()
+            while queue.waiting <= index:
+                time.sleep(0.001)
+        self.assertFalse(queue.acquire(timeout=0.01))
+        self.assertEqual(queue.waiting, 5)
+
+        queue.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertTrue(queue.acquire(timeout=0))
+
     def _get_command_patch(self, stdout=b'', stderr=b'', returncode=0):
         def side_effect(*args, **kwargs):
             if returncode:
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+import history
+from history import StatusHistory
+from tinkoff import Tinkoff, PaymentStatus
+from signer import FakeSigner
+
+
+TRANSITIONS = (
+    (1, 'NEW', 0), (1, 'CHECKING', 10), (1, 'COMPLETING', 30), (1, 'COMPLETED', 40),
+    (2, 'NEW', 5), (2, 'CHECKING', 10), (2, 'COMPLETING', 15),
+    (3, 'NEW', 20), (3, 'CHECKING', 50), (3, 'CHECKED', 60), (3, 'COMPLETING', 100),
+)
+
+
+class StatusHistoryTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'history')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_add(self):
+        with StatusHistory() as history_:
+            self.assertTrue(history_.add(1, 'NEW', 0))
+            self.assertFalse(history_.add('1', PaymentStatus.NEW, 5))
+            self.assertTrue(history_.add(1, 'SOMETHING', 10))
+            self.assertFalse(history_.add('payment', 'NEW', 10))
+            self.assertEqual(len(history_), 2)
+            self.assertEqual(history_.get(1), [(PaymentStatus.NEW, 0.0), (PaymentStatus.UNKNOWN, 10.0)])
+            self.assertEqual(history_.get(2), [])
+
+        with self.assertRaises(ValueError):
+            history_.add(1, 'NEW')
+
+    def test_queries(self):
+        with StatusHistory(chunk_size=4) as history_:
+            # Payments are added out of order of time, queries must not depend on it
+            for payment_id, status, timestamp in reversed(TRANSITIONS):
+                history_.add(payment_id, status, timestamp)
+            self._check_queries(history_)
+
+    @skipIf(history.np is None, 'numpy is not installed')
+    def test_python_queries(self):
+        with StatusHistory(chunk_size=4) as history_, patch('history.np', None):
+            for payment_id, status, timestamp in TRANSITIONS:
+                history_.add(payment_id, status, timestamp)
+            self._check_queries(history_)
+
+    def test_persistence(self):
+        with StatusHistory(self.path, chunk_size=4) as history_:
+            # Sealed chunks are written by the writer thread, a request thread doesn't wait for the disk
+            disk = threading.Event()
+            write_chunk = history_._write_chunk
+
+            def slow_write_chunk(path, columns):
+                disk.wait(5)
+                write_chunk(path, columns)
+
+            with patch.object(history_, '_write_chunk', side_effect=slow_write_chunk):
+                for payment_id, status, timestamp in TRANSITIONS:
+                    history_.add(payment_id, status, timestamp)
+                self.assertEqual(os.listdir(self.path), [])
+                self._check_queries(history_)
+                disk.set()
+                history_.flush()
+            self.assertEqual(len(os.listdir(self.path)), 3)
+            self._check_queries(history_)
+        self.assertEqual(len(os.listdir(self.path)), 3)
+        self.assertEqual(os.path.getsize(os.path.join(self.path, '00000000.chunk')), 16 + 4 * 17)
+
+        with StatusHistory(self.path, chunk_size=4) as history_:
+            self.assertEqual(len(history_), len(TRANSITIONS))
+            self._check_queries(history_)
+            # A repeat of a status in a new chunk is added, but queries collapse it to the first row
+            self.assertTrue(history_.add(2, 'COMPLETING', 200))
+            self.assertFalse(history_.add(2, 'COMPLETING', 210))
+            self.assertTrue(history_.add(2, 'COMPLETED', 220))
+            history_.flush()
+            self.assertEqual([x[1] for x in history_.get(2)], [5.0, 10.0, 15.0, 220.0])
+            self.assertEqual(sorted(history_.durations('COMPLETING')), [10.0, 205.0])
+            self.assertEqual(history_.stuck(older_than=500, now=1000), [3])
+
+        with open(os.path.join(self.path, '00000004.chunk'), 'wb') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            StatusHistory(self.path)
+
+    def test_hook(self):
+        history_ = StatusHistory()
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), hooks=[history_])
+        responses = [
+            {'Success': True, 'PaymentId': '1', 'Status': 'CHECKING'},
+            {'Success': True, 'PaymentId': '1', 'Status': 'CHECKING'},
+            {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETING'},
+            {'Success': False, 'ErrorCode': '7', 'Message': 'Unknown payment'},
+        ]
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=[(x, 200, {}) for x in responses]):
+            tinkoff.proceed_payment(1)
+            tinkoff.get_payment(1)
+            tinkoff.get_payment(1)
+            with self.assertRaises(Exception):
+                tinkoff.get_payment(2)
+
+        self.assertEqual([x[0] for x in history_.get(1)], [PaymentStatus.CHECKING, PaymentStatus.COMPLETING])
+        self.assertEqual(len(history_), 2)
+
+    def _check_queries(self, history_):
+        self.assertEqual([x[1] for x in history_.get(3)], [20.0, 50.0, 60.0, 100.0])
+        self.assertEqual(sorted(history_.durations(PaymentStatus.NEW)), [5.0, 10.0, 30.0])
+        self.assertEqual(history_.durations('COMPLETING'), [10.0])
+        self.assertEqual(history_.durations('REJECTED'), [])
+        self.assertEqual(history_.percentiles('NEW'), {50: 10.0, 90: 30.0, 99: 30.0})
+        self.assertEqual(history_.percentiles('CHECKING', (50,)), {50: 10.0})
+        self.assertEqual(history_.percentiles('REJECTED', (50,)), {50: None})
+        self.assertEqual(history_.stuck(older_than=500, now=1000), [2, 3])
+        self.assertEqual(history_.stuck(older_than=950, now=1000), [2])
+        self.assertEqual(history_.stuck(PaymentStatus.COMPLETED, older_than=0, now=1000), [1])
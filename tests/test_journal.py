@@ -0,0 +1,167 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from journal import PayoutJournal
+from tinkoff import Tinkoff, TinkoffError
+from signer import FakeSigner
+
+
+
+class PayoutJournalTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'journal.sqlite')
+        self.journal = PayoutJournal(self.path, batch_size=3, flush_interval=60)
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def test_record(self):
+        self.journal.record_init('order-1', 'payment-1', 'NEW', 'https://some.url/')
+        entry = self.journal.get('order-1')
+        self.assertEqual(entry['payment_id'], 'payment-1')
+        self.assertEqual(entry['step'], 'init')
+        self.assertEqual(entry['url'], 'https://some.url/')
+
+        self.journal.record_status('payment-1', 'COMPLETED', 'payment')
+        entry = self.journal.find('payment-1')
+        self.assertEqual(entry['order_id'], 'order-1')
+        self.assertEqual(entry['step'], 'payment')
+        self.assertEqual(entry['status'], 'COMPLETED')
+
+        self.assertIsNone(self.journal.get('order-2'))
+        self.assertIsNone(self.journal.find('payment-2'))
+
+        # `PaymentId` is the same whether it's passed as a number or as a string
+        self.journal.record_init('order-3', '3', 'NEW')
+        self.journal.record_status(3, 'COMPLETED')
+        self.assertEqual(self.journal.find(3)['status'], 'COMPLETED')
+        self.journal.flush()
+        self.assertEqual(self.journal.find(3)['order_id'], 'order-3')
+        self.assertEqual(self.journal.find('3')['status'], 'COMPLETED')
+
+    def test_group_commit(self):
+        self.assertIsNone(self.journal.try_record_intent('order-1'))
+        self.assertEqual(self.journal.try_record_intent('order-1')['step'], 'pending')
+        self.journal.record_init('order-2', 'payment-2', 'NEW')
+
+        other = PayoutJournal(self.path)
+        try:
+            # Intents and registered payments are committed at once, status updates are batched
+            self.assertEqual(other.get('order-1')['step'], 'pending')
+            self.assertEqual(other.get('order-2')['payment_id'], 'payment-2')
+
+            self.journal.record_status('payment-2', 'CHECKING')
+            self.journal.record_status('payment-2', 'COMPLETING')
+            self.assertEqual(other.get('order-2')['status'], 'NEW')
+            self.journal.record_status('payment-2', 'COMPLETED')
+            self.assertEqual(other.get('order-2')['status'], 'COMPLETED')
+        finally:
+            other.close()
+
+        self.journal.discard('order-1')
+        self.assertIsNone(self.journal.get('order-1'))
+
+    def test_resume(self):
+        self.journal.record_init('order-1', 'payment-1', 'NEW')
+        self.journal.close()
+
+        self.journal = PayoutJournal(self.path)
+        entry = self.journal.get('order-1')
+        self.assertEqual(entry['payment_id'], 'payment-1')
+        self.assertEqual(entry['status'], 'NEW')
+
+
+class TinkoffJournalTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal = PayoutJournal(os.path.join(self.directory.name, 'journal.sqlite'))
+        self.tinkoff = Tinkoff('test_key', None, signer=FakeSigner(), is_test=True, journal=self.journal)
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def test_init_is_not_resent(self):
+        calls = []
+
+        def side_effect(method, url, **kwargs):
+            calls.append(url.rsplit('/', 1)[-1])
+            if url.endswith('Init'):
+                return {'Success': True, 'PaymentId': '1', 'Status': 'NEW'}, 200, {}
+            return {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}, 200, {}
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            for _ in range(2):
+                payment = self.tinkoff.create_payment(order_id='1', card_id=1, amount=1)
+                self.assertEqual(payment['payment_id'], '1')
+                result = self.tinkoff.proceed_payment(payment['payment_id'])
+                self.assertEqual(result['status'], 'COMPLETED')
+
+        self.assertEqual(calls, ['Init', 'Payment'])
+        self.assertEqual(self.journal.get('1')['step'], 'payment')
+
+    def test_init_in_doubt(self):
+        def side_effect(method, url, **kwargs):
+            data = dict(parse_qsl(kwargs['data'].decode('utf-8')))
+            if data['OrderId'] == '1':
+                raise TimeoutError()
+            if data['OrderId'] == '2':
+                return {'Success': False, 'ErrorCode': '1', 'Message': 'Some error'}, 200, {}
+            return {'Success': True, 'PaymentId': '3', 'Status': 'NEW'}, 200, {}
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect) as request_mock:
+            # A request without a response may be processed by the bank, so it's not sent again
+            for _ in range(2):
+                with self.assertRaises(TinkoffError):
+                    self.tinkoff.create_payment(order_id='1', card_id=1, amount=1)
+            self.assertEqual(request_mock.call_count, 1)
+            self.assertEqual(self.journal.get('1')['step'], 'pending')
+
+            # A rejected request is not registered, so it may be sent again
+            for _ in range(2):
+                with self.assertRaises(TinkoffError):
+                    self.tinkoff.create_payment(order_id='2', card_id=1, amount=1)
+            self.assertEqual(request_mock.call_count, 3)
+            self.assertIsNone(self.journal.get('2'))
+
+            self.journal.discard('1')
+            self.tinkoff.create_payment(order_id='3', card_id=1, amount=1)
+            self.assertEqual(self.journal.get('3')['payment_id'], '3')
+
+    def test_concurrent_init(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def side_effect(method, url, **kwargs):
+            calls.append(url)
+            started.set()
+            release.wait(5)
+            return {'Success': True, 'PaymentId': '1', 'Status': 'NEW'}, 200, {}
+
+        errors = []
+
+        def create():
+            try:
+                self.tinkoff.create_payment(order_id='1', card_id=1, amount=1)
+            except TinkoffError as e:
+                errors.append(e)
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            first = threading.Thread(target=create)
+            first.start()
+            self.assertTrue(started.wait(5))
+            # The same order is in flight, so the second call finds its intent and sends nothing
+            create()
+            release.set()
+            first.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.journal.get('1')['payment_id'], '1')
@@ -0,0 +1,109 @@
+import os
+import time
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from presign import PresignedStore
+from tinkoff import Tinkoff
+from watcher import PaymentWatcher
+from signer import FakeSigner
+from metrics import Metrics
+
+
+SIGN_VALUE = FakeSigner().sign('1terminal_key')
+
+
+def bank(method, url, **kwargs):
+    data = dict(parse_qsl(kwargs['data'].decode('utf-8')))
+    return {'Success': True, 'PaymentId': data['PaymentId'], 'Status': 'CHECKING'}, 200, {}
+
+
+class PresignedStoreTestCase(TestCase):
+    def test_store(self):
+        metrics = Metrics()
+        store = PresignedStore(max_entries=2, ttl=0.05, metrics=metrics)
+
+        store.put('1terminal_key', SIGN_VALUE)
+        self.assertIn('1terminal_key', store)
+        self.assertEqual(store.take('1terminal_key'), SIGN_VALUE)
+        self.assertIsNone(store.take('1terminal_key'))
+
+        store.put('2terminal_key', SIGN_VALUE)
+        time.sleep(0.06)
+        self.assertNotIn('2terminal_key', store)
+        self.assertIsNone(store.take('2terminal_key'))
+
+        for i in range(3, 6):
+            store.put('{}terminal_key'.format(i), SIGN_VALUE)
+        self.assertEqual(len(store), 2)
+        self.assertNotIn('3terminal_key', store)
+
+        stats = store.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['evicted'], 1)
+        self.assertEqual(stats['size'], 2)
+        self.assertAlmostEqual(stats['hit_rate'], 1 / 3)
+        self.assertEqual(metrics.get('presigned', result='hit'), 1)
+        self.assertEqual(metrics.get('presigned', result='expired'), 1)
+
+        time.sleep(0.06)
+        store.put('6terminal_key', SIGN_VALUE)
+        self.assertEqual(len(store), 1)
+
+    def test_tinkoff(self):
+        signer = FakeSigner()
+        store = PresignedStore()
+        tinkoff = Tinkoff('terminal_key', None, signer=signer, presigned=store)
+        requests = []
+
+        def request(method, url, **kwargs):
+            requests.append(dict(parse_qsl(kwargs['data'].decode('utf-8'))))
+            return bank(method, url, **kwargs)
+
+        with patch.object(signer, 'sign', wraps=signer.sign) as sign_mock:
+            self.assertEqual(tinkoff.presign([1, 2]), 2)
+            self.assertEqual(tinkoff.presign([1, 2]), 0)
+            self.assertEqual(sign_mock.call_count, 2)
+
+            with patch('tinkoff.Tinkoff._proceed_request', side_effect=request):
+                self.assertEqual(tinkoff.get_payment(1)['status'], 'CHECKING')
+                self.assertEqual(sign_mock.call_count, 2)
+                tinkoff.get_payment(3)
+                self.assertEqual(sign_mock.call_count, 3)
+                tinkoff.proceed_payment(2)
+                self.assertEqual(sign_mock.call_count, 4)
+
+        self.assertEqual(requests[0], dict(signer.sign('1terminal_key'), PaymentId='1', TerminalKey='terminal_key'))
+        self.assertEqual(store.stats()['hits'], 1)
+        self.assertEqual(store.stats()['misses'], 1)
+        self.assertIn('2terminal_key', store)
+
+    def test_watcher(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        signer = FakeSigner()
+        store = PresignedStore()
+        tinkoff = Tinkoff('terminal_key', None, signer=signer, presigned=store)
+        watcher = PaymentWatcher(tinkoff, os.path.join(directory.name, 'watcher.sqlite'), presign_ahead=10)
+        self.addCleanup(watcher.close)
+        watcher.add([1, 2, 3])
+
+        self.assertEqual(watcher.presign(), 3)
+        self.assertEqual(len(store), 3)
+
+        with patch.object(signer, 'sign', wraps=signer.sign) as sign_mock, \
+                patch('tinkoff.Tinkoff._proceed_request', side_effect=bank):
+            self.assertEqual(len(watcher.poll()), 3)
+        sign_mock.assert_not_called()
+        self.assertEqual(store.stats()['hits'], 3)
+
+        # Polled payments are due in `poll_interval` (5 seconds)
+        self.assertEqual(watcher.presign(), 3)
+        watcher.presign_ahead = 1
+        store.clear()
+        self.assertEqual(watcher.presign(), 0)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from profiler import SlowRequestProfiler
+from spawner import Spawner, run_command, collect_usage
+from tinkoff import Tinkoff, TinkoffError
+from cryptopro import CryptoPro
+from signer import FakeSigner
+from .test_signer import CSPTEST, CERTMGR
+
+
+
+def slow_bank(method, url, **kwargs):
+    time.sleep(0.1)
+    return {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}, 200, {}
+
+
+def fast_bank(method, url, **kwargs):
+    return {'Success': False, 'ErrorCode': '7', 'Message': 'Unknown payment'}, 200, {}
+
+
+class SlowRequestProfilerTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, content in (('csptest', CSPTEST), ('certmgr', CERTMGR)):
+            path = os.path.join(self.directory.name, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            os.chmod(path, 0o755)
+
+        self.cryptopro = CryptoPro(container_name='\\\\.\\HDIMAGE\\container', store_name='uMy')
+        self.cryptopro.prefix = self.directory.name + '/'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_slow_request(self):
+        with SlowRequestProfiler(threshold=0.05, sample_rate=1.0, sample_interval=0.001, max_reports=2) as profiler:
+            tinkoff = Tinkoff('terminal_key', self.cryptopro, profiler=profiler)
+            with patch('tinkoff.Tinkoff._proceed_request', side_effect=slow_bank):
+                tinkoff.get_payment(1)
+            with patch('tinkoff.Tinkoff._proceed_request', side_effect=fast_bank):
+                with self.assertRaises(TinkoffError):
+                    tinkoff.get_payment(1)
+
+            reports = profiler.reports()
+            self.assertEqual(len(reports), 1)
+            report = reports[0]
+            self.assertEqual(report['operation'], 'GetState')
+            self.assertEqual(report['terminal'], 'terminal_key')
+            self.assertIsNone(report['error'])
+            self.assertEqual(list(report['phases']), ['sign', 'request', 'response'])
+            self.assertGreaterEqual(report['phases']['request'], 0.1)
+            self.assertGreaterEqual(report['duration'], sum(report['phases'].values()))
+
+            self.assertEqual({x['command'] for x in report['commands']}, {'csptest', 'certmgr'})
+            self.assertGreater(report['max_rss'], 0)
+            self.assertGreaterEqual(report['cpu'], 0)
+
+            self.assertTrue(report['samples'])
+            self.assertTrue(any('test_profiler.py:slow_bank' in x for x in report['samples']))
+
+            path = os.path.join(self.directory.name, 'slow.jsonl')
+            self.assertEqual(profiler.dump(path), 1)
+            with open(path) as f:
+                self.assertEqual(json.loads(f.readline())['operation'], 'GetState')
+
+            with patch('tinkoff.Tinkoff._proceed_request', side_effect=slow_bank):
+                for _ in range(3):
+                    tinkoff.get_payment(1)
+            self.assertEqual(len(profiler.reports()), 2)
+            profiler.clear()
+            self.assertEqual(profiler.reports(), [])
+
+    def test_thresholds(self):
+        profiler = SlowRequestProfiler(threshold=10, thresholds={'GetState': 0})
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), profiler=profiler)
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=fast_bank):
+            with self.assertRaises(TinkoffError):
+                tinkoff.get_payment(1)
+            with self.assertRaises(TinkoffError):
+                tinkoff.proceed_payment(1)
+
+        reports = profiler.reports()
+        self.assertEqual([x['operation'] for x in reports], ['GetState'])
+        self.assertEqual(reports[0]['error'], '7: Unknown payment')
+        self.assertIsNone(reports[0]['samples'])
+        self.assertEqual(reports[0]['commands'], [])
+
+    def test_usage(self):
+        command = [os.path.join(self.directory.name, 'certmgr')]
+        code, _, _ = run_command(command)
+        self.assertEqual(code, 0)
+
+        with Spawner() as spawner:
+            with collect_usage() as usages:
+                run_command(command)
+                spawner.run(command)
+        self.assertEqual(len(usages), 2)
+        for usage in usages:
+            self.assertEqual(usage['command'], 'certmgr')
+            self.assertGreater(usage['max_rss'], 0)
+            self.assertGreater(usage['elapsed'], 0)
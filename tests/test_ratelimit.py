@@ -0,0 +1,111 @@
+import os
+import time
+import tempfile
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+
+from ratelimit import RateLimiter, RateLimitError
+from tinkoff import Tinkoff, TinkoffError
+from signer import FakeSigner
+
+
+
+def _acquire_many(limiter, count, results):
+    acquired = 0
+    for _ in range(count):
+        try:
+            limiter.acquire('test_key', 'GetState')
+            acquired += 1
+        except RateLimitError:
+            pass
+    results.put(acquired)
+
+
+def _acquire_forked(limiter, count, processes):
+    # Forked processes get the limiter as it is, it's not pickled
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=_acquire_many, args=(limiter, count, results)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    acquired = [results.get(timeout=10) for _ in workers]
+    for worker in workers:
+        worker.join()
+    return acquired
+
+
+class RateLimiterTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'ratelimit')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_acquire(self):
+        limiter = RateLimiter(rate=100, burst=2)
+        self.assertEqual(limiter.acquire('test_key', 'Init'), 0)
+        self.assertEqual(limiter.acquire('test_key', 'Init'), 0)
+        started = time.monotonic()
+        self.assertGreater(limiter.acquire('test_key', 'Init'), 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.005)
+
+        # Other operations and terminals have their own buckets
+        self.assertEqual(limiter.acquire('test_key', 'GetState'), 0)
+        self.assertEqual(limiter.acquire('other_key', 'Init'), 0)
+        limiter.close()
+
+    def test_timeout(self):
+        limiter = RateLimiter(rate=1, burst=1, rates={'GetState': (1, 2)}, timeout=0.1)
+        limiter.acquire('test_key', 'Init')
+        with self.assertRaises(RateLimitError):
+            limiter.acquire('test_key', 'Init')
+        limiter.acquire('test_key', 'GetState')
+        limiter.acquire('test_key', 'GetState')
+        with self.assertRaises(RateLimitError):
+            limiter.acquire('test_key', 'GetState')
+        limiter.close()
+
+    def test_clock(self):
+        limiter = RateLimiter(rate=10, burst=1, path=self.path, timeout=0.5)
+        limiter.acquire('test_key', 'Init')
+        limiter.close()
+
+        # A bucket stored before the clock is stepped back (or before a reboot) must not make
+        # requests wait for the difference
+        with patch('time.time', return_value=time.time() - 3600):
+            limiter = RateLimiter(rate=10, burst=1, path=self.path, timeout=0.5)
+            self.assertLessEqual(limiter.acquire('test_key', 'Init'), 0.1)
+            limiter.close()
+
+    def test_shared(self):
+        # The limiter is made before the fork, so workers inherit its file and its (held) thread lock
+        limiter = RateLimiter(rate=1, burst=4, path=self.path, timeout=0)
+        limiter._lock.acquire()
+        try:
+            acquired = _acquire_forked(limiter, 4, 4)
+        finally:
+            limiter._lock.release()
+        self.assertEqual(sum(acquired), 4)
+        with self.assertRaises(RateLimitError):
+            limiter.acquire('test_key', 'GetState')
+        limiter.close()
+
+        # Without a file a forked process gets buckets of its own
+        limiter = RateLimiter(rate=1, burst=1, timeout=0)
+        limiter.acquire('test_key', 'GetState')
+        self.assertEqual(_acquire_forked(limiter, 2, 1), [1])
+        limiter.close()
+
+    def test_tinkoff(self):
+        limiter = RateLimiter(rate=1, burst=1, timeout=0)
+        signer = FakeSigner()
+        tinkoff = Tinkoff('test_key', None, signer=signer, is_test=True, rate_limiter=limiter)
+        response = {'Success': True, 'PaymentId': '1', 'Status': 'NEW'}
+        with patch('tinkoff.Tinkoff._proceed_request', return_value=(response, 200, {})):
+            tinkoff.get_payment('1')
+            with patch.object(signer, 'sign', wraps=signer.sign) as sign_mock, self.assertRaises(TinkoffError):
+                tinkoff.get_payment('1')
+            sign_mock.assert_not_called()
+        limiter.close()
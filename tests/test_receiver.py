@@ -0,0 +1,157 @@
+import json
+import queue
+import asyncio
+import hashlib
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+from receiver import NotificationReceiver, NotificationVerifier
+from cryptopro import CryptoPro
+
+
+SERIAL = 'hexserial'
+
+
+def get_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).digest()
+
+
+def get_signature(content):
+    # A stand-in for the bank private key
+    return hashlib.sha256(b'bank' + content).digest()
+
+
+def check_signature(content, signature, serial):
+    return signature == get_signature(content)
+
+
+def sign(notification):
+    content = ''.join(str(notification[x]).lower() if isinstance(notification[x], bool) else str(notification[x])
+                      for x in sorted(notification))
+    notification = dict(notification)
+    notification['DigestValue'] = CryptoPro().to_base64(get_hash(content))
+    notification['SignatureValue'] = CryptoPro().to_base64(get_signature(content.encode('utf-8')))
+    notification['X509SerialNumber'] = SERIAL
+    return notification
+
+
+class NotificationReceiverTestCase(TestCase):
+    def setUp(self):
+        self.notification = sign({
+            'TerminalKey': 'test_key',
+            'OrderId': '1',
+            'Success': True,
+            'Status': 'COMPLETED',
+            'PaymentId': '10',
+            'ErrorCode': '0',
+            'Amount': 10000,
+        })
+        self.queue = queue.Queue()
+        self.payments = []
+        self.verifier = NotificationVerifier(CryptoPro(), check_signature, terminal_key='test_key', serials=[SERIAL])
+        self.receiver = NotificationReceiver(self.verifier, queue=self.queue)
+        self.receiver.add_callback(lambda payment, notification: self.payments.append(payment))
+
+    def test_verify(self):
+        with patch('cryptopro.CryptoPro.get_hash', side_effect=get_hash) as hash_mock:
+            forged = dict(self.notification, Status='REJECTED')
+            untrusted = dict(self.notification, X509SerialNumber='other')
+            # The digest is public, so a forger can recalculate it but not the signature
+            resigned = dict(sign(dict(self.notification, Status='REJECTED')), SignatureValue='Zm9yZ2Vk')
+            malformed = dict(self.notification, SignatureValue='!')
+            results = self.verifier.verify_many([
+                self.notification, forged, self.notification, untrusted, resigned, malformed,
+            ])
+            self.assertEqual(results, [True, False, True, False, False, False])
+            self.assertEqual(hash_mock.call_count, 4)
+
+            self.assertTrue(self.verifier.verify(self.notification))
+            self.assertEqual(hash_mock.call_count, 4)
+
+        with self.assertRaises(AssertionError):
+            NotificationVerifier(CryptoPro(), None)
+        with self.assertRaises(AssertionError):
+            NotificationReceiver(None)
+
+    def test_post(self):
+        server = self.receiver.make_server('127.0.0.1', 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:{}/'.format(server.server_port)
+        try:
+            with patch('cryptopro.CryptoPro.get_hash', side_effect=get_hash):
+                with urlopen(self._get_request(url, self.notification)) as response:
+                    self.assertEqual(response.read(), b'OK')
+
+                with self.assertRaises(HTTPError) as error:
+                    urlopen(self._get_request(url, dict(self.notification, Amount=1)))
+                self.assertEqual(error.exception.code, 403)
+
+                # A malformed amount is a bad request, unhashable values are just invalid
+                with self.assertRaises(HTTPError) as error:
+                    urlopen(self._get_request(url, sign(dict(self.notification, Amount='1e3'))))
+                self.assertEqual(error.exception.code, 400)
+                with self.assertRaises(HTTPError) as error:
+                    urlopen(self._get_request(url, dict(self.notification, DATA={'a': [1]}, DigestValue=['x'])))
+                self.assertEqual(error.exception.code, 403)
+
+                with self.assertRaises(HTTPError) as error:
+                    urlopen(self._get_request(url, [self.notification] * 400))
+                self.assertEqual(error.exception.code, 413)
+
+                with urlopen(self._get_request(url, [self.notification, self.notification])) as response:
+                    self.assertEqual(response.read(), b'OK')
+
+                # A batch is rejected as a whole, so its valid notifications are dispatched on a retry only
+                valid = sign(dict(self.notification, PaymentId='12'))
+                with self.assertRaises(HTTPError) as error:
+                    urlopen(self._get_request(url, [valid, dict(self.notification, Amount=1)]))
+                self.assertEqual(error.exception.code, 403)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(self.payments), 3)
+        payment = self.payments[0]
+        self.assertEqual(dict(payment), {
+            'payment_id': '10',
+            'status': 'COMPLETED',
+            'status_name': payment['status_name'],
+            'amount': 100.0,
+        })
+        self.assertEqual(self.queue.qsize(), 3)
+        self.assertEqual(self.receiver.get_stale(['10', '11', '12'], 60), ['11', '12'])
+
+    def test_asgi(self):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': json.dumps(self.notification).encode()}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http',
+            'method': 'POST',
+            'headers': [(b'content-type', b'application/json')],
+        }
+        with patch('cryptopro.CryptoPro.get_hash', side_effect=get_hash):
+            asyncio.run(self.receiver.asgi(scope, receive, send))
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(messages[1]['body'], b'OK')
+        self.assertEqual(len(self.payments), 1)
+
+        async def receive_large():
+            return {'type': 'http.request', 'body': b' ' * 1024, 'more_body': True}
+
+        messages.clear()
+        asyncio.run(self.receiver.asgi(scope, receive_large, send))
+        self.assertEqual(messages[0]['status'], 413)
+
+    def _get_request(self, url, data):
+        return Request(url, data=json.dumps(data).encode(), headers={'Content-Type': 'application/json'})
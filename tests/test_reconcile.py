@@ -0,0 +1,109 @@
+import io
+import os
+import csv
+import json
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from reconcile import Reconciler, read_ledger
+from tinkoff import Payment, TinkoffError
+
+
+class ReconcilerTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.watermark = os.path.join(self.directory.name, 'watermark.json')
+        self.states = {
+            '1': Payment('1', 'COMPLETED', amount=10.0),
+            '2': Payment('2', 'REJECTED', amount=20.0),
+            '3': Payment('3', 'COMPLETING', amount=31.0),
+            '4': Payment('4', 'COMPLETED', amount=40.0),
+        }
+        self.tinkoff = Mock()
+        self.tinkoff.get_payment.side_effect = self._get_payment
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_ledger(self):
+        path = os.path.join(self.directory.name, 'ledger.csv')
+        with open(path, 'w', newline='') as file:
+            file.write('payment_id,amount,status\n1,10.00,COMPLETED\n2,20.5,\n')
+        self.assertEqual(list(read_ledger(path)), [('1', 10.0, 'COMPLETED'), ('2', 20.5, None)])
+
+        path = os.path.join(self.directory.name, 'ledger.jsonl')
+        with open(path, 'w') as file:
+            file.write('{"payment_id": 1, "amount": 10}\n\n{"payment_id": 2, "amount": 20, "status": "NEW"}\n')
+        self.assertEqual(list(read_ledger(path)), [('1', 10.0, None), ('2', 20.0, 'NEW')])
+
+    def test_reconcile(self):
+        rows = [
+            ('1', 10.0, None),
+            ('2', 20.0, 'COMPLETED'),
+            ('3', 30.0, None),
+            ('4', 40.0, None),
+            ('5', 50.0, None),
+        ]
+        reconciler = Reconciler(self.tinkoff, concurrency=2, chunk_size=2, watermark_path=self.watermark)
+
+        report = io.StringIO()
+        summary = reconciler.reconcile(iter(rows), report)
+        self.assertEqual(summary['checked'], 5)
+        self.assertEqual(summary['mismatches'], 2)
+        self.assertEqual(summary['errors'], 1)
+        # A stuck row (3) doesn't stop settling of the next ones, a mismatched terminal row (2) isn't settled
+        self.assertEqual(summary['watermark'], 2)
+        self.assertEqual(summary['mismatched'], 1)
+
+        mismatches = list(csv.reader(io.StringIO(report.getvalue())))[1:]
+        self.assertIn(['1', '2', 'status', 'COMPLETED', 'REJECTED'], mismatches)
+        self.assertIn(['2', '3', 'amount', '30.00', '31.00'], mismatches)
+        self.assertIn('5', [x[1] for x in mismatches if x[2] == 'error'])
+
+        with open(self.watermark) as file:
+            watermark = json.load(file)
+        self.assertEqual(watermark['settled'], [[0, 1], [3, 4]])
+        self.assertEqual(watermark['mismatched'], [1])
+
+        self.tinkoff.get_payment.reset_mock()
+        report = io.StringIO()
+        summary = reconciler.reconcile(iter(rows), report)
+        self.assertEqual(summary['skipped'], 2)
+        self.assertEqual(summary['checked'], 3)
+        self.assertEqual(sorted(x.args[0] for x in self.tinkoff.get_payment.call_args_list), ['2', '3', '5'])
+        self.assertIn(['1', '2', 'status', 'COMPLETED', 'REJECTED'], list(csv.reader(io.StringIO(report.getvalue()))))
+
+        # The mismatch is fixed in the ledger
+        rows[1] = ('2', 20.0, 'REJECTED')
+        self.states['3'] = Payment('3', 'COMPLETED', amount=30.0)
+        summary = reconciler.reconcile(iter(rows), io.StringIO())
+        self.assertEqual(summary['watermark'], 4)
+        self.assertEqual(summary['mismatched'], 0)
+        with open(self.watermark) as file:
+            self.assertEqual(json.load(file)['settled'], [[0, 4]])
+
+    def test_max_ranges(self):
+        # Every other row is stuck, so each settled row makes a range of its own
+        self.states.update({str(x): Payment(str(x), 'COMPLETED', amount=x) for x in range(10, 20)})
+        self.states.update({str(x): Payment(str(x), 'NEW', amount=x) for x in range(20, 30)})
+        rows = [(str(x), float(x), None) for pair in zip(range(10, 20), range(20, 30)) for x in pair]
+        reconciler = Reconciler(self.tinkoff, chunk_size=4, watermark_path=self.watermark, max_ranges=3)
+        summary = reconciler.reconcile(iter(rows), io.StringIO())
+        self.assertEqual(summary['watermark'], 3)
+        with open(self.watermark) as file:
+            self.assertEqual(json.load(file)['settled'], [[0, 1], [2, 3], [4, 5]])
+
+    def test_old_watermark(self):
+        with open(self.watermark, 'w') as file:
+            json.dump({'offset': 2}, file)
+        rows = [('1', 10.0, None), ('2', 20.0, None), ('4', 40.0, None)]
+        reconciler = Reconciler(self.tinkoff, watermark_path=self.watermark)
+        summary = reconciler.reconcile(iter(rows), io.StringIO())
+        self.assertEqual(summary['skipped'], 2)
+        self.assertEqual(summary['watermark'], 3)
+
+    def _get_payment(self, payment_id):
+        if payment_id not in self.states:
+            raise TinkoffError('Payment not found', '404')
+        return self.states[payment_id]
@@ -0,0 +1,132 @@
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from recorder import TrafficRecorder, ReplayTransport, TrafficReplayer, read_records, redact, main
+from tinkoff import Tinkoff, TinkoffError
+from transport import TransportError
+from signer import FakeSigner
+
+
+
+class BankStub:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def __call__(self, method, url, **kwargs):
+        time.sleep(self.latency)
+        data = dict(parse_qsl(kwargs['data'].decode('utf-8')))
+        if url.endswith('GetCardList'):
+            return [{'CardId': '100', 'Pan': '430000******0777', 'Status': 'A', 'CardType': 1,
+                     'RebillID': '200'}], 200, {}
+        if url.endswith('RemoveCard'):
+            raise TransportError('Got HTTP status 503', 503)
+        if data.get('PaymentId') == '0':
+            return {'Success': False, 'ErrorCode': '7', 'Message': 'Unknown payment'}, 200, {}
+        return {'Success': True, 'PaymentId': data['PaymentId'], 'Status': 'COMPLETED', 'Params': 'x' * 100}, 200, {}
+
+
+class TrafficRecorderTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'traffic.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record(self):
+        with TrafficRecorder(self.path) as recorder:
+            self._make_traffic(recorder)
+
+        records = list(read_records(self.path))
+        self.assertEqual([x['operation'] for x in records], ['GetState', 'GetState', 'GetCardList', 'RemoveCard'])
+        self.assertEqual([x['result'] for x in records], ['ok', 'rejected', 'ok', 'error'])
+        self.assertEqual(records[1]['error'], '7: Unknown payment')
+        self.assertEqual(records[3]['status'], 503)
+        self.assertEqual(records[0]['data'], {'PaymentId': 1})
+        self.assertGreater(records[0]['request_size'], 0)
+        # Fields which are not read by the client are not kept, but the size is one of the whole response
+        self.assertEqual(records[0]['response'], {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'})
+        self.assertGreater(records[0]['response_size'], 100)
+        self.assertGreaterEqual(records[0]['latency'], 0.01)
+
+        content = open(self.path, encoding='utf-8').read()
+        for value in ('client', '430000', '"100"', '"200"'):
+            self.assertNotIn(value, content)
+        self.assertEqual(records[2]['data']['CustomerKey'], records[3]['data']['CustomerKey'])
+
+    def test_background(self):
+        recorder = TrafficRecorder(self.path, flush_interval=60, response_fields=None)
+        self._make_traffic(recorder)
+        # Records are written by the writer thread, not by request threads
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertTrue(recorder.flush(5))
+        records = list(read_records(self.path))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]['response']['Params'], 'x' * 100)
+        recorder.close()
+
+    def test_redact(self):
+        value = {'CustomerKey': 'client', 'Items': [{'CardId': 1, 'Status': 'A'}], 'Pan': None}
+        result = redact(value, key=b'key')
+        self.assertEqual(result['Items'][0]['Status'], 'A')
+        self.assertEqual(result['Items'][0]['CardId'], redact({'CardId': 1}, key=b'key')['CardId'])
+        self.assertNotEqual(result['CustomerKey'], redact(value, key=b'other')['CustomerKey'])
+        self.assertIsNone(result['Pan'])
+        self.assertEqual(value['CustomerKey'], 'client')
+
+    def test_failed_hook(self):
+        def hook(record):
+            raise ValueError
+
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), hooks=[hook])
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=BankStub()):
+            self.assertEqual(tinkoff.get_payment(1)['status'], 'COMPLETED')
+
+    def test_replay(self):
+        with TrafficRecorder(self.path) as recorder:
+            self._make_traffic(recorder)
+
+        records = list(read_records(self.path))
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), transport=ReplayTransport(records, speed=0.5))
+        summary = TrafficReplayer(tinkoff, records, speed=0).run()
+
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['mismatches'], 0)
+        self.assertEqual(summary['operations']['GetState']['count'], 2)
+        self.assertEqual(summary['operations']['RemoveCard']['errors'], 1)
+        self.assertGreaterEqual(summary['operations']['GetCardList']['p50'], 0.02)
+
+        transport = ReplayTransport(records, speed=0)
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), transport=transport)
+        card = tinkoff.get_cards(records[2]['data']['CustomerKey'])[0]
+        self.assertEqual(card['card_id'], records[2]['response'][0]['CardId'])
+        with self.assertRaises(TinkoffError):
+            tinkoff.get_cards('another')
+
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), transport=ReplayTransport(records, speed=0))
+        self.assertEqual(tinkoff.request('GetState', {'PaymentId': 1})['Status'], 'COMPLETED')
+
+    def test_main(self):
+        with TrafficRecorder(self.path) as recorder:
+            self._make_traffic(recorder)
+
+        with patch('sys.stdout') as stdout:
+            self.assertEqual(main([self.path, '--speed', '10']), 0)
+        output = ''.join(x[0][0] for x in stdout.write.call_args_list)
+        self.assertIn('GetCardList', output)
+        self.assertIn('4 requests', output)
+
+    def _make_traffic(self, recorder):
+        tinkoff = Tinkoff('terminal_key', None, signer=FakeSigner(), hooks=[recorder])
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=BankStub(0.01)):
+            tinkoff.get_payment(1)
+            with self.assertRaises(TinkoffError):
+                tinkoff.get_payment(0)
+            tinkoff.get_cards('client')
+            with self.assertRaises(TinkoffError):
+                tinkoff.delete_card(100, 'client')
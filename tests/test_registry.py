@@ -0,0 +1,68 @@
+import threading
+from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from registry import TinkoffRegistry
+from metrics import Metrics
+from transport import Urllib3Transport
+from signer import FakeSigner
+from tests.test_transport import StubHandler
+
+
+class CountingHandler(StubHandler):
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        with CountingHandler.lock:
+            CountingHandler.connections += 1
+        super().setup()
+
+
+class TinkoffRegistryTestCase(TestCase):
+    def setUp(self):
+        CountingHandler.connections = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.metrics = Metrics()
+        self.registry = TinkoffRegistry(None, signer=FakeSigner(), transport=Urllib3Transport(pool_size=4),
+                                        metrics=self.metrics, max_clients=10)
+
+    def tearDown(self):
+        self.registry.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_shared_resources(self):
+        own = FakeSigner(serial='own')
+        self.registry.register('terminal_1', signer=own)
+
+        first = self.registry.get('terminal_0')
+        self.assertIs(self.registry['terminal_0'], first)
+        self.assertIs(first.transport, self.registry.transport)
+        self.assertIs(first.signer, self.registry.signer)
+        self.assertIs(first.metrics, self.metrics)
+        self.assertIs(self.registry.get('terminal_1').signer, own)
+
+        for i in range(30):
+            self.registry.get('terminal_{}'.format(i))
+        self.assertEqual(len(self.registry), 10)
+        self.assertIsNot(self.registry.get('terminal_0'), first)
+
+    def test_requests(self):
+        url = 'http://127.0.0.1:{}/e2c/'.format(self.server.server_port)
+
+        def call(index):
+            return self.registry.get('terminal_{}'.format(index % 50)).get_payment(index)['status']
+
+        with patch('tinkoff.Tinkoff.prod_url', url), ThreadPoolExecutor(max_workers=4) as executor:
+            statuses = list(executor.map(call, range(200)))
+
+        self.assertEqual(statuses, ['COMPLETED'] * 200)
+        # Connections are shared by all terminals
+        self.assertLessEqual(CountingHandler.connections, 4)
+        self.assertEqual(self.metrics.get('requests', terminal='terminal_7', operation='GetState', result='ok'), 4)
+        self.assertEqual(self.metrics.get('request_latency', terminal='terminal_7', operation='GetState')['count'], 4)
+        self.assertEqual(sum(x['value'] for x in self.metrics.snapshot() if x['name'] == 'requests'), 200)
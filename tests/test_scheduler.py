@@ -0,0 +1,156 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from scheduler import RequestScheduler, SchedulerError, call_options, get_call_options
+from tinkoff import Tinkoff, TinkoffError
+from metrics import Metrics
+from ratelimit import RateLimiter
+from signer import FakeSigner
+
+
+
+class RequestSchedulerTestCase(TestCase):
+    def test_priorities(self):
+        scheduler = RequestScheduler(concurrency=1)
+        scheduler.acquire()
+        order, threads = self._queue(scheduler, [
+            {'operation': 'GetState', 'priority': 'batch'},
+            {'operation': 'GetState'},
+            {'operation': 'GetCardList'},
+            {'operation': 'Payment', 'priority': 'batch'},
+            {'operation': 'AddCard'},
+        ])
+        scheduler.release()
+        self._join(threads)
+        self.assertEqual(order, [2, 4, 1, 0, 3])
+
+    def test_fairness(self):
+        scheduler = RequestScheduler(concurrency=1, weights={'big': 2})
+        scheduler.acquire()
+        calls = [{'tenant': 'big'}] * 6 + [{'tenant': 'small'}] * 6
+        order, threads = self._queue(scheduler, calls)
+        scheduler.release()
+        self._join(threads)
+
+        tenants = [calls[x]['tenant'] for x in order]
+        self.assertEqual(tenants[:9].count('big'), 6)
+        self.assertEqual(tenants[:9].count('small'), 3)
+
+    def test_deadline(self):
+        sink = Metrics()
+        scheduler = RequestScheduler(concurrency=1, metrics=sink)
+        scheduler.acquire()
+
+        started = time.monotonic()
+        with self.assertRaises(SchedulerError):
+            scheduler.acquire(deadline=time.monotonic() + 0.05)
+        self.assertLess(time.monotonic() - started, 1.0)
+        with self.assertRaises(SchedulerError):
+            scheduler.acquire(deadline=time.monotonic() - 1)
+
+        scheduler.release()
+        scheduler.acquire(deadline=time.monotonic() + 1)
+        scheduler.release()
+
+        metrics = scheduler.metrics()['default']
+        self.assertEqual(metrics['dropped'], 2)
+        self.assertEqual(metrics['waited'], 2)
+        self.assertEqual(metrics['queued'], 0)
+        self.assertEqual(sink.get('queue_dropped', priority='default'), 2)
+        self.assertEqual(sink.get('queue_wait', priority='default')['count'], 2)
+
+    def test_call_options(self):
+        self.assertEqual(get_call_options(), {})
+        with call_options(priority='batch', tenant='tenant'):
+            with call_options(timeout=10) as options:
+                self.assertEqual(options['priority'], 'batch')
+                self.assertEqual(options['tenant'], 'tenant')
+                self.assertGreater(options['deadline'], time.monotonic())
+            self.assertNotIn('deadline', get_call_options())
+        self.assertEqual(get_call_options(), {})
+
+    def test_tinkoff(self):
+        scheduler = RequestScheduler(concurrency=1)
+        signer = FakeSigner()
+        tinkoff = Tinkoff('terminal_key', None, signer=signer, scheduler=scheduler)
+
+        def request(method, url, **kwargs):
+            data = dict(parse_qsl(kwargs['data'].decode('utf-8')))
+            return {'Success': True, 'PaymentId': data.get('PaymentId', '1'), 'Status': 'COMPLETED'}, 200, {}
+
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=request), \
+                patch.object(signer, 'sign', wraps=signer.sign) as sign_mock:
+            scheduler.acquire()
+            with call_options(timeout=0.05):
+                with self.assertRaises(TinkoffError):
+                    tinkoff.get_payment(1)
+            sign_mock.assert_not_called()
+            scheduler.release()
+
+            self.assertEqual(tinkoff.get_payment(1)['status'], 'COMPLETED')
+            sign_mock.assert_called_once()
+
+            priorities = []
+            acquire = scheduler.acquire
+
+            def record(operation=None, tenant=None, priority=None, deadline=None):
+                priorities.append((operation, tenant, priority))
+                acquire(operation, tenant, priority, deadline)
+
+            with patch.object(scheduler, 'acquire', side_effect=record):
+                rows = [{'order_id': 'order', 'card_id': 1, 'amount': 10}]
+                results = list(tinkoff.bulk_payout(rows))
+                self.assertIsNone(results[0]['error'])
+                with call_options(tenant='tenant'):
+                    tinkoff.get_payment(1)
+
+        self.assertEqual(priorities, [
+            ('Init', 'terminal_key', 'batch'),
+            ('Payment', 'terminal_key', 'batch'),
+            ('GetState', 'tenant', None),
+        ])
+        self.assertEqual(scheduler.metrics()['default']['dropped'], 1)
+
+    def test_tinkoff_rate_limit(self):
+        rate_limiter = RateLimiter(1, burst=1)
+        self.addCleanup(rate_limiter.close)
+        signer = FakeSigner()
+        tinkoff = Tinkoff('terminal_key', None, signer=signer, scheduler=RequestScheduler(), rate_limiter=rate_limiter)
+        result = {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}
+
+        with patch('tinkoff.Tinkoff._proceed_request', return_value=(result, 200, {})), \
+                patch.object(signer, 'sign', wraps=signer.sign) as sign_mock:
+            tinkoff.get_payment(1)
+            # A slot is got at once, but a token is due in a second which is after the deadline
+            started = time.monotonic()
+            with call_options(timeout=0.1):
+                with self.assertRaises(TinkoffError) as context:
+                    tinkoff.get_payment(1)
+            self.assertEqual(context.exception.message, 'Deadline is exceeded')
+            self.assertLess(time.monotonic() - started, 0.1)
+        sign_mock.assert_called_once()
+
+    def _queue(self, scheduler, calls):
+        order = []
+        threads = []
+
+        def call(index, kwargs):
+            scheduler.acquire(**kwargs)
+            order.append(index)
+            scheduler.release()
+
+        for index, kwargs in enumerate(calls):
+            thread = threading.Thread(target=call, args=(index, kwargs))
+            thread.start()
+            threads.append(thread)
+            while sum(x['queued'] for x in scheduler.metrics().values()) <= index:
+                time.sleep(0.001)
+
+        return order, threads
+
+    def _join(self, threads):
+        for thread in threads:
+            thread.join()
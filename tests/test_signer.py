@@ -0,0 +1,256 @@
+import os
+import base64
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from signer import (Signer, SignerError, CryptoProSigner, PooledSigner, RemoteSigner, FakeSigner, SignerServer,
+                    create_signer, register_signer)
+from cryptopro import CryptoPro
+from tinkoff import Tinkoff, TinkoffError
+
+
+CSPTEST = '''#!/bin/sh
+in=''
+out=''
+operation=''
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -enum_cont) printf '%s\\n' '\\\\.\\HDIMAGE\\container|\\\\.\\HDIMAGE\\HDIMAGE\\\\cont.000\\0001'; exit 0 ;;
+        -hash) operation='hash' ;;
+        -sign) operation='sign' ;;
+        -in) in="$2"; shift ;;
+        -hashout|-out) out="$2"; shift ;;
+    esac
+    shift
+done
+(printf '%s' "$operation"; cat "$in") | sha256sum | cut -d ' ' -f 1 > "$out"
+'''
+
+CERTMGR = '''#!/bin/sh
+printf '%s\\n' \\
+    '======================================================================' \\
+    '1-------' \\
+    'Serial              : 0x00AB' \\
+    'Container           : HDIMAGE\\\\cont.000\\0001' \\
+    '======================================================================'
+'''
+
+
+class SignerConformance:
+    """
+    Checks which every signer backend must pass
+    """
+
+    count = 64
+
+    def get_signer(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.signer = self.get_signer()
+
+    def tearDown(self):
+        self.signer.close()
+
+    def test_fields(self):
+        result = self.signer.sign('1100test_key')
+        self.assertEqual(set(result), {'DigestValue', 'SignatureValue', 'X509SerialNumber'})
+        for key in ('DigestValue', 'SignatureValue'):
+            self.assertIsInstance(result[key], str)
+            self.assertTrue(base64.b64decode(result[key], validate=True))
+        self.assertIsInstance(result['X509SerialNumber'], str)
+
+    def test_content(self):
+        first = self.signer.sign('1100test_key')
+        self.assertEqual(self.signer.sign('1100test_key'), first)
+        second = self.signer.sign('1101test_key')
+        self.assertNotEqual(second['DigestValue'], first['DigestValue'])
+        self.assertNotEqual(second['SignatureValue'], first['SignatureValue'])
+        self.assertEqual(second['X509SerialNumber'], first['X509SerialNumber'])
+        self.assertNotEqual(self.signer.sign('Иванов Иван|test_key')['DigestValue'], first['DigestValue'])
+
+    def test_concurrent(self):
+        contents = ['{}|test_key'.format(i % (self.count // 2)) for i in range(self.count)]
+        expected = {x: self.signer.sign(x) for x in set(contents)}
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(self.signer.sign, contents))
+        self.assertEqual(results, [expected[x] for x in contents])
+
+    def test_async(self):
+        contents = ['{}|test_key'.format(i) for i in range(8)]
+
+        async def sign():
+            return await asyncio.gather(*(self.signer.sign_async(x) for x in contents))
+
+        self.assertEqual(asyncio.run(sign()), [self.signer.sign(x) for x in contents])
+
+
+class FakeSignerTestCase(SignerConformance, TestCase):
+    def get_signer(self):
+        return FakeSigner()
+
+
+class PooledSignerTestCase(SignerConformance, TestCase):
+    def get_signer(self):
+        return PooledSigner(signer={'backend': 'fake'}, size=2)
+
+    def test_timeout(self):
+        class SlowSigner(Signer):
+            def __init__(self):
+                self.event = threading.Event()
+
+            def sign(self, content):
+                self.event.wait()
+                return {}
+
+        slow = SlowSigner()
+        signer = PooledSigner([slow], timeout=0.05)
+        thread = threading.Thread(target=signer.sign, args=('busy',))
+        thread.start()
+        try:
+            with self.assertRaises(SignerError):
+                signer.sign('waiting')
+        finally:
+            slow.event.set()
+            thread.join()
+
+
+class RemoteSignerTestCase(SignerConformance, TestCase):
+    def get_signer(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = SignerServer(FakeSigner(), os.path.join(self.directory.name, 'signer.sock'))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return RemoteSigner(self.server.address)
+
+    def tearDown(self):
+        super().tearDown()
+        self.server.shutdown()
+        self.directory.cleanup()
+
+    def test_errors(self):
+        class FailingSigner(Signer):
+            def sign(self, content):
+                raise SignerError('Keyset does not exist', 2148073494)
+
+        server = SignerServer(FailingSigner(), ('127.0.0.1', 0), secret='secret')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        signer = RemoteSigner(server.address, secret='secret')
+        try:
+            with self.assertRaises(SignerError) as context:
+                signer.sign('content')
+            self.assertEqual(context.exception.code, 2148073494)
+        finally:
+            signer.close()
+            server.shutdown()
+
+        with self.assertRaises(SignerError):
+            signer.sign('content')
+
+    def test_unix_access(self):
+        self.assertEqual(os.stat(self.server.address).st_mode & 0o777, 0o600)
+        self.assertIn('DigestValue', self.signer.sign('content'))
+
+        # A peer of another user is rejected
+        self.server.server.uid = os.getuid() + 1
+        other = RemoteSigner(self.server.address)
+        try:
+            with self.assertRaises(SignerError):
+                other.sign('content')
+        finally:
+            other.close()
+
+    def test_tcp_access(self):
+        with self.assertRaises(SignerError):
+            SignerServer(FakeSigner(), ('0.0.0.0', 0), secret='secret')
+        with self.assertRaises(SignerError):
+            SignerServer(FakeSigner(), ('127.0.0.1', 0))
+
+        server = SignerServer(FakeSigner(), ('127.0.0.1', 0), secret='secret')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        signers = [RemoteSigner(server.address, secret=x) for x in ('secret', 'other', None)]
+        try:
+            self.assertEqual(signers[0].sign('content'), FakeSigner().sign('content'))
+            self.assertEqual(asyncio.run(signers[0].sign_async('content')), FakeSigner().sign('content'))
+            for signer in signers[1:]:
+                with self.assertRaises(SignerError):
+                    signer.sign('content')
+            with self.assertRaises(SignerError):
+                asyncio.run(signers[1].sign_async('content'))
+        finally:
+            for signer in signers:
+                signer.close()
+            server.shutdown()
+
+    def test_reconnect(self):
+        first = self.signer.sign('content')
+        # A daemon restart breaks kept connections
+        self.server.shutdown()
+        self.server = SignerServer(FakeSigner(), self.server.address)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.assertEqual(self.signer.sign('content'), first)
+
+
+class CryptoProSignerTestCase(SignerConformance, TestCase):
+    count = 8
+
+    def get_signer(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, content in (('csptest', CSPTEST), ('certmgr', CERTMGR)):
+            path = os.path.join(self.directory.name, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            os.chmod(path, 0o755)
+
+        cryptopro = CryptoPro(container_name='\\\\.\\HDIMAGE\\container', store_name='uMy')
+        cryptopro.prefix = self.directory.name + '/'
+        return create_signer({'backend': 'cryptopro', 'cryptopro': cryptopro})
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def test_serial(self):
+        self.assertEqual(self.signer.sign('content')['X509SerialNumber'], '00ab')
+
+    def test_errors(self):
+        self.signer.cryptopro.container_name = None
+        with self.assertRaises(SignerError) as context:
+            self.signer.sign('content')
+        self.assertEqual(context.exception.message, 'Cannot generate digest')
+
+
+class SignerTestCase(TestCase):
+    def test_create_signer(self):
+        self.assertIsInstance(create_signer({'backend': 'fake'}), FakeSigner)
+        self.assertIsInstance(create_signer({'container_name': 'container'}), CryptoProSigner)
+        pooled = create_signer({'backend': 'pooled', 'size': 3, 'signer': {'backend': 'fake', 'serial': 'pooled'}})
+        self.assertEqual([x.serial for x in pooled.signers], ['pooled'] * 3)
+        with self.assertRaises(SignerError):
+            create_signer({'backend': 'unknown'})
+
+        register_signer('custom', lambda serial: FakeSigner(serial=serial))
+        self.assertEqual(create_signer({'backend': 'custom', 'serial': 'custom'}).sign('')['X509SerialNumber'], 'custom')
+
+    def test_tinkoff(self):
+        signer = FakeSigner()
+        tinkoff = Tinkoff('test_key', None, signer=signer)
+        result = {'Success': True, 'PaymentId': '1', 'Status': 'COMPLETED'}
+        with patch('tinkoff.Tinkoff._proceed_request', return_value=(result, 200, {})) as request_mock:
+            tinkoff.get_payment('1')
+        data = dict(parse_qsl(request_mock.call_args.kwargs['data'].decode('utf-8')))
+        self.assertEqual(data['DigestValue'], signer.sign('1test_key')['DigestValue'])
+        self.assertEqual(data['SignatureValue'], signer.sign('1test_key')['SignatureValue'])
+
+        class FailingSigner(Signer):
+            def sign(self, content):
+                raise SignerError('Cannot generate signature')
+
+        with self.assertRaises(TinkoffError) as context:
+            Tinkoff('test_key', None, signer=FailingSigner()).get_payment('1')
+        self.assertEqual(context.exception.message, 'Cannot generate signature')
+        self.assertEqual(context.exception.code, '-1')
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+
+from spawner import Spawner, run_command
+from cryptopro import CryptoPro, CryptoProError
+
+
+CSPTEST = '''#!/bin/sh
+if [ "$2" = "-enum_cont" ]; then
+    echo 'AcquireContext: OK. HCRYPTPROV: 12345678'
+    exit 0
+fi
+echo 'Error number 0x80090016 (2148073494).' >&2
+echo 'Keyset does not exist' >&2
+exit 1
+'''
+
+
+class SpawnerTestCase(TestCase):
+    def test_run_command(self):
+        code, stdout, stderr = run_command([sys.executable, '-c', 'import sys; print("out"); sys.exit("err")'])
+        self.assertEqual(code, 1)
+        self.assertEqual(stdout, b'out\n')
+        self.assertEqual(stderr, b'err\n')
+
+        with self.assertRaises(FileNotFoundError):
+            run_command(['/nonexistent/csptest'])
+
+    def test_helper(self):
+        with Spawner(max_workers=4) as spawner:
+            self.assertTrue(spawner.is_alive)
+            args = [[sys.executable, '-c', 'print({})'.format(i)] for i in range(8)]
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(spawner.run, args))
+            self.assertEqual(results, [(0, '{}\n'.format(i).encode(), b'') for i in range(8)])
+
+            # A large output must not block the helper
+            code, stdout, _ = spawner.run([sys.executable, '-c', 'print("x" * 1000000)'])
+            self.assertEqual(len(stdout), 1000001)
+
+            with self.assertRaises(FileNotFoundError):
+                spawner.run(['/nonexistent/csptest'])
+
+            # Not only OS errors are passed back, so a caller never waits for a lost result
+            with self.assertRaises(ValueError):
+                spawner.run(['true\0'], timeout=10)
+            self.assertEqual(spawner.run(['true']), (0, b'', b''))
+        self.assertFalse(spawner.is_alive)
+
+        # Commands are run locally without the helper
+        spawner = Spawner(helper=False)
+        self.assertFalse(spawner.is_alive)
+        self.assertEqual(spawner.run(['true']), (0, b'', b''))
+
+    def test_cryptopro(self):
+        with tempfile.TemporaryDirectory() as directory, Spawner() as spawner:
+            path = os.path.join(directory, 'csptest')
+            with open(path, 'w') as f:
+                f.write(CSPTEST)
+            os.chmod(path, 0o755)
+
+            cryptopro = CryptoPro(container_name='container', spawner=spawner)
+            cryptopro.prefix = directory + '/'
+            self.assertEqual(cryptopro.get_containers(), [])
+            with self.assertRaises(CryptoProError) as context:
+                cryptopro.get_hash(b'content')
+            self.assertEqual(context.exception.code, 2148073494)
+            self.assertEqual(context.exception.message, 'Keyset does not exist')
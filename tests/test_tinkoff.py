@@ -1,8 +1,14 @@
 from unittest import TestCase
-from unittest.mock import patch
+import json
+import time
+from unittest.mock import patch, Mock
+from urllib.parse import parse_qsl
 
-from tinkoff import Tinkoff, TinkoffError
+from tinkoff import Tinkoff, TinkoffError, JSONDecoder, Card, CardStatus, Payment, PaymentStatus, Client
 from cryptopro import CryptoPro
+from metrics import Metrics
+from scheduler import RequestScheduler
+from adaptive import AdaptiveLimiter
 
 
 CRYPTOPRO = {
@@ -283,6 +289,7 @@ class TinkoffTestCase(TestCase):
         with patch('tinkoff.Tinkoff._proceed_request', **request_patch):
             result = self.tinkoff.delete_card(**params)
             self.assertEqual(result['card_id'], success['CardId'])
+            self.assertEqual(list(result), ['card_id', 'status', 'status_name'])
 
         request_patch = self._get_request_patch(fail)
         with patch('tinkoff.Tinkoff._proceed_request', **request_patch):
@@ -346,6 +353,203 @@ class TinkoffTestCase(TestCase):
             with self.assertRaises(TinkoffError):
                 result = self.tinkoff.create_payment(**params)
 
+    def test_iter_cards(self, sign_mock):
+        params = {
+            'client_id': '1',
+        }
+        success = [
+            {
+                'CardId': i,
+                'Pan': '1111 22** **** 4444',
+                'RebillID': i,
+                'Status': 'A',
+                'CardType': 1,
+            } for i in range(100)
+        ]
+        fail = {
+            'TerminalKey': self.tinkoff.terminal_key,
+            'Success': False,
+            'ErrorCode': '1',
+            'Message': 'Some error',
+        }
+
+        with patch('tinkoff.Tinkoff._proceed_stream_request', return_value=self._get_stream_response(success)):
+            items = list(self.tinkoff.iter_cards(**params))
+            self.assertEqual([x['card_id'] for x in items], [x['CardId'] for x in success])
+
+        with patch('tinkoff.Tinkoff._proceed_stream_request', return_value=self._get_stream_response(fail)):
+            with self.assertRaises(TinkoffError) as error:
+                list(self.tinkoff.iter_cards(**params))
+            self.assertEqual(error.exception.code, fail['ErrorCode'])
+
+    def test_iter_cards_pipeline(self, sign_mock):
+        records = []
+        metrics = Metrics()
+        scheduler = RequestScheduler(concurrency=1)
+        limiter = AdaptiveLimiter(initial=1, max_limit=1)
+        tinkoff = Tinkoff(hooks=[records.append], metrics=metrics, scheduler=scheduler,
+                          concurrency_limiter=limiter, **TINKOFF)
+        cards = [{'CardId': i, 'Pan': '4444', 'Status': 'A', 'CardType': 1} for i in range(5)]
+
+        with patch('tinkoff.Tinkoff._proceed_stream_request', return_value=self._get_stream_response(cards)):
+            items = tinkoff.iter_cards('1')
+            self.assertEqual(next(items)['card_id'], 0)
+            # The slot is held while the stream is read
+            self.assertEqual(limiter.in_flight, 1)
+            self.assertEqual(len(list(items)), 4)
+        self.assertEqual(limiter.in_flight, 0)
+        scheduler.acquire('GetState', deadline=time.monotonic() + 1)
+        scheduler.release()
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['operation'], 'GetCardList')
+        self.assertEqual(records[0]['result'], 'ok')
+        self.assertEqual(records[0]['response'], cards)
+        self.assertEqual(metrics.get('requests', terminal=TINKOFF['terminal_key'], operation='GetCardList',
+                                     result='ok'), 1)
+
+        # A stream which is not read to the end is reported with the items read
+        with patch('tinkoff.Tinkoff._proceed_stream_request', return_value=self._get_stream_response(cards)):
+            items = tinkoff.iter_cards('1')
+            next(items)
+            items.close()
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(records[1]['response'], cards[:1])
+
+    def test_decode_stream(self, sign_mock):
+        decoder = JSONDecoder()
+        content = json.dumps([{'Pan': 'пан', 'Id': i} for i in range(20)] + [1.5, 'x', None]).encode()
+        for size in (1, 5, 64, len(content)):
+            chunks = [content[i:i + size] for i in range(0, len(content), size)]
+            self.assertEqual(list(decoder.decode_stream(chunks)), json.loads(content))
+
+        self.assertEqual(decoder.decode_stream([b' {"Success"', b': false}']), {'Success': False})
+        with self.assertRaises(ValueError):
+            list(decoder.decode_stream([b'[{"Id": 1}, ']))
+
+    def test_results(self, sign_mock):
+        payment = Payment('1', 'NEW')
+        self.assertEqual(dict(payment), {
+            'payment_id': '1',
+            'status': 'NEW',
+            'status_name': PaymentStatus.NEW.description,
+        })
+        self.assertIs(payment['status'], PaymentStatus.NEW)
+        self.assertNotIn('url', payment)
+        self.assertEqual(Payment('1', 'NEW', 'https://some.url/')['url'], 'https://some.url/')
+        self.assertEqual(Payment('1', 'SOMETHING')['status_name'], None)
+
+        card = Card(1, 'A', type=1, pan='1111 22** **** 4444')
+        self.assertEqual(len(card), 9)
+        self.assertTrue(card['is_active'])
+        self.assertIs(card['status'], CardStatus.ACTIVE)
+        self.assertEqual({'A': 'active'}[card['status']], 'active')
+        self.assertEqual(card.get('rebill_id', 1), None)
+        self.assertNotIn('pan', Card(1, 'D'))
+
+        client = Client('1', email='test@test.ru')
+        self.assertEqual(client, {'client_id': '1', 'email': 'test@test.ru'})
+        with self.assertRaises(KeyError):
+            client['phone']
+
+        result = card.to_dict()
+        self.assertIsInstance(result, dict)
+        self.assertEqual(json.loads(json.dumps(result))['status'], 'A')
+        result['status'] = 'D'
+        self.assertIs(card['status'], CardStatus.ACTIVE)
+
+    def test_bulk_payout(self, sign_mock):
+        rows = ({
+            'order_id': str(i),
+            'card_id': 1,
+            'amount': 1,
+        } for i in range(10))
+
+        def side_effect(method, url, **kwargs):
+            data = dict(parse_qsl(kwargs['data'].decode('utf-8')))
+            if url.endswith('Init'):
+                if data['OrderId'] == '3':
+                    return {'Success': False, 'ErrorCode': '1', 'Message': 'Some error'}, 200, {}
+                return {'Success': True, 'PaymentId': data['OrderId'], 'Status': 'NEW'}, 200, {}
+            return {'Success': True, 'PaymentId': data['PaymentId'], 'Status': 'COMPLETED'}, 200, {}
+
+        reports = []
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            results = list(self.tinkoff.bulk_payout(rows, concurrency=3, total=10, progress=reports.append))
+
+        self.assertEqual(len(results), 10)
+        failed = [x for x in results if x['error'] is not None]
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0]['row']['order_id'], '3')
+        self.assertIsInstance(failed[0]['error'], TinkoffError)
+        for item in results:
+            if item['error'] is None:
+                self.assertEqual(item['payment_id'], item['row']['order_id'])
+                self.assertEqual(item['status'], 'COMPLETED')
+        self.assertEqual(reports[-1]['processed'], 10)
+        self.assertEqual(reports[-1]['failed'], 1)
+
+        # Rows are found exhausted only after the last of them is done, the final report must be sent anyway
+        reports = []
+        rows = iter([{'order_id': '1', 'card_id': 1, 'amount': 1}])
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            results = list(self.tinkoff.bulk_payout(rows, concurrency=1, progress=reports.append,
+                                                    progress_interval=60))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['processed'], 1)
+
+        # The final report doesn't repeat a periodic one with the same counters
+        reports = []
+        rows = [{'order_id': str(i), 'card_id': 1, 'amount': 1} for i in (11, 12)]
+        with patch('tinkoff.Tinkoff._proceed_request', side_effect=side_effect):
+            list(self.tinkoff.bulk_payout(rows, concurrency=1, progress=reports.append, progress_interval=0))
+        self.assertEqual([x['processed'] for x in reports], [1, 2])
+
+    def test_prepare_request(self, sign_mock):
+        data = {'PaymentId': 1, 'Amount': 100, 'DATA': 'a=b|c=d e', 'ClientId': None}
+        headers = {'Accept': 'application/json'}
+
+        method, url, params = self.tinkoff._prepare_request('POST', 'GetState', data=data, headers=headers)
+
+        self.assertEqual(data, {'PaymentId': 1, 'Amount': 100, 'DATA': 'a=b|c=d e', 'ClientId': None})
+        self.assertEqual(headers, {'Accept': 'application/json'})
+        self.assertEqual(url, self.tinkoff.url + 'GetState')
+        self.assertEqual(params['headers']['Content-Type'], 'application/x-www-form-urlencoded')
+        self.assertEqual(params['headers']['Accept'], 'application/json')
+
+        # The body is always a form, so its type overrides one of a caller
+        params = self.tinkoff._prepare_request('POST', 'GetState', data=data,
+                                               headers={'Content-Type': 'application/json'})[2]
+        self.assertEqual(params['headers']['Content-Type'], 'application/x-www-form-urlencoded')
+
+        sign_mock.assert_called_with('100a=b|c=d e1' + TINKOFF['terminal_key'])
+        self.assertEqual(dict(parse_qsl(params['data'].decode('utf-8'))), dict(SIGN_VALUE, **{
+            'PaymentId': '1',
+            'Amount': '100',
+            'DATA': 'a=b|c=d e',
+            'TerminalKey': TINKOFF['terminal_key'],
+        }))
+
+    def test_prepare_request_overhead(self, sign_mock):
+        # Python-side overhead of building a signed request (without CryptoPro) must stay small
+        sign_mock.return_value = SIGN_VALUE
+        data = {'OrderId': '1000001', 'CardId': 123456, 'Amount': 150000, 'DATA': 'Phone=+79001234567|Email=x@y.ru'}
+        count = 2000
+
+        started = time.perf_counter()
+        for _ in range(count):
+            self.tinkoff._prepare_request('POST', 'Init', data=data)
+        elapsed = (time.perf_counter() - started) / count
+
+        self.assertLess(elapsed, 200e-6)
+
+    def _get_stream_response(self, result, chunk_size=16):
+        content = json.dumps(result).encode()
+        response = Mock(status=200, headers={})
+        response.iter_content.return_value = (content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
+        return response
+
     def _get_request_patch(self, result, status=200, headers=None):
         if headers is None:
             headers = {}
@@ -0,0 +1,161 @@
+import json
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+
+from transport import RequestsTransport, Urllib3Transport, HTTP2Transport, TransportError, httpx
+from tinkoff import Tinkoff, TinkoffError
+from signer import FakeSigner
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:  # pragma: no cover
+    h2 = None
+
+
+
+def get_stub_response(operation, data):
+    if operation == 'AddCard':
+        return 302, {'Success': True, 'RequestKey': data['CustomerKey']}, {'Location': 'https://redirect.url/'}
+    elif operation == 'GetState':
+        return 200, {'Success': True, 'PaymentId': data['PaymentId'], 'Status': 'COMPLETED'}, {}
+    elif operation == 'GetCardList':
+        return 200, [{'CardId': i, 'Pan': '4444', 'Status': 'A', 'CardType': 1} for i in range(3)], {}
+    return 503, {}, {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = dict(parse_qsl(body.decode('utf-8')))
+        self._send(*get_stub_response(self.path.rsplit('/', 1)[-1], data))
+
+    def _send(self, status, result, headers):
+        content = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class H2StubProtocol(asyncio.Protocol):
+    """
+    An HTTP/2 server without TLS (prior knowledge), it doesn't speak HTTP/1.1 at all
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        self.connection.initiate_connection()
+        self.transport.write(self.connection.data_to_send())
+        self.streams = {}
+
+    def data_received(self, data):
+        for event in self.connection.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                headers = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                           for k, v in event.headers}
+                self.streams[event.stream_id] = (headers[':path'], bytearray())
+            elif isinstance(event, h2.events.DataReceived):
+                self.streams[event.stream_id][1].extend(event.data)
+                self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                path, body = self.streams.pop(event.stream_id)
+                data = dict(parse_qsl(body.decode('utf-8')))
+                self._send(event.stream_id, *get_stub_response(path.rsplit('/', 1)[-1], data))
+        self.transport.write(self.connection.data_to_send())
+
+    def _send(self, stream_id, status, result, headers):
+        content = json.dumps(result).encode()
+        self.connection.send_headers(stream_id, [
+            (':status', str(status)),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(content))),
+        ] + [(key.lower(), value) for key, value in headers.items()])
+        self.connection.send_data(stream_id, content, end_stream=True)
+
+
+class TransportTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{}/e2c/'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_requests_transport(self):
+        self._check_transport(RequestsTransport())
+
+    def test_urllib3_transport(self):
+        self._check_transport(Urllib3Transport())
+
+    @skipIf(httpx is None, 'httpx is not installed')
+    def test_http2_transport(self):
+        # The HTTP/1.1 stub checks a fallback to HTTP/1.1 (a server doesn't negotiate HTTP/2)
+        self._check_transport(HTTP2Transport())
+
+    @skipIf(httpx is None or h2 is None, 'httpx[http2] is not installed')
+    def test_http2_transport_h2(self):
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(loop.create_server(H2StubProtocol, '127.0.0.1', 0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            server.close()
+            loop.close()
+
+        self.addCleanup(stop)
+
+        transport = HTTP2Transport(http1=False)
+        versions = []
+        transport.client.event_hooks['response'].append(lambda response: versions.append(response.http_version))
+        url = 'http://127.0.0.1:{}/e2c/'.format(server.sockets[0].getsockname()[1])
+        self._check_transport(transport, url)
+        self.assertTrue(versions)
+        self.assertEqual(set(versions), {'HTTP/2'})
+
+    def _check_transport(self, transport, url=None):
+        url = url or self.url
+        response = transport.request('POST', url + 'GetState', data={'PaymentId': '1'})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(response.content)['PaymentId'], '1')
+
+        with self.assertRaises(TransportError) as error:
+            transport.request('POST', url + 'Payment', data={'PaymentId': '1'})
+        self.assertEqual(error.exception.status, 503)
+
+        tinkoff = Tinkoff('test_key', None, signer=FakeSigner(), is_test=True, transport=transport)
+        with patch.object(Tinkoff, 'test_url', url):
+            result = tinkoff.create_card(client_id='1')
+            self.assertEqual(result['request_id'], '1')
+            self.assertEqual(result['url'], 'https://redirect.url/')
+
+            self.assertEqual(tinkoff.get_payment('1')['status'], 'COMPLETED')
+            self.assertEqual([x['card_id'] for x in tinkoff.iter_cards('1')], [0, 1, 2])
+
+            with self.assertRaises(TinkoffError):
+                tinkoff.proceed_payment('1')
+
+        transport.close()
@@ -0,0 +1,141 @@
+import os
+import time
+import tempfile
+import threading
+from unittest import TestCase
+
+from tinkoff import Payment
+from watcher import PaymentWatcher, HashRing, get_slot
+
+
+class FakeTinkoff:
+    """
+    Records polls and marks payments which are polled by two nodes at once
+    """
+
+    def __init__(self, node, polls, active, lock, latency=0.0, completed=()):
+        self.node = node
+        self.polls = polls
+        self.active = active
+        self.lock = lock
+        self.latency = latency
+        self.completed = set(completed)
+
+    def get_payment(self, payment_id):
+        with self.lock:
+            if payment_id in self.active:
+                self.polls.append(('overlap', payment_id))
+            self.active.add(payment_id)
+            self.polls.append((self.node, payment_id))
+        time.sleep(self.latency)
+        with self.lock:
+            self.active.discard(payment_id)
+        return Payment(payment_id, 'COMPLETED' if payment_id in self.completed else 'CHECKING')
+
+
+class PaymentWatcherTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'watcher.sqlite')
+        self.polls = []
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ring(self):
+        slots = [get_slot(x) for x in range(2000)]
+        ring = HashRing(['a', 'b', 'c'])
+        owners = [ring.get_node(x) for x in slots]
+
+        for node in ('a', 'b', 'c'):
+            ranges = ring.get_ranges(node)
+            owned = [any(start < x <= end or start < x - (1 << 32) <= end for start, end in ranges) for x in slots]
+            self.assertEqual(owned, [x == node for x in owners])
+            self.assertGreater(owners.count(node), 400)
+
+        # Only keys of a new node are moved
+        grown = HashRing(['a', 'b', 'c', 'd'])
+        moved = [(x, grown.get_node(s)) for x, s in zip(owners, slots) if grown.get_node(s) != x]
+        self.assertTrue(all(x[1] == 'd' for x in moved))
+        self.assertLess(len(moved), 800)
+
+    def test_sharding(self):
+        watchers = [self._get_watcher(x, completed=range(0, 300, 3), poll_interval=0.5) for x in ('a', 'b', 'c')]
+        watchers[0].add(str(x) for x in range(300))
+        for watcher in watchers:
+            watcher.heartbeat()
+
+        for watcher in watchers:
+            watcher.poll()
+
+        polled = [x[1] for x in self.polls]
+        self.assertEqual(sorted(polled), sorted(str(x) for x in range(300)))
+        for node in ('a', 'b', 'c'):
+            self.assertGreater(len([x for x in self.polls if x[0] == node]), 50)
+
+        # Payments are not due yet
+        for watcher in watchers:
+            self.assertEqual(watcher.poll(), [])
+
+        # Terminal payments are not watched anymore, others are taken by live nodes
+        watchers[2].leave()
+        self.polls.clear()
+        time.sleep(0.5)
+        for watcher in watchers[:2]:
+            watcher.heartbeat()
+        for watcher in watchers[:2]:
+            watcher.poll()
+        polled = [x[1] for x in self.polls]
+        self.assertEqual(sorted(polled), sorted(str(x) for x in range(300) if x % 3))
+
+        for watcher in watchers:
+            watcher.close()
+
+    def test_concurrent(self):
+        watchers = [self._get_watcher(x, latency=0.002, poll_interval=0.05, batch_size=20) for x in ('a', 'b', 'c')]
+        watchers[0].add(str(x) for x in range(100))
+
+        stop = threading.Event()
+        threads = [threading.Thread(target=x.run, args=(stop,)) for x in watchers]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        # A node joins and another one leaves while polling
+        joined = self._get_watcher('d', latency=0.002, poll_interval=0.05, batch_size=20)
+        threads.append(threading.Thread(target=joined.run, args=(stop,)))
+        threads[-1].start()
+        time.sleep(0.3)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        nodes = {x[0] for x in self.polls}
+        self.assertNotIn('overlap', nodes)
+        self.assertEqual(nodes, {'a', 'b', 'c', 'd'})
+        self.assertEqual({x[1] for x in self.polls}, {str(x) for x in range(100)})
+
+    def test_slow_batch(self):
+        # A batch is polled longer than `lease_ttl`, its leases and the heartbeat must not expire meanwhile
+        slow = self._get_watcher('a', latency=0.6, lease_ttl=0.3)
+        other = self._get_watcher('b', lease_ttl=0.3)
+        ring = HashRing(['a', 'b'])
+        slow.add([x for x in map(str, range(100)) if ring.get_node(get_slot(x)) == 'a'][:3])
+
+        thread = threading.Thread(target=slow.poll)
+        thread.start()
+        time.sleep(0.45)
+        self.assertEqual(other.heartbeat(), ['a', 'b'])
+        self.assertEqual(other.poll(), [])
+        thread.join()
+
+        self.assertEqual([x[0] for x in self.polls], ['a'] * 3)
+        slow.close()
+        other.close()
+
+    def _get_watcher(self, node, latency=0.0, completed=(), **kwargs):
+        tinkoff = FakeTinkoff(node, self.polls, self.active, self.lock, latency, {str(x) for x in completed})
+        kwargs.setdefault('poll_interval', 60)
+        kwargs.setdefault('lease_ttl', 5)
+        return PaymentWatcher(tinkoff, self.path, node_id=node, batch_size=kwargs.pop('batch_size', 1000), **kwargs)
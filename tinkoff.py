@@ -1,5 +1,29 @@
-import requests
+import argparse
 import logging
+import codecs
+import json
+import sys
+import time
+import contextvars
+from contextlib import contextmanager
+from collections.abc import Mapping
+from enum import Enum
+from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    from .transport import RequestsTransport
+    from .signer import CryptoProSigner, SignerError
+    from .scheduler import SchedulerError, PRIORITY_BATCH, call_options, get_call_options
+except ImportError:
+    from transport import RequestsTransport
+    from signer import CryptoProSigner, SignerError
+    from scheduler import SchedulerError, PRIORITY_BATCH, call_options, get_call_options
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +52,9 @@ CARD_STATUS_MAPPING = {
     'E': 'Срок действия истек',
     'D': 'Удалена',
 }
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+TERMINAL_PAYMENT_STATUSES = frozenset(('COMPLETED', 'REJECTED'))
 CARD_TYPE_MAPPING = {
     0: 'Карта списания',
     1: 'Карта пополнения',
@@ -35,7 +62,367 @@ CARD_TYPE_MAPPING = {
 }
 
 
+class PaymentStatus(str, Enum):
+    """
+    Payment `Status` codes, the description is available as `description`
+    """
+
+    NEW = 'NEW'
+    CHECKING = 'CHECKING'
+    CHECKED = 'CHECKED'
+    COMPLETING = 'COMPLETING'
+    COMPLETED = 'COMPLETED'
+    REJECTED = 'REJECTED'
+    PROCESSING = 'PROCESSING'
+    UNKNOWN = 'UNKNOWN'
+
+    __str__ = str.__str__
+    __hash__ = str.__hash__
+
+    @property
+    def description(self):
+        return PAYMENT_STATUS_MAPPING.get(self.value)
+
+
+class CardStatus(str, Enum):
+    """
+    Card `Status` codes, the description is available as `description`
+    """
+
+    ACTIVE = 'A'
+    INACTIVE = 'I'
+    EXPIRED = 'E'
+    DELETED = 'D'
+
+    __str__ = str.__str__
+    __hash__ = str.__hash__
+
+    @property
+    def description(self):
+        return CARD_STATUS_MAPPING.get(self.value)
+
+
+class CardType(int, Enum):
+    """
+    `CardType` codes, the description is available as `description`
+    """
+
+    DEBIT = 0
+    CREDIT = 1
+    DEBIT_CREDIT = 2
+
+    __str__ = int.__repr__
+    __hash__ = int.__hash__
+
+    @property
+    def description(self):
+        return CARD_TYPE_MAPPING.get(self.value)
+
+
+def _parse_code(enum, value):
+    """
+    Returns an enum member for a known code or the (interned) code itself for an unknown one
+    """
+
+    member = enum._value2member_map_.get(value)
+    if member is not None:
+        return member
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class Result(Mapping):
+    """
+    A base class for compact results which are read-only mappings with a fixed set of keys
+
+    Values are stored in slots, computed keys (like descriptions) are evaluated on access.
+    Keys from `_optional` are omitted when their value is None. A result is not a `dict`:
+    use `to_dict()` to serialize it (like with `json.dumps()`) or to change it.
+
+    Methods
+    -------
+    to_dict()
+        get a dict copy of a result
+    """
+
+    __slots__ = ()
+    _keys = ()
+    _optional = ()
+
+    def __getitem__(self, key):
+        if key not in self._keys or (key in self._optional and getattr(self, key) is None):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        for key in self._keys:
+            if key not in self._optional or getattr(self, key) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(k, self[k]) for k in self))
+
+    def to_dict(self):
+        """
+        Returns a dict copy of a result (codes stay `str` and `int` enum members)
+
+        Returns
+        -------
+        dict: keys and values of a result
+        """
+
+        return {k: self[k] for k in self}
+
+
+class Payment(Result):
+    """
+    A payment info:
+        - payment_id[int] - `PaymentId`
+        - status[PaymentStatus] - `Status`
+        - status_name[str] - `Status` description
+        - url[str] - `PaymentURL` (optional)
+        - amount[float] - `Amount` in basic units (optional)
+    """
+
+    __slots__ = ('payment_id', 'status', 'url', 'amount')
+    _keys = ('payment_id', 'status', 'status_name', 'url', 'amount')
+    _optional = ('url', 'amount')
+
+    def __init__(self, payment_id, status, url=None, amount=None):
+        self.payment_id = payment_id
+        self.status = _parse_code(PaymentStatus, status)
+        self.url = url
+        self.amount = amount
+
+    @property
+    def status_name(self):
+        return PAYMENT_STATUS_MAPPING.get(self.status)
+
+
+class Card(Result):
+    """
+    A card info:
+        - card_id[int] - `CardId`
+        - type[CardType] -  `CardType` (optional)
+        - type_name[str] - `CardType` description (optional)
+        - pan[str] - `Pan` (masked, optional)
+        - status[CardStatus] - `Status`
+        - status_name[str] - `Status` description
+        - rebill_id[int] - `RebillID`
+        - expires[str] - `ExpDate`
+        - is_active[bool] - card has `A` (active) `Status`
+    """
+
+    __slots__ = ('card_id', 'type', 'pan', 'status', 'rebill_id', 'expires')
+    _keys = ('card_id', 'type', 'type_name', 'pan', 'status', 'status_name', 'rebill_id', 'expires', 'is_active')
+    _optional = ('type', 'type_name', 'pan')
+
+    def __init__(self, card_id, status, type=None, pan=None, rebill_id=None, expires=None):
+        self.card_id = card_id
+        self.status = _parse_code(CardStatus, status)
+        self.type = _parse_code(CardType, type)
+        self.pan = pan
+        self.rebill_id = rebill_id
+        self.expires = expires
+
+    @property
+    def status_name(self):
+        return CARD_STATUS_MAPPING.get(self.status)
+
+    @property
+    def type_name(self):
+        return None if self.type is None else CARD_TYPE_MAPPING.get(self.type)
+
+    @property
+    def is_active(self):
+        return self.status == CardStatus.ACTIVE
+
+
+class RemovedCard(Card):
+    """
+    A status of a removed card:
+        - card_id[int] - `CardId`
+        - status[CardStatus] - `Status`
+        - status_name[str] - `Status` description
+    """
+
+    __slots__ = ()
+    _keys = ('card_id', 'status', 'status_name')
+
+
+class CardRequest(Result):
+    """
+    A request for creating a card:
+        - request_id[str] - `RequestKey`
+        - url[str] - `PaymentURL` or `Location` header when got a 3xx status (optional)
+    """
+
+    __slots__ = ('request_id', 'url')
+    _keys = ('request_id', 'url')
+    _optional = ('url',)
+
+    def __init__(self, request_id, url=None):
+        self.request_id = request_id
+        self.url = url
+
+
+class Client(Result):
+    """
+    A client info:
+        - client_id[str] - `CustomerKey`
+        - email[str] - `Email` (optional)
+        - phone[str] - `Phone` (optional)
+    """
+
+    __slots__ = ('client_id', 'email', 'phone')
+    _keys = ('client_id', 'email', 'phone')
+    _optional = ('email', 'phone')
+
+    def __init__(self, client_id, email=None, phone=None):
+        self.client_id = client_id
+        self.email = email
+        self.phone = phone
+
+
+class JSONDecoder:
+    """
+    A decoder of bank responses based on stdlib `json`
+
+    Methods
+    -------
+    loads()
+        decode a whole response body
+    decode_stream()
+        decode a response body from an iterable of chunks
+    """
+
+    encoding = 'utf-8'
+
+    def loads(self, content):
+        """
+        Returns a decoded response body
+
+        Parameters
+        ----------
+        content[str, bytes]: a response body
+
+        Returns
+        -------
+        dict, list: a decoded document
+        """
+
+        return json.loads(content)
+
+    def decode_stream(self, chunks):
+        """
+        Decodes a response body from an iterable of chunks
+
+        An object document is decoded as a whole. Items of an array document are decoded
+        one by one while chunks are read, so the array itself is never built.
+
+        Parameters
+        ----------
+        chunks[iterable]: bytes chunks of a response body
+
+        Returns
+        -------
+        dict, iterator: a decoded object or an iterator over array items
+        """
+
+        chunks = iter(chunks)
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        buffer = ''
+        while not buffer.strip():
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Empty response body')
+            buffer += decoder.decode(chunk)
+
+        buffer = buffer.lstrip()
+        if buffer[0] != '[':
+            return self.loads(buffer + ''.join(decoder.decode(x) for x in chunks) + decoder.decode(b'', True))
+        return self._iter_items(chunks, decoder, buffer[1:])
+
+    def _iter_items(self, chunks, decoder, buffer):
+        raw_decoder = json.JSONDecoder()
+        whitespace = ' \t\r\n'
+        exhausted = False
+        expect_value = True
+        first = True
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in whitespace:
+                pos += 1
+
+            if pos < len(buffer):
+                char = buffer[pos]
+                if char == ']' and (first or not expect_value):
+                    return
+                if not expect_value:
+                    if char != ',':
+                        raise ValueError('Expecting "," at position {}'.format(pos))
+                    pos += 1
+                    expect_value = True
+                    continue
+
+                try:
+                    item, end = raw_decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    if exhausted:
+                        raise
+                else:
+                    # A value is complete only when it's followed by a separator, otherwise it may be
+                    # a truncated one (like a number split between chunks)
+                    tail = end
+                    while tail < len(buffer) and buffer[tail] in whitespace:
+                        tail += 1
+                    if exhausted or (tail < len(buffer) and buffer[tail] in ',]'):
+                        yield item
+                        pos = tail
+                        expect_value = False
+                        first = False
+                        continue
+            elif exhausted:
+                raise ValueError('Unexpected end of response body')
+
+            chunk = next(chunks, None)
+            buffer = buffer[pos:]
+            pos = 0
+            if chunk is None:
+                exhausted = True
+                buffer += decoder.decode(b'', True)
+            else:
+                buffer += decoder.decode(chunk)
+
+
+class OrjsonDecoder(JSONDecoder):
+    """
+    A decoder of bank responses based on `orjson`
+    """
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+def get_default_decoder():
+    """
+    Returns the fastest available decoder
+    """
+
+    if orjson is not None:
+        return OrjsonDecoder()
+    return JSONDecoder()
+
+
 class TinkoffError(Exception):
+    # Whether a request may have been processed by the bank without a response (like on a timeout)
+    in_doubt = False
+
     def __init__(self, message, code='-1'):
         super().__init__(message, code)
         self.message = message
@@ -49,6 +436,11 @@ class Tinkoff:
     """
     A class for Tinkoff's E2C operations
 
+    An instance is thread-safe and is meant to be shared by all threads of a process:
+    a request changes neither the instance nor arguments of a caller, and resources
+    of the instance (a transport, a signer, a cache, limiters, a journal, metrics)
+    are safe for concurrent use.
+
     Methods
     -------
     create_payment()
@@ -69,27 +461,76 @@ class Tinkoff:
         delete a card by id and client id
     get_cards()
         get a list of cards by client id
+    invalidate_cards()
+        drop a cached list of cards by client id
     get_card_check_types()
         get a list of available card check types
+    bulk_payout()
+        create and proceed payments for every row of an iterable
+    presign()
+        sign payment state requests in advance
+    request()
+        send a request of any operation
     """
 
     test_url = 'https://rest-api-test.tinkoff.ru/e2c/'
     prod_url = 'https://securepay.tinkoff.ru/e2c/'
 
-    def __init__(self, terminal_key, cryptopro, is_test=False):
+    stream_chunk_size = 64 * 1024
+
+    def __init__(self, terminal_key, cryptopro, is_test=False, journal=None, decoder=None, rate_limiter=None,
+                 concurrency_limiter=None, transport=None, cache=None, cards_ttl=60, payment_ttl=86400, metrics=None,
+                 signer=None, scheduler=None, hooks=None, profiler=None, presigned=None, add_card_ttl=3600,
+                 pending_cards_ttl=5):
         """
         Parameters
         ----------
         terminal_key[str]: the terminal key (got from bank)
-        cryptopro[CryptoPro]: CryptoPro instance
+        cryptopro[CryptoPro]: CryptoPro instance (may be None when `signer` is given)
         is_test[bool]: use test endpoint for requests
+        journal[PayoutJournal]: a journal to record payments to and to resume them from
+        decoder[JSONDecoder]: a response decoder (`orjson` based one when it's installed by default)
+        rate_limiter[RateLimiter]: a limiter to wait for before a request is signed
+        concurrency_limiter[AdaptiveLimiter]: a limiter of simultaneous requests
+        transport[Transport]: an HTTP transport (`RequestsTransport` by default)
+        cache[SharedCache]: a cache to share card lists and final payment states between processes
+        cards_ttl[float]: seconds to keep a card list in `cache`
+        payment_ttl[float]: seconds to keep a final payment state in `cache`
+        metrics[Metrics]: a sink for request counters and latencies (tagged with the terminal key)
+        signer[Signer]: a request signer (`CryptoProSigner` of `cryptopro` by default)
+        scheduler[RequestScheduler]: a scheduler to wait for a slot in before a request is signed
+            (see `call_options()` to set a priority, a tenant or a deadline of requests)
+        hooks[iterable]: callables which take a record of every finished request (see `_send()`),
+            they are called in a thread of the request and must not change the record
+        profiler[SlowRequestProfiler]: a profiler to keep reports of slow requests
+        presigned[PresignedStore]: a store of signatures computed in advance (see `presign()`)
+        add_card_ttl[float]: seconds a client may complete a form of `create_card()` in
+        pending_cards_ttl[float]: seconds to keep a card list in `cache` while a form is not completed,
+            so a new card appears soon (see `invalidate_cards()`)
         """
 
         assert terminal_key, 'Terminal key must be defined'
+        assert cryptopro is not None or signer is not None, 'CryptoPro or signer must be defined'
 
         self.terminal_key = terminal_key
         self.cryptopro = cryptopro
         self.is_test = is_test
+        self.journal = journal
+        self.decoder = decoder if decoder is not None else get_default_decoder()
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.transport = transport if transport is not None else RequestsTransport()
+        self.cache = cache
+        self.cards_ttl = cards_ttl
+        self.payment_ttl = payment_ttl
+        self.metrics = metrics
+        self.signer = signer if signer is not None else CryptoProSigner(cryptopro)
+        self.scheduler = scheduler
+        self.hooks = tuple(hooks or ())
+        self.profiler = profiler
+        self.presigned = presigned
+        self.add_card_ttl = add_card_ttl
+        self.pending_cards_ttl = pending_cards_ttl
 
     def create_payment(self, order_id, card_id, amount, client_id=None, data=None):
         """
@@ -105,7 +546,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: payment data:
+        Payment: payment info:
             - payment_id[int] - `PaymentId`
             - status[str] - `Status`
             - status_name[str] - `Status` description
@@ -128,16 +569,29 @@ class Tinkoff:
         if data is not None:
             request['DATA'] = self._join_data(data)
 
-        response = self._request('POST', 'Init', data=request)
-        result = {
-            'payment_id': response['PaymentId'],
-            'status': response['Status'],
-            'status_name': PAYMENT_STATUS_MAPPING.get(response['Status']),
-        }
-        if 'PaymentURL' in response:
-            result['url'] = response['PaymentURL']
-        elif 'URL' in response:
-            result['url'] = response['URL']
+        if self.journal is None:
+            response = self._request('POST', 'Init', data=request)
+        else:
+            # The intent is committed before the request, so a crash never leads to a second `Init`,
+            # and it's checked and recorded at once, so concurrent calls never send two of them either
+            entry = self.journal.try_record_intent(order_id)
+            if entry is not None and entry['step'] == 'pending':
+                raise TinkoffError('Init of order {} may be already sent, check the order and discard it '
+                                   'from the journal to retry'.format(order_id))
+            if entry is not None:
+                logger.info('Payment for order %s is already registered, Init is skipped', order_id)
+                return Payment(entry['payment_id'], entry['status'], entry['url'])
+            try:
+                response = self._request('POST', 'Init', data=request)
+            except TinkoffError as e:
+                if not e.in_doubt:
+                    self.journal.discard(order_id)
+                raise
+        result = Payment(response['PaymentId'], response['Status'], response.get('PaymentURL', response.get('URL')))
+
+        if self.journal is not None:
+            self.journal.record_init(order_id, result.payment_id, result.status, result.url)
+
         return result
 
     def proceed_payment(self, payment_id):
@@ -150,7 +604,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: payment info:
+        Payment: payment info:
             - id[int] - `PaymentId`
             - status[str] - `Status`
             - status_name[str] - `Status` description
@@ -162,15 +616,22 @@ class Tinkoff:
         TinkoffError: when got an error from the bank
         """
 
+        if self.journal is not None:
+            entry = self.journal.find(payment_id)
+            if entry is not None and entry['step'] == 'payment':
+                logger.info('Payment %s is already proceeded, Payment is skipped', payment_id)
+                return Payment(entry['payment_id'], entry['status'])
+
         request = {
             'PaymentId': payment_id,
         }
         response = self._request('POST', 'Payment', data=request)
-        return {
-            'payment_id': response['PaymentId'],
-            'status': response['Status'],
-            'status_name': PAYMENT_STATUS_MAPPING.get(response['Status']),
-        }
+        result = Payment(response['PaymentId'], response['Status'])
+
+        if self.journal is not None:
+            self.journal.record_status(payment_id, result.status, 'payment')
+
+        return result
 
     def get_payment(self, payment_id):
         """
@@ -182,25 +643,66 @@ class Tinkoff:
 
         Returns
         -------
-        dict: payment info:
+        Payment: payment info:
             - id[int] - `PaymentId`
             - status[str] - `Status`
             - status_name[str] - `Status` description
+            - amount[float] - `Amount` (when returned by the bank)
 
         Raises
         ------
         TinkoffError: when got an error
         """
 
+        if self.cache is not None:
+            result = self.cache.get(self._get_cache_key('payment', payment_id))
+            if result is not None:
+                return result
+
         request = {
             'PaymentId': payment_id,
         }
         response = self._request('POST', 'GetState', data=request)
-        return {
-            'payment_id': response['PaymentId'],
-            'status': response['Status'],
-            'status_name': PAYMENT_STATUS_MAPPING.get(response['Status']),
-        }
+        amount = response.get('Amount')
+        result = Payment(response['PaymentId'], response['Status'],
+                         amount=None if amount is None else self._restore_amount(amount))
+
+        if self.cache is not None and result.status in TERMINAL_PAYMENT_STATUSES:
+            self.cache.set(self._get_cache_key('payment', payment_id), result, self.payment_ttl)
+
+        if self.journal is not None and self.journal.find(payment_id) is not None:
+            self.journal.record_status(payment_id, result.status)
+
+        return result
+
+    def presign(self, payment_ids):
+        """
+        Signs `GetState` requests of payments in advance (for example, while a signer is idle),
+        so `get_payment()` of these payments only sends a request
+
+        Parameters
+        ----------
+        payment_ids[iterable]: `PaymentId`s
+
+        Returns
+        -------
+        int: a number of signed requests (requests which are already signed are skipped)
+
+        Raises
+        ------
+        TinkoffError: when got a signing error
+        """
+
+        assert self.presigned is not None, 'Presigned store must be defined'
+
+        count = 0
+        for payment_id in payment_ids:
+            content, _ = self._encode_fields({'PaymentId': payment_id})
+            if content in self.presigned:
+                continue
+            self.presigned.put(content, self._get_sign(content))
+            count += 1
+        return count
 
     def create_client(self, client_id, email=None, phone=None):
         """
@@ -214,7 +716,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: client info:
+        Client: client info:
             - client_id[str] - `CustomerKey`
 
         Raises
@@ -230,9 +732,7 @@ class Tinkoff:
         if phone is not None:
             request['Phone'] = phone
         response = self._request('POST', 'AddCustomer', data=request)
-        return {
-            'client_id': response['CustomerKey'],
-        }
+        return Client(response['CustomerKey'])
 
     def delete_client(self, client_id):
         """
@@ -244,7 +744,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: client info:
+        Client: client info:
             - client_id[str] - `CustomerKey`
 
         Raises
@@ -256,9 +756,7 @@ class Tinkoff:
             'CustomerKey': client_id,
         }
         response = self._request('POST', 'RemoveCustomer', data=request)
-        return {
-            'client_id': response['CustomerKey'],
-        }
+        return Client(response['CustomerKey'])
 
     def get_client(self, client_id):
         """
@@ -270,7 +768,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: client info:
+        Client: client info:
             - client_id[str] - `CustomerKey`
             - email[str] - `Email`
             - phone[str] - `Phone`
@@ -284,14 +782,7 @@ class Tinkoff:
             'CustomerKey': client_id,
         }
         response = self._request('POST', 'GetCustomer', data=request)
-        result = {
-            'client_id': response['CustomerKey'],
-        }
-        if 'Email' in response:
-            result['email'] = response['Email']
-        if 'Phone' in response:
-            result['phone'] = response['Phone']
-        return result
+        return Client(response['CustomerKey'], response.get('Email'), response.get('Phone'))
 
     def create_card(self, client_id, check_type=None, comment=None, form_type=None):
         """
@@ -306,7 +797,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: request info:
+        CardRequest: request info:
             - request_id[str] - `RequestKey`
             - url[str] - `PaymentURL` or `Location` header when got a 3xx status
 
@@ -327,14 +818,11 @@ class Tinkoff:
         if form_type is not None:
             request['PayForm'] = form_type
         response = self._request('POST', 'AddCard', data=request, allow_redirects=False)
-        result = {
-            'request_id': response['RequestKey'],
-        }
-        if 'PaymentURL' in response:
-            result['url'] = response['PaymentURL']
-        elif 'URL' in response:
-            result['url'] = response['URL']
-        return result
+        if self.cache is not None:
+            # A card is added when a client completes the form, so card lists are kept shortly till then
+            self.cache.set(self._get_cache_key('adding_card', client_id), True, self.add_card_ttl)
+            self.cache.delete(self._get_cache_key('cards', client_id))
+        return CardRequest(response['RequestKey'], response.get('PaymentURL', response.get('URL')))
 
     def delete_card(self, card_id, client_id):
         """
@@ -347,7 +835,7 @@ class Tinkoff:
 
         Returns
         -------
-        dict: card info:
+        RemovedCard: card info:
             - card_id[int] - `CardId`
             - status[str] - `Status`
             - status_name[str] - `Status` description
@@ -362,11 +850,9 @@ class Tinkoff:
             'CustomerKey': client_id,
         }
         response = self._request('POST', 'RemoveCard', data=request)
-        return {
-            'card_id': response['CardId'],
-            'status': response['Status'],
-            'status_name': CARD_STATUS_MAPPING.get(response['Status']),
-        }
+        if self.cache is not None:
+            self.cache.delete(self._get_cache_key('cards', client_id))
+        return RemovedCard(response['CardId'], response['Status'])
 
     def get_cards(self, client_id):
         """
@@ -378,7 +864,7 @@ class Tinkoff:
 
         Returns
         -------
-        list[dict]: cards:
+        list[Card]: cards:
             - card_id[int] - `CardId`
             - status[str] - `Status`
             - status_name[str] - `Status` description
@@ -394,21 +880,76 @@ class Tinkoff:
         TinkoffError: when got an error
         """
 
+        if self.cache is not None:
+            result = self.cache.get(self._get_cache_key('cards', client_id))
+            if result is not None:
+                return result
+
         request = {
             'CustomerKey': client_id,
         }
         response = self._request('POST', 'GetCardList', data=request)
-        return [{
-            'card_id': x['CardId'],
-            'type': x['CardType'],
-            'type_name': CARD_TYPE_MAPPING.get(x['CardType']),
-            'pan': x['Pan'],
-            'status': x['Status'],
-            'status_name': CARD_STATUS_MAPPING.get(x['Status']),
-            'rebill_id': x.get('RebillID'),
-            'expires': x.get('ExpDate'),
-            'is_active': (x['Status'] == 'A'),
-        } for x in response['items']]
+        result = [Card(
+            x['CardId'],
+            x['Status'],
+            type=x['CardType'],
+            pan=x['Pan'],
+            rebill_id=x.get('RebillID'),
+            expires=x.get('ExpDate'),
+        ) for x in response['items']]
+
+        if self.cache is not None:
+            ttl = self.cards_ttl
+            if self.cache.get(self._get_cache_key('adding_card', client_id)) is not None:
+                ttl = min(ttl, self.pending_cards_ttl)
+            self.cache.set(self._get_cache_key('cards', client_id), result, ttl)
+
+        return result
+
+    def invalidate_cards(self, client_id):
+        """
+        Drops a cached card list of a client, like when got a notification of an added card
+
+        Parameters
+        ----------
+        client_id[str]: `CustomerKey`
+        """
+
+        if self.cache is not None:
+            self.cache.delete(self._get_cache_key('adding_card', client_id))
+            self.cache.delete(self._get_cache_key('cards', client_id))
+
+    def iter_cards(self, client_id):
+        """
+        Iterates over client's cards while the response is being received
+
+        Cards are decoded one by one from the response stream, so a list of all cards is never built.
+
+        Parameters
+        ----------
+        client_id[str]: `CustomerKey`
+
+        Yields
+        ------
+        Card: card info (see `get_cards()`)
+
+        Raises
+        ------
+        TinkoffError: when got an error
+        """
+
+        request = {
+            'CustomerKey': client_id,
+        }
+        for x in self._request_items('POST', 'GetCardList', data=request):
+            yield Card(
+                x['CardId'],
+                x['Status'],
+                type=x['CardType'],
+                pan=x['Pan'],
+                rebill_id=x.get('RebillID'),
+                expires=x.get('ExpDate'),
+            )
 
     def get_card_check_types(self):
         """
@@ -423,39 +964,426 @@ class Tinkoff:
 
         return [{'code': x[0], 'name': x[1]} for x in CARD_CHECK_TYPES]
 
+    def bulk_payout(self, rows, concurrency=8, total=None, progress=None, progress_interval=5.0):
+        """
+        Creates and proceeds payments (`Init` then `Payment`) for every row of an iterable
+
+        Rows are consumed lazily and no more than `concurrency` of them are in progress at once,
+        so memory usage doesn't depend on the number of rows. A failed row doesn't stop the run,
+        its error is yielded with the row result. Requests of rows have the batch priority
+        unless another one is set by `call_options()`.
+
+        Parameters
+        ----------
+        rows[iterable]: dicts with `create_payment` arguments (`order_id`, `card_id`, `amount`, ...)
+        concurrency[int]: a number of rows processed simultaneously
+        total[int]: an expected number of rows (used for ETA estimation)
+        progress[callable]: a callback which takes a progress info dict:
+            - processed[int] - a number of processed rows
+            - failed[int] - a number of failed rows
+            - elapsed[float] - seconds since start
+            - rate[float] - rows per second
+            - eta[float] - seconds left (None when `total` is not set)
+        progress_interval[float]: seconds between progress reports
+
+        Yields
+        ------
+        dict: row result (in order of completion):
+            - row[dict] - a source row
+            - payment_id[int] - `PaymentId` (None when `Init` is failed)
+            - status[str] - `Status`
+            - status_name[str] - `Status` description
+            - error[Exception] - an error or None when the row is succeeded
+        """
+
+        assert concurrency > 0, 'Concurrency must be positive'
+
+        rows = iter(rows)
+        pending = set()
+        exhausted = False
+        started = last_report = time.monotonic()
+        processed = failed = 0
+        reported = None
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency:
+                    try:
+                        row = next(rows)
+                    except StopIteration:
+                        exhausted = True
+                    else:
+                        context = contextvars.copy_context()
+                        pending.add(executor.submit(context.run, self._bulk_payout_row, row))
+
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    processed += 1
+                    if result['error'] is not None:
+                        failed += 1
+                    yield result
+
+                now = time.monotonic()
+                if now - last_report >= progress_interval:
+                    last_report = now
+                    reported = (processed, failed)
+                    self._report_bulk_progress(progress, processed, failed, now - started, total)
+
+            # Rows may be found exhausted only after the last of them is done, so the final report
+            # is made after the loop unless a periodic one has just reported the same counters
+            if reported != (processed, failed):
+                self._report_bulk_progress(progress, processed, failed, time.monotonic() - started, total)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def request(self, operation, data=None, method='POST'):
+        """
+        Sends a request of an operation with the whole request pipeline (scheduling, limits,
+        signing, hooks), like to replay recorded traffic
+
+        Parameters
+        ----------
+        operation[str]: an operation (like `GetState`)
+        data[dict]: request fields (without `TerminalKey` and signature fields)
+        method[str]: HTTP method
+
+        Returns
+        -------
+        dict: a decoded response (a list response is in `items`)
+
+        Raises
+        ------
+        TinkoffError: when got an error
+        """
+
+        return self._request(method, operation, data=data or {})
+
+    def _bulk_payout_row(self, row):
+        result = {
+            'row': row,
+            'payment_id': None,
+            'status': None,
+            'status_name': None,
+            'error': None,
+        }
+        try:
+            with call_options(priority=get_call_options().get('priority', PRIORITY_BATCH)):
+                payment = self.create_payment(**row)
+                result.update(payment)
+                payment = self.proceed_payment(payment['payment_id'])
+                result.update(payment)
+        except Exception as e:
+            logger.warning('Bulk payout row %s is failed: %s', row.get('order_id'), e)
+            result['error'] = e
+        return result
+
+    def _report_bulk_progress(self, progress, processed, failed, elapsed, total):
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if total is not None and rate > 0:
+            eta = max(total - processed, 0) / rate
+
+        info = {
+            'processed': processed,
+            'failed': failed,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': eta,
+        }
+
+        logger.info('Bulk payout: %d processed, %d failed, %.1f rows/s, ETA %s',
+                    processed, failed, rate, '-' if eta is None else '%.0fs' % eta)
+
+        if progress is not None:
+            progress(info)
+
+    def _get_cache_key(self, kind, key):
+        return 'tinkoff:{}:{}:{}'.format(self.terminal_key, kind, key)
+
     def _process_amount(self, value):
         return int(value * 100)
 
+    def _restore_amount(self, value):
+        return int(value) / 100
+
     def _join_data(self, data):
         return '|'.join(['%s=%s' % (x, data[x]) for x in data])
 
     def _request(self, method, url, **kwargs):
+        with self._acquire_request(url) as profile:
+            return self._exchange(method, url, profile, **kwargs)
+
+    def _request_items(self, method, url, **kwargs):
+        # Slots and limits of a stream request are held until its response is read (or closed)
+        with self._acquire_request(url) as profile:
+            yield from self._exchange_items(method, url, profile, **kwargs)
+
+    @contextmanager
+    def _acquire_request(self, url):
+        # Every request passes the scheduler, the rate limiter, the concurrency limiter and the profiler
+        with self._schedule_request(url), self._limit_request(url), self._profile_request(url) as profile:
+            yield profile
+
+    @contextmanager
+    def _schedule_request(self, url):
+        if self.scheduler is None:
+            yield
+            return
+
+        # A slot is taken before a request is throttled and signed, so a request which deadline
+        # is passed in a queue costs nothing
+        options = get_call_options()
+        try:
+            self.scheduler.acquire(url, options.get('tenant', self.terminal_key), options.get('priority'),
+                                   options.get('deadline'))
+        except SchedulerError as e:
+            raise TinkoffError('Deadline is exceeded') from e
+
+        try:
+            yield
+        finally:
+            self.scheduler.release()
+
+    @contextmanager
+    def _limit_request(self, url):
+        self._throttle(url)
+
+        if self.concurrency_limiter is None:
+            yield
+            return
+
+        try:
+            self.concurrency_limiter.acquire()
+        except Exception as e:
+            raise TinkoffError('Concurrency limit is exceeded') from e
+
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.concurrency_limiter.release(time.monotonic() - started, error)
+
+    @contextmanager
+    def _profile_request(self, url):
+        if self.profiler is None:
+            yield None
+            return
+        with self.profiler.profile(url, self.terminal_key) as profile:
+            yield profile
+
+    def _exchange(self, method, url, profile, **kwargs):
+        # Every finished request is reported to hooks as a record:
+        #   time - a start time (Unix), terminal, operation, method,
+        #   data - request fields of a caller, request_size - a body size in bytes,
+        #   sign_latency, latency - seconds spent on signing and on a request (with decoding),
+        #   result - ok, error or rejected, status - HTTP status, response - a decoded response,
+        #   error - an exception
+        operation = url
+        started = time.monotonic()
         method, url, params = self._prepare_request(method, url, **kwargs)
+        signed = time.monotonic()
+        if profile is not None:
+            profile.mark('sign')
 
-        logger.debug('Request %s to URL %s with args: %s' % (method, url, str(kwargs)))
+        logger.debug('Request %s to URL %s with args: %s', method, url, kwargs)
 
         try:
             result, status, headers = self._proceed_request(method, url, **params)
         except Exception as e:
-            raise TinkoffError('Request is failed') from e
+            self._record_request(operation, started, signed, 'error', method, kwargs, params, error=e)
+            error = TinkoffError('Request is failed')
+            error.in_doubt = True
+            raise error from e
+        finally:
+            if profile is not None:
+                profile.mark('request')
 
-        return self._prepare_response(result, status, headers)
+        try:
+            response = self._prepare_response(result, status, headers)
+        except TinkoffError as e:
+            self._record_request(operation, started, signed, 'rejected', method, kwargs, params, result, status, e)
+            raise
+        finally:
+            if profile is not None:
+                profile.mark('response')
+
+        self._record_request(operation, started, signed, 'ok', method, kwargs, params, result, status)
+        return response
+
+    def _record_request(self, operation, started, signed, result, method, kwargs, params, response=None, status=None,
+                        error=None):
+        finished = time.monotonic()
+
+        if self.metrics is not None:
+            self.metrics.observe('sign_latency', signed - started, terminal=self.terminal_key, operation=operation)
+            self.metrics.observe('request_latency', finished - signed, terminal=self.terminal_key,
+                                 operation=operation)
+            self.metrics.increment('requests', terminal=self.terminal_key, operation=operation, result=result)
+
+        if not self.hooks:
+            return
+
+        if status is None:
+            # A transport error has the HTTP status of a 4xx or 5xx response
+            status = getattr(error, 'status', None)
+        record = {
+            'time': time.time() - (finished - started),
+            'terminal': self.terminal_key,
+            'operation': operation,
+            'method': method,
+            'data': kwargs.get('data') or {},
+            'request_size': len(params['data']),
+            'sign_latency': signed - started,
+            'latency': finished - signed,
+            'result': result,
+            'status': status,
+            'response': response,
+            'error': error,
+        }
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception:
+                logger.exception('Request hook is failed')
+
+    def _exchange_items(self, method, url, profile, **kwargs):
+        # A stream request is reported to hooks like any other one (see `_exchange()`), its items
+        # are collected for the record only when there are hooks, the latency includes reading
+        operation = url
+        started = time.monotonic()
+        method, url, params = self._prepare_request(method, url, **kwargs)
+        signed = time.monotonic()
+        if profile is not None:
+            profile.mark('sign')
 
-    def _prepare_request(self, method, url, **kwargs):
-        kwargs.setdefault('data', {})
-        kwargs.setdefault('headers', {})
+        logger.debug('Stream request %s to URL %s with args: %s', method, url, kwargs)
 
-        kwargs['data'].update({'TerminalKey': self.terminal_key})
-        kwargs['data'].update(self._get_sign(kwargs['data']))
-        kwargs['headers'].update({'Content-Type': 'application/x-www-form-urlencoded'})
-        url = self.url + url
+        try:
+            response = self._proceed_stream_request(method, url, **params)
+        except Exception as e:
+            self._record_request(operation, started, signed, 'error', method, kwargs, params, error=e)
+            error = TinkoffError('Request is failed')
+            error.in_doubt = True
+            raise error from e
+        finally:
+            if profile is not None:
+                profile.mark('request')
+
+        items = [] if self.hooks else None
+        try:
+            try:
+                result = self.decoder.decode_stream(response.iter_content(self.stream_chunk_size))
+            except Exception as e:
+                self._record_request(operation, started, signed, 'error', method, kwargs, params,
+                                     status=response.status, error=e)
+                raise TinkoffError('Request is failed') from e
+
+            if isinstance(result, dict):
+                try:
+                    prepared = self._prepare_response(result, response.status, response.headers)
+                except TinkoffError as e:
+                    self._record_request(operation, started, signed, 'rejected', method, kwargs, params, result,
+                                         response.status, e)
+                    raise
+                self._record_request(operation, started, signed, 'ok', method, kwargs, params, result,
+                                     response.status)
+                yield from prepared.get('items', ())
+                return
+
+            try:
+                for item in result:
+                    if items is not None:
+                        items.append(item)
+                    yield item
+            except ValueError as e:
+                self._record_request(operation, started, signed, 'error', method, kwargs, params, items,
+                                     response.status, e)
+                raise TinkoffError('Request is failed') from e
+            except GeneratorExit:
+                # A caller has stopped reading, the request is done with the items read so far
+                self._record_request(operation, started, signed, 'ok', method, kwargs, params, items,
+                                     response.status)
+                raise
+            self._record_request(operation, started, signed, 'ok', method, kwargs, params, items, response.status)
+        finally:
+            response.close()
+            if profile is not None:
+                profile.mark('response')
+
+    def _throttle(self, operation):
+        if self.rate_limiter is None:
+            return
+
+        # A request is throttled after it's scheduled, so a wait for a token must not outlast its deadline
+        timeout = self.rate_limiter.timeout
+        deadline = get_call_options().get('deadline')
+        by_deadline = False
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if timeout is None or left < timeout:
+                timeout = max(left, 0.0)
+                by_deadline = True
 
-        return method, url, kwargs
+        try:
+            self.rate_limiter.acquire(self.terminal_key, operation, timeout)
+        except Exception as e:
+            raise TinkoffError('Deadline is exceeded' if by_deadline else 'Rate limit is exceeded') from e
+
+    def _prepare_request(self, method, url, data=None, headers=None, **kwargs):
+        # `data` and `headers` of a caller are not changed
+        content, body = self._encode_fields(data)
+
+        sign = None
+        if self.presigned is not None and url in self.presigned.operations:
+            sign = self.presigned.take(content)
+        if sign is None:
+            sign = self._get_sign(content)
+
+        for key, value in sign.items():
+            if value is not None:
+                body.append(key + '=' + quote_plus(value))
+
+        kwargs['data'] = '&'.join(body).encode('utf-8')
+        kwargs['headers'] = dict(headers, **FORM_HEADERS) if headers else FORM_HEADERS
+
+        return method, self.url + url, kwargs
+
+    def _encode_fields(self, data):
+        # Every value is converted to a string once and used both for a signing string
+        # (values in order of keys) and for a form body
+        fields = {'TerminalKey': self.terminal_key}
+        if data:
+            fields.update(data)
+
+        content = []
+        body = []
+        for key in sorted(fields):
+            value = fields[key]
+            if value is None:
+                continue
+            value = value if isinstance(value, str) else str(value)
+            content.append(value)
+            body.append(quote_plus(key) + '=' + quote_plus(value))
+
+        return ''.join(content), body
 
     def _proceed_request(self, method, url, **kwargs):
-        response = requests.request(method, url, **kwargs)
-        response.raise_for_status()
-        return response.json(), response.status_code, response.headers
+        response = self.transport.request(method, url, **kwargs)
+        return self.decoder.loads(response.content), response.status, response.headers
+
+    def _proceed_stream_request(self, method, url, **kwargs):
+        return self.transport.stream(method, url, **kwargs)
 
     def _prepare_response(self, result, status, headers):
         logger.debug('Got response: %s', result)
@@ -476,45 +1404,83 @@ class Tinkoff:
 
         return result
 
-    def _get_sign(self, data):
-        logger.debug('Sign data: %s', data)
-
-        content = ''.join([str(data[x]) for x in sorted(data.keys())])
-
+    def _get_sign(self, content):
         logger.debug('Sign string: %s', content)
 
         try:
-            digest = self.cryptopro.get_hash(content)
-            digest_b64 = self.cryptopro.to_base64(digest)
-        except Exception as e:
-            raise TinkoffError('Cannot generate digest') from e
-
-        logger.debug('Hash: %s', digest_b64)
-
-        try:
-            sign = self.cryptopro.get_sign(digest)
-            sign_b64 = self.cryptopro.to_base64(sign)
-        except Exception as e:
-            raise TinkoffError('Cannot generate signature') from e
-
-        logger.debug('Sign: %s' % (sign_b64,))
-
-        try:
-            serial = self.cryptopro.get_certificate_serial()
+            result = self.signer.sign(content)
+        except SignerError as e:
+            # The code of a signer error is kept in `__cause__`, a sign error has the default code of `TinkoffError`
+            raise TinkoffError(e.message) from e
         except Exception as e:
-            raise TinkoffError('Cannot get certificate serial') from e
+            raise TinkoffError('Cannot sign request') from e
 
-        logger.debug('Serial: %s', serial)
+        logger.debug('Sign: %s', result)
 
-        return {
-            'DigestValue': digest_b64,
-            'SignatureValue': sign_b64,
-            'X509SerialNumber': serial,
-        }
+        return result
 
     @property
     def url(self):
         return self.test_url if self.is_test else self.prod_url
 
 
-__all__ = ('Tinkoff', 'TinkoffError')
+def main(argv=None):
+    """
+    Runs a command line tool:
+
+        python -m tinkoff reconcile LEDGER [options]
+    """
+
+    try:
+        from .cryptopro import CryptoPro
+        from .reconcile import Reconciler, read_ledger
+    except ImportError:
+        from cryptopro import CryptoPro
+        from reconcile import Reconciler, read_ledger
+
+    parser = argparse.ArgumentParser(prog='python -m tinkoff')
+    parser.add_argument('--terminal-key', required=True, help='the terminal key (got from bank)')
+    parser.add_argument('--container', help='CryptoPro container name')
+    parser.add_argument('--store', default='uMy', help='CryptoPro certificate store name')
+    parser.add_argument('--provider', type=int, default=80, help='CryptoPro encryption provider')
+    parser.add_argument('--algorithm', default='GOST12_256', help='CryptoPro sign algorithm')
+    parser.add_argument('--test', action='store_true', help='use test endpoint')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    reconcile = commands.add_parser('reconcile', help='compare a ledger with payment states')
+    reconcile.add_argument('ledger', help='a CSV or JSONL file with payment_id, amount and optional status')
+    reconcile.add_argument('--report', default='-', help='a mismatch report file (stdout by default)')
+    reconcile.add_argument('--watermark', help='a file to keep the number of rows known to be terminal')
+    reconcile.add_argument('--concurrency', type=int, default=8, help='a number of simultaneous requests')
+    reconcile.add_argument('--chunk-size', type=int, default=1000, help='a number of rows compared at once')
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    cryptopro = CryptoPro(
+        container_name=args.container,
+        store_name=args.store,
+        encryption_provider=args.provider,
+        sign_algorithm=args.algorithm,
+    )
+    tinkoff = Tinkoff(args.terminal_key, cryptopro, is_test=args.test)
+
+    reconciler = Reconciler(tinkoff, args.concurrency, args.chunk_size, args.watermark)
+    report = sys.stdout if args.report == '-' else open(args.report, 'w', newline='', encoding='utf-8')
+    try:
+        summary = reconciler.reconcile(read_ledger(args.ledger), report)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+
+    print(' '.join('{}={}'.format(k, v) for k, v in summary.items()), file=sys.stderr)
+    return 1 if summary['mismatches'] or summary['errors'] else 0
+
+
+__all__ = ('Tinkoff', 'TinkoffError', 'JSONDecoder', 'OrjsonDecoder', 'Payment', 'PaymentStatus', 'Card', 'CardStatus', 'CardType', 'Client', 'CardRequest', 'RemovedCard')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import logging
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlencode
+
+import requests
+import urllib3
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(Exception):
+    def __init__(self, message, code=-1):
+        super().__init__(message, code)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return '{}: {}'.format(self.code, self.message)
+
+    @property
+    def status(self):
+        return self.code
+
+
+class Response:
+    """
+    A transport response:
+        - status[int] - HTTP status
+        - headers[Mapping] - case-insensitive headers
+        - content[bytes] - a body (None for streamed responses)
+    """
+
+    __slots__ = ('status', 'headers', 'content', '_iter_content', '_close')
+
+    def __init__(self, status, headers, content=None, iter_content=None, close=None):
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self._iter_content = iter_content
+        self._close = close
+
+    def iter_content(self, chunk_size):
+        """
+        Iterates over body chunks of a streamed response
+        """
+
+        if self._iter_content is None:
+            return iter((self.content,))
+        return self._iter_content(chunk_size)
+
+    def close(self):
+        """
+        Releases a connection of a streamed response
+        """
+
+        if self._close is not None:
+            self._close()
+
+
+class Transport:
+    """
+    A base class for HTTP transports used by `Tinkoff`
+
+    A transport is shared by all threads which use a `Tinkoff` instance, so it must be thread-safe.
+
+    Methods
+    -------
+    request()
+        send a request and read a whole response
+    stream()
+        send a request and get a response which body is read by chunks
+    close()
+        close connections
+    """
+
+    def request(self, method, url, data=None, headers=None, allow_redirects=True):
+        """
+        Sends a request and reads a whole response
+
+        Parameters
+        ----------
+        method[str]: HTTP method
+        url[str]: URL
+        data[dict, bytes]: a form body
+        headers[dict]: request headers
+        allow_redirects[bool]: follow 3xx responses (otherwise a 3xx response is returned as is)
+
+        Returns
+        -------
+        Response: a response
+
+        Raises
+        ------
+        TransportError: when got a 4xx or 5xx status
+        """
+
+        raise NotImplementedError
+
+    def stream(self, method, url, data=None, headers=None, allow_redirects=True):
+        """
+        Sends a request and returns a response which body is read with `iter_content()`,
+        the response must be closed
+
+        Parameters
+        ----------
+        see `request()`
+
+        Returns
+        -------
+        Response: a response
+
+        Raises
+        ------
+        TransportError: when got a 4xx or 5xx status
+        """
+
+        return self.request(method, url, data=data, headers=headers, allow_redirects=allow_redirects)
+
+    def close(self):
+        """
+        Closes connections
+        """
+
+    def _check_status(self, status, close=None):
+        if status >= 400:
+            if close is not None:
+                close()
+            raise TransportError('Got HTTP status {}'.format(status), status)
+
+
+class RequestsTransport(Transport):
+    """
+    An HTTP/1.1 transport based on `requests` with keep-alive connections
+    """
+
+    def __init__(self, pool_size=10, timeout=None):
+        """
+        Parameters
+        ----------
+        pool_size[int]: a maximum number of kept connections per host
+        timeout[float]: connect and read timeout in seconds (unlimited by default)
+        """
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Cookies of one response must not be sent with requests of other threads
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, data=None, headers=None, allow_redirects=True):
+        response = self.session.request(method, url, data=data, headers=headers,
+                                        allow_redirects=allow_redirects, timeout=self.timeout)
+        self._check_status(response.status_code)
+        return Response(response.status_code, response.headers, response.content)
+
+    def stream(self, method, url, data=None, headers=None, allow_redirects=True):
+        response = self.session.request(method, url, data=data, headers=headers,
+                                        allow_redirects=allow_redirects, timeout=self.timeout, stream=True)
+        self._check_status(response.status_code, response.close)
+        return Response(response.status_code, response.headers,
+                        iter_content=response.iter_content, close=response.close)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """
+    A lean HTTP/1.1 transport based on a `urllib3` connection pool
+
+    It skips `requests` machinery (hooks, adapters, cookies): a form body is encoded once,
+    default headers are shared between requests and a body is returned without copying.
+    """
+
+    headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Accept': 'application/json',
+    }
+
+    def __init__(self, pool_size=10, timeout=None):
+        """
+        Parameters
+        ----------
+        pool_size[int]: a maximum number of kept connections per host
+        timeout[float]: connect and read timeout in seconds (unlimited by default)
+        """
+
+        self.pool = urllib3.PoolManager(maxsize=pool_size, timeout=urllib3.Timeout(connect=timeout, read=timeout))
+        self._follow = urllib3.Retry(total=None, connect=0, read=0, status=0, other=0, redirect=10,
+                                     raise_on_redirect=False)
+        self._no_follow = urllib3.Retry(total=None, connect=0, read=0, status=0, other=0, redirect=0,
+                                        raise_on_redirect=False)
+
+    def request(self, method, url, data=None, headers=None, allow_redirects=True):
+        response = self.pool.urlopen(
+            method, url,
+            body=self._encode(data),
+            headers=self._merge_headers(headers),
+            redirect=allow_redirects,
+            retries=self._follow if allow_redirects else self._no_follow,
+        )
+        self._check_status(response.status)
+        return Response(response.status, response.headers, response.data)
+
+    def stream(self, method, url, data=None, headers=None, allow_redirects=True):
+        response = self.pool.urlopen(
+            method, url,
+            body=self._encode(data),
+            headers=self._merge_headers(headers),
+            redirect=allow_redirects,
+            retries=self._follow if allow_redirects else self._no_follow,
+            preload_content=False,
+        )
+
+        def close():
+            response.drain_conn()
+            response.release_conn()
+
+        self._check_status(response.status, close)
+        return Response(response.status, response.headers, iter_content=response.stream, close=close)
+
+    def close(self):
+        self.pool.clear()
+
+    def _encode(self, data):
+        if isinstance(data, dict):
+            return urlencode(data).encode('utf-8')
+        return data
+
+    def _merge_headers(self, headers):
+        if not headers or all(self.headers.get(k) == v for k, v in headers.items()):
+            return self.headers
+        return dict(self.headers, **headers)
+
+
+class HTTP2Transport(Transport):
+    """
+    An HTTP/2 transport based on `httpx` (`pip install httpx[http2]`)
+
+    Concurrent requests are multiplexed as streams over a few connections
+    instead of a connection per request.
+    """
+
+    def __init__(self, max_connections=4, timeout=None, http1=True):
+        """
+        Parameters
+        ----------
+        max_connections[int]: a maximum number of connections per host
+        timeout[float]: connect and read timeout in seconds (unlimited by default)
+        http1[bool]: allow HTTP/1.1 when a server doesn't negotiate HTTP/2
+            (use False for HTTP/2 without TLS, like for local stubs)
+        """
+
+        if httpx is None:
+            raise ImportError('HTTP2Transport requires httpx: pip install httpx[http2]')
+
+        self.client = httpx.Client(
+            http1=http1,
+            http2=True,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def request(self, method, url, data=None, headers=None, allow_redirects=True):
+        response = self.client.request(method, url, content=self._encode(data), headers=headers,
+                                       follow_redirects=allow_redirects)
+        self._check_status(response.status_code)
+        return Response(response.status_code, response.headers, response.content)
+
+    def stream(self, method, url, data=None, headers=None, allow_redirects=True):
+        request = self.client.build_request(method, url, content=self._encode(data), headers=headers)
+        response = self.client.send(request, stream=True, follow_redirects=allow_redirects)
+        self._check_status(response.status_code, response.close)
+        return Response(response.status_code, response.headers,
+                        iter_content=response.iter_bytes, close=response.close)
+
+    def close(self):
+        self.client.close()
+
+    def _encode(self, data):
+        if isinstance(data, dict):
+            return urlencode(data, doseq=True).encode('ascii')
+        return data
+
+
+__all__ = ('Transport', 'TransportError', 'Response', 'RequestsTransport', 'Urllib3Transport', 'HTTP2Transport')
@@ -0,0 +1,464 @@
+import os
+import time
+import uuid
+import bisect
+import socket
+import sqlite3
+import hashlib
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .tinkoff import TERMINAL_PAYMENT_STATUSES
+except ImportError:
+    from tinkoff import TERMINAL_PAYMENT_STATUSES
+
+
+logger = logging.getLogger(__name__)
+
+
+RING_SIZE = 1 << 32
+
+
+def get_slot(key):
+    """
+    Returns a position of a key on a hash ring
+
+    Parameters
+    ----------
+    key[str]: a key
+
+    Returns
+    -------
+    int: a position in [0, 2^32)
+    """
+
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=4).digest(), 'big')
+
+
+class HashRing:
+    """
+    A consistent hash ring: when a node joins or leaves, only keys of its neighbours are moved
+
+    Methods
+    -------
+    get_node()
+        get a node which owns a slot
+    get_ranges()
+        get slot ranges which are owned by a node
+    """
+
+    def __init__(self, nodes, replicas=64):
+        """
+        Parameters
+        ----------
+        nodes[iterable]: node ids
+        replicas[int]: a number of points of every node on the ring
+        """
+
+        points = sorted((get_slot('{}#{}'.format(node, i)), node) for node in set(nodes) for i in range(replicas))
+        self._slots = [x[0] for x in points]
+        self._nodes = [x[1] for x in points]
+
+    def get_node(self, slot):
+        """
+        Returns a node which owns a slot (the first point clockwise)
+
+        Parameters
+        ----------
+        slot[int]: a slot (see `get_slot()`)
+
+        Returns
+        -------
+        str: a node id (None when the ring is empty)
+        """
+
+        if not self._slots:
+            return None
+        index = bisect.bisect_left(self._slots, slot)
+        return self._nodes[index % len(self._nodes)]
+
+    def get_ranges(self, node):
+        """
+        Returns slot ranges which are owned by a node, adjacent ranges are merged
+
+        Parameters
+        ----------
+        node[str]: a node id
+
+        Returns
+        -------
+        list: (start, end) tuples, a range includes slots `start < slot <= end`
+        """
+
+        ranges = []
+        count = len(self._slots)
+        for index in range(count):
+            if self._nodes[index] != node:
+                continue
+            start = self._slots[index - 1] if index else self._slots[-1] - RING_SIZE
+            end = self._slots[index]
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+
+class PaymentWatcher:
+    """
+    Polls states of payments on several nodes (hosts or processes) which share a SQLite database
+
+    Watched payments are split between live nodes by a consistent hash ring of their `PaymentId`s,
+    so every node polls only its own share and the ring is rebalanced when nodes join or leave.
+    A node polls a payment only with a time-limited lease, so a payment is never polled by two nodes
+    at once even while their views of the ring differ. Leases of a batch and the heartbeat are renewed
+    in background while the batch is polled, so a slow batch keeps them. Payments in a terminal state are removed.
+    A node is considered as left when it has no heartbeat for `lease_ttl` seconds.
+    With `presign_ahead` and a client with a `PresignedStore`, a node signs `GetState` requests
+    of its payments which are due within `presign_ahead` seconds while it waits between polls,
+    so a poll only sends requests.
+
+    Methods
+    -------
+    add()
+        start watching payments
+    remove()
+        stop watching payments
+    poll()
+        poll due payments of this node once
+    presign()
+        sign requests of payments which are due soon
+    run()
+        poll due payments until stopped
+    leave()
+        leave the ring and release leases
+    """
+
+    def __init__(self, tinkoff, path, node_id=None, poll_interval=5.0, lease_ttl=30.0, replicas=64,
+                 batch_size=100, concurrency=4, callback=None, presign_ahead=None):
+        """
+        Parameters
+        ----------
+        tinkoff[Tinkoff]: Tinkoff instance
+        path[str]: a database file path shared by all nodes (a local or a network file system with locks)
+        node_id[str]: a unique node id (a host name, a process id and a random suffix by default)
+        poll_interval[float]: seconds between polls of a payment
+        lease_ttl[float]: seconds a lease and a heartbeat are valid for
+        replicas[int]: a number of points of every node on the ring
+        batch_size[int]: a maximum number of payments polled at once
+        concurrency[int]: a number of simultaneous `GetState` requests
+        callback[callable]: a function which takes a polled `Payment`
+        presign_ahead[float]: seconds before a poll to sign its request in advance
+            (`tinkoff` must have a `PresignedStore`, disabled by default)
+        """
+
+        self.tinkoff = tinkoff
+        self.path = path
+        self.node_id = node_id or '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.replicas = replicas
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.callback = callback
+        self.presign_ahead = presign_ahead
+
+        self._lock = threading.Lock()
+        self._ring = None
+        self._ring_nodes = None
+
+        self._connection = sqlite3.connect(path, timeout=lease_ttl, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS watched ('
+            'payment_id TEXT PRIMARY KEY, '
+            'slot INTEGER NOT NULL, '
+            'status TEXT, '
+            'next_poll REAL NOT NULL, '
+            'lease_node TEXT, '
+            'lease_expires REAL NOT NULL DEFAULT 0)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS watched_slot ON watched (slot)')
+
+        self.heartbeat()
+
+    def add(self, payment_ids, status=None):
+        """
+        Starts watching payments (they are polled as soon as possible)
+
+        Parameters
+        ----------
+        payment_ids[iterable]: `PaymentId`s
+        status[str]: a known status
+        """
+
+        rows = [(str(x), get_slot(x), status) for x in payment_ids]
+        with self._lock:
+            self._execute_many(
+                'INSERT OR IGNORE INTO watched (payment_id, slot, status, next_poll) VALUES (?, ?, ?, 0)', rows
+            )
+
+    def remove(self, payment_ids):
+        """
+        Stops watching payments
+
+        Parameters
+        ----------
+        payment_ids[iterable]: `PaymentId`s
+        """
+
+        with self._lock:
+            self._execute_many('DELETE FROM watched WHERE payment_id = ?', [(str(x),) for x in payment_ids])
+
+    def heartbeat(self):
+        """
+        Marks the node as live and forgets nodes which have no heartbeat for `lease_ttl` seconds
+
+        Returns
+        -------
+        list: ids of live nodes
+        """
+
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('INSERT OR REPLACE INTO nodes (node_id, heartbeat) VALUES (?, ?)', (self.node_id, now))
+                cursor.execute('DELETE FROM nodes WHERE heartbeat < ?', (now - self.lease_ttl,))
+                nodes = sorted(x[0] for x in cursor.execute('SELECT node_id FROM nodes'))
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+            if nodes != self._ring_nodes:
+                logger.info('Node %s sees %d nodes: %s', self.node_id, len(nodes), ', '.join(nodes))
+                self._ring = HashRing(nodes, self.replicas)
+                self._ring_nodes = nodes
+        return nodes
+
+    def poll(self):
+        """
+        Polls due payments of this node once
+
+        Returns
+        -------
+        list: polled `Payment`s
+        """
+
+        self.heartbeat()
+        payment_ids = self._acquire()
+        if not payment_ids:
+            return []
+
+        done = threading.Event()
+        keeper = threading.Thread(target=self._keep_leases, args=(payment_ids, done), daemon=True)
+        keeper.start()
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(payment_ids))) as executor:
+                results = list(executor.map(self._get_payment, payment_ids))
+        finally:
+            done.set()
+            keeper.join()
+
+        payments = [x for x in results if x is not None]
+        self._release(payment_ids, payments)
+
+        if self.callback is not None:
+            for payment in payments:
+                try:
+                    self.callback(payment)
+                except Exception:
+                    logger.exception('Watcher callback is failed')
+
+        return payments
+
+    def presign(self):
+        """
+        Signs `GetState` requests of payments of this node which are due within `presign_ahead` seconds
+
+        Returns
+        -------
+        int: a number of signed requests
+        """
+
+        if not self.presign_ahead or self.tinkoff.presigned is None:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            condition, params = self._get_slot_condition()
+            if condition is None:
+                return 0
+            payment_ids = [x[0] for x in self._connection.execute(
+                'SELECT payment_id FROM watched WHERE next_poll <= ? AND ({}) ORDER BY next_poll LIMIT ?'.format(
+                    condition),
+                [now + self.presign_ahead] + params + [self.batch_size],
+            )]
+
+        try:
+            return self.tinkoff.presign(payment_ids)
+        except Exception as e:
+            logger.warning('Cannot presign payments: %s', e)
+            return 0
+
+    def run(self, stop=None):
+        """
+        Polls due payments until stopped, then leaves the ring
+
+        Parameters
+        ----------
+        stop[threading.Event]: an event to stop polling
+        """
+
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                try:
+                    payments = self.poll()
+                except Exception:
+                    logger.exception('Watcher poll is failed')
+                    payments = None
+                if not payments:
+                    started = time.monotonic()
+                    self.presign()
+                    stop.wait(max(min(self.poll_interval, self.lease_ttl / 3) - (time.monotonic() - started), 0))
+        finally:
+            self.leave()
+
+    def leave(self):
+        """
+        Leaves the ring and releases leases of this node, so other nodes take its payments at once
+        """
+
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('DELETE FROM nodes WHERE node_id = ?', (self.node_id,))
+                cursor.execute('UPDATE watched SET lease_node = NULL, lease_expires = 0 WHERE lease_node = ?',
+                               (self.node_id,))
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+            self._ring_nodes = None
+
+    def close(self):
+        """
+        Leaves the ring and closes the database
+        """
+
+        self.leave()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _acquire(self):
+        now = time.time()
+        with self._lock:
+            condition, params = self._get_slot_condition()
+            if condition is None:
+                return []
+
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                payment_ids = [x[0] for x in cursor.execute(
+                    'SELECT payment_id FROM watched WHERE next_poll <= ? AND lease_expires <= ? AND ({}) '
+                    'ORDER BY next_poll LIMIT ?'.format(condition),
+                    [now, now] + params + [self.batch_size],
+                )]
+                cursor.executemany(
+                    'UPDATE watched SET lease_node = ?, lease_expires = ? WHERE payment_id = ?',
+                    [(self.node_id, now + self.lease_ttl, x) for x in payment_ids],
+                )
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+        return payment_ids
+
+    def _keep_leases(self, payment_ids, done):
+        # A batch may be polled longer than `lease_ttl`, so leases and the heartbeat are renewed till it's done
+        while not done.wait(self.lease_ttl / 3):
+            try:
+                self.heartbeat()
+                self._renew(payment_ids)
+            except Exception:
+                logger.exception('Cannot renew leases of node %s', self.node_id)
+
+    def _renew(self, payment_ids):
+        lease_expires = time.time() + self.lease_ttl
+        with self._lock:
+            self._execute_many(
+                'UPDATE watched SET lease_expires = ? WHERE payment_id = ? AND lease_node = ?',
+                [(lease_expires, x, self.node_id) for x in payment_ids],
+            )
+
+    def _get_slot_condition(self):
+        # A condition on slots owned by this node and its params (None when the node owns nothing)
+        ranges = self._ring.get_ranges(self.node_id)
+        if not ranges:
+            return None, []
+
+        condition = ' OR '.join(
+            'slot > ? AND slot <= ?' if start >= 0 else '(slot > ? OR slot <= ?)' for start, _ in ranges
+        )
+        params = []
+        for start, end in ranges:
+            params.extend((start + RING_SIZE, end) if start < 0 else (start, end))
+        return condition, params
+
+    def _release(self, payment_ids, payments):
+        next_poll = time.time() + self.poll_interval
+        statuses = {str(x['payment_id']): str(x['status']) for x in payments}
+        finished = [(x,) for x, status in statuses.items() if status in TERMINAL_PAYMENT_STATUSES]
+        updated = [(statuses.get(x), next_poll, x, self.node_id) for x in payment_ids
+                   if statuses.get(x) not in TERMINAL_PAYMENT_STATUSES]
+
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.executemany('DELETE FROM watched WHERE payment_id = ?', finished)
+                cursor.executemany(
+                    'UPDATE watched SET status = COALESCE(?, status), next_poll = ?, lease_node = NULL, '
+                    'lease_expires = 0 WHERE payment_id = ? AND lease_node = ?',
+                    updated,
+                )
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+        logger.debug('Node %s polled %d payments, %d finished', self.node_id, len(payment_ids), len(finished))
+
+    def _get_payment(self, payment_id):
+        try:
+            return self.tinkoff.get_payment(payment_id)
+        except Exception as e:
+            logger.warning('Cannot get payment %s: %s', payment_id, e)
+            return None
+
+    def _execute_many(self, query, rows):
+        cursor = self._connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.executemany(query, rows)
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+
+__all__ = ('PaymentWatcher', 'HashRing')